@@ -1,11 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import func, or_
+from sqlalchemy import JSON, Integer, any_, delete, func, literal, literal_column, or_, type_coerce
+from sqlalchemy.dialects.postgresql import ARRAY, aggregate_order_by, insert as pg_insert
+from datetime import datetime
 from typing import Optional, List
 from pydantic import BaseModel, Field
 
 from app.core.database import get_db
+from app.core.serialization import FastJSONResponse
+from app.services.catalog_cache import bump_catalog_version, cached_json_response
+from app.services.product_queries import CATEGORY_PRODUCT_FIELDS, as_dicts, columns, parse_fields
 from app.domain.models import Category, ProductCategory, Product, ProductLocation, Location
 
 router = APIRouter()
@@ -36,25 +41,28 @@ class AddProductsToCategory(BaseModel):
 # --- Endpoints ---
 
 @router.get("")
-async def get_categories(db: AsyncSession = Depends(get_db)):
-    stmt = (
-        select(Category, func.count(ProductCategory.id).label("product_count"))
-        .outerjoin(ProductCategory, Category.id == ProductCategory.category_id)
-        .group_by(Category.id)
-        .order_by(Category.name.asc())
-    )
-    result = await db.execute(stmt)
-    return [
-        {
-            "id": cat.id,
-            "name": cat.name,
-            "description": cat.description,
-            "color": cat.color,
-            "created_at": cat.created_at,
-            "product_count": count,
-        }
-        for cat, count in result.all()
-    ]
+async def get_categories(request: Request, db: AsyncSession = Depends(get_db)):
+    async def build():
+        stmt = (
+            select(Category, func.count(ProductCategory.id).label("product_count"))
+            .outerjoin(ProductCategory, Category.id == ProductCategory.category_id)
+            .group_by(Category.id)
+            .order_by(Category.name.asc())
+        )
+        result = await db.execute(stmt)
+        return [
+            {
+                "id": cat.id,
+                "name": cat.name,
+                "description": cat.description,
+                "color": cat.color,
+                "created_at": cat.created_at,
+                "product_count": count,
+            }
+            for cat, count in result.all()
+        ]
+
+    return await cached_json_response(request, db, build)
 
 
 @router.post("")
@@ -72,6 +80,7 @@ async def create_category(data: CategoryCreate, db: AsyncSession = Depends(get_d
         color=data.color.strip() if data.color else "blue",
     )
     db.add(category)
+    await bump_catalog_version(db)
     await db.commit()
     await db.refresh(category)
     return {"id": category.id, "name": category.name}
@@ -122,58 +131,94 @@ async def search_products_for_category(
     ]
 
 
+# Columnas por las que se puede ordenar el detalle
+CATEGORY_DETAIL_SORT = {"name", "sku", "price", "selling_price", "added_at"}
+
+
+def locations_json():
+    """Ubicaciones de cada producto como arreglo JSON (subconsulta correlacionada)."""
+    return type_coerce(
+        select(
+            func.coalesce(
+                func.json_agg(
+                    aggregate_order_by(
+                        func.json_build_object(
+                            "code", Location.code, "quantity", ProductLocation.quantity
+                        ),
+                        Location.code.asc(),
+                    )
+                ),
+                literal_column("'[]'::json"),
+            )
+        )
+        .select_from(ProductLocation)
+        .join(Location, ProductLocation.location_id == Location.id)
+        .where(ProductLocation.product_id == Product.id)
+        .scalar_subquery(),
+        JSON,
+    ).label("locations")
+
+
 @router.get("/{category_id}")
-async def get_category_detail(category_id: int, db: AsyncSession = Depends(get_db)):
-    category = await db.get(Category, category_id)
-    if not category:
+async def get_category_detail(
+    category_id: int,
+    fields: Optional[str] = None,
+    sort_by: str = "name",
+    sort_order: str = "asc",
+    limit: Optional[int] = None,
+    offset: int = 0,
+    db: AsyncSession = Depends(get_db),
+):
+    keys = parse_fields(fields, CATEGORY_PRODUCT_FIELDS, extra=("locations",))
+    if sort_by not in CATEGORY_DETAIL_SORT:
+        sort_by = "name"
+    if sort_order not in ("asc", "desc"):
+        sort_order = "asc"
+
+    # 1. Categoría + total de productos en una sola consulta
+    count = (
+        select(func.count())
+        .where(ProductCategory.category_id == Category.id)
+        .scalar_subquery()
+    )
+    row = (
+        await db.execute(
+            select(Category, count.label("product_count")).where(Category.id == category_id)
+        )
+    ).first()
+    if not row:
         raise HTTPException(404, "Categoría no encontrada")
+    category, product_count = row
 
+    # 2. Productos de la página, con sus ubicaciones agregadas en la misma consulta
+    cols = columns(CATEGORY_PRODUCT_FIELDS, [k for k in CATEGORY_PRODUCT_FIELDS if k in keys])
+    if "locations" in keys:
+        cols.append(locations_json())
+    sort_col = CATEGORY_PRODUCT_FIELDS[sort_by]
     stmt = (
-        select(ProductCategory, Product)
+        select(*cols)
+        .select_from(ProductCategory)
         .join(Product, ProductCategory.product_id == Product.id)
         .where(ProductCategory.category_id == category_id)
-        .order_by(Product.name.asc())
-    )
-    result = await db.execute(stmt)
-
-    products = []
-    for pc, p in result.all():
-        # Get locations for each product
-        loc_stmt = (
-            select(ProductLocation, Location)
-            .join(Location, ProductLocation.location_id == Location.id)
-            .where(ProductLocation.product_id == p.id)
-            .order_by(Location.code.asc())
+        .order_by(
+            sort_col.desc() if sort_order == "desc" else sort_col.asc(),
+            Product.id.asc(),
         )
-        loc_result = await db.execute(loc_stmt)
-        locs = [
-            {"code": loc.code, "quantity": pl.quantity}
-            for pl, loc in loc_result.all()
-        ]
-
-        products.append({
-            "id": pc.id,
-            "product_id": p.id,
-            "name": p.name,
-            "sku": p.sku or "",
-            "upc": p.upc or "",
-            "alias": p.alias or "",
-            "image_url": p.image_url or "",
-            "price": p.price,
-            "selling_price": p.selling_price,
-            "locations": locs,
-            "added_at": pc.added_at,
-        })
+        .offset(max(offset, 0))
+    )
+    if limit is not None:
+        stmt = stmt.limit(min(max(limit, 1), 500))
+    products = as_dicts((await db.execute(stmt)).all())
 
-    return {
+    return FastJSONResponse({
         "id": category.id,
         "name": category.name,
         "description": category.description,
         "color": category.color,
         "created_at": category.created_at,
         "products": products,
-        "product_count": len(products),
-    }
+        "product_count": product_count,
+    })
 
 
 @router.put("/{category_id}")
@@ -202,6 +247,7 @@ async def update_category(
     if data.color is not None:
         category.color = data.color.strip()
 
+    await bump_catalog_version(db)
     await db.commit()
     return {"message": "Categoría actualizada"}
 
@@ -213,6 +259,7 @@ async def delete_category(category_id: int, db: AsyncSession = Depends(get_db)):
         raise HTTPException(404, "Categoría no encontrada")
 
     await db.delete(category)
+    await bump_catalog_version(db)
     await db.commit()
     return {"message": "Categoría eliminada"}
 
@@ -225,22 +272,55 @@ async def add_products_to_category(
     if not category:
         raise HTTPException(404, "Categoría no encontrada")
 
-    added = 0
-    for pid in data.product_ids:
-        existing = await db.execute(
-            select(ProductCategory).where(
-                ProductCategory.category_id == category_id,
-                ProductCategory.product_id == pid,
-            )
+    # Un solo INSERT ... SELECT: ignora ids inexistentes y asignaciones repetidas
+    ids = sorted(set(data.product_ids))
+    stmt = (
+        pg_insert(ProductCategory)
+        .from_select(
+            ["category_id", "product_id", "added_at"],
+            select(literal(category_id), Product.id, literal(datetime.utcnow())).where(
+                Product.id == any_(literal(ids, ARRAY(Integer)))
+            ),
+        )
+        .on_conflict_do_nothing(index_elements=["category_id", "product_id"])
+    )
+    added = (await db.execute(stmt)).rowcount or 0
+
+    if added:
+        await bump_catalog_version(db)
+    await db.commit()
+    return {
+        "message": f"{added} producto(s) agregado(s)",
+        "added": added,
+        "skipped": len(ids) - added,
+    }
+
+
+@router.post("/{category_id}/products/remove")
+async def remove_products_from_category(
+    category_id: int, data: AddProductsToCategory, db: AsyncSession = Depends(get_db)
+):
+    category = await db.get(Category, category_id)
+    if not category:
+        raise HTTPException(404, "Categoría no encontrada")
+
+    ids = sorted(set(data.product_ids))
+    result = await db.execute(
+        delete(ProductCategory).where(
+            ProductCategory.category_id == category_id,
+            ProductCategory.product_id == any_(literal(ids, ARRAY(Integer))),
         )
-        if not existing.scalar_one_or_none():
-            product = await db.get(Product, pid)
-            if product:
-                db.add(ProductCategory(category_id=category_id, product_id=pid))
-                added += 1
+    )
+    removed = result.rowcount or 0
 
+    if removed:
+        await bump_catalog_version(db)
     await db.commit()
-    return {"message": f"{added} producto(s) agregado(s)", "added": added}
+    return {
+        "message": f"{removed} producto(s) removido(s)",
+        "removed": removed,
+        "skipped": len(ids) - removed,
+    }
 
 
 @router.delete("/{category_id}/products/{product_id}")
@@ -258,5 +338,6 @@ async def remove_product_from_category(
         raise HTTPException(404, "Producto no encontrado en esta categoría")
 
     await db.delete(item)
+    await bump_catalog_version(db)
     await db.commit()
     return {"message": "Producto removido de la categoría"}
@@ -0,0 +1,281 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy import func
+from typing import Optional, List
+from datetime import datetime
+from pydantic import BaseModel, Field
+
+from app.core.database import get_db
+from app.core.serialization import FastJSONResponse
+from app.services.catalog_cache import bump_catalog_version
+from app.services.cycle_counts import (
+    BATCH_MODES,
+    aggregate_counts,
+    close_cycle_count,
+    register_batch,
+    upsert_entries,
+)
+from app.services.location_scans import get_scan_index, normalize_location_code, normalize_product_code
+from app.domain.models import (
+    CycleCount,
+    CycleCountBatch,
+    CycleCountEntry,
+    CycleCountLocation,
+    Location,
+    Product,
+    ProductLocation,
+)
+
+router = APIRouter()
+
+
+class CycleCountCreate(BaseModel):
+    location_ids: List[int] = Field(..., min_length=1, max_length=500)
+    notes: Optional[str] = Field(None, max_length=500)
+
+
+class CountLine(BaseModel):
+    location_id: Optional[int] = None
+    location_code: Optional[str] = Field(None, max_length=50)
+    product_id: Optional[int] = None
+    code: Optional[str] = Field(None, max_length=100)  # UPC o SKU escaneado
+    quantity: int = Field(1, ge=0, le=999999)
+
+
+class CountBatch(BaseModel):
+    batch_id: str = Field(..., min_length=1, max_length=100)  # Generado por el dispositivo
+    mode: str = "set"
+    device: Optional[str] = Field(None, max_length=100)
+    entries: List[CountLine] = Field(..., min_length=1, max_length=10000)
+
+
+def cycle_count_to_dict(c: CycleCount) -> dict:
+    return {
+        "id": c.id,
+        "status": c.status,
+        "notes": c.notes,
+        "created_at": c.created_at,
+        "closed_at": c.closed_at,
+        "variance_lines": c.variance_lines or 0,
+        "units_over": c.units_over or 0,
+        "units_short": c.units_short or 0,
+    }
+
+
+async def get_open_count(db: AsyncSession, count_id: int) -> CycleCount:
+    """Sesión bloqueada hasta el commit: lotes y cierre no se cruzan."""
+    count = (
+        await db.execute(select(CycleCount).where(CycleCount.id == count_id).with_for_update())
+    ).scalar_one_or_none()
+    if not count:
+        raise HTTPException(404, "Conteo no encontrado")
+    if count.status != "open":
+        raise HTTPException(400, "El conteo ya no está abierto")
+    return count
+
+
+# --- 1. SESIONES ---
+@router.post("")
+async def create_cycle_count(data: CycleCountCreate, db: AsyncSession = Depends(get_db)):
+    ids = sorted(set(data.location_ids))
+    found = set((await db.execute(select(Location.id).where(Location.id.in_(ids)))).scalars().all())
+    if len(found) != len(ids):
+        missing = ", ".join(str(i) for i in ids if i not in found)
+        raise HTTPException(404, f"Ubicaciones no encontradas: {missing}")
+
+    busy = (
+        await db.execute(
+            select(CycleCountLocation.location_id)
+            .join(CycleCount, CycleCount.id == CycleCountLocation.cycle_count_id)
+            .where(CycleCount.status == "open", CycleCountLocation.location_id.in_(ids))
+        )
+    ).scalars().all()
+    if busy:
+        raise HTTPException(400, f"Ubicaciones con un conteo abierto: {', '.join(map(str, sorted(busy)))}")
+
+    count = CycleCount(status="open", notes=data.notes.strip() if data.notes else None)
+    db.add(count)
+    await db.flush()
+    db.add_all([CycleCountLocation(cycle_count_id=count.id, location_id=i) for i in ids])
+    await db.commit()
+    await db.refresh(count)
+    return {**cycle_count_to_dict(count), "location_ids": ids}
+
+
+@router.get("")
+async def get_cycle_counts(
+    status: Optional[str] = None, limit: int = 50, offset: int = 0, db: AsyncSession = Depends(get_db)
+):
+    stmt = select(CycleCount)
+    if status:
+        stmt = stmt.where(CycleCount.status == status)
+    result = await db.execute(
+        stmt.order_by(CycleCount.id.desc()).limit(min(max(limit, 1), 200)).offset(max(offset, 0))
+    )
+    return [cycle_count_to_dict(c) for c in result.scalars().all()]
+
+
+@router.get("/{count_id}")
+async def get_cycle_count(count_id: int, db: AsyncSession = Depends(get_db)):
+    """Sesión con avance por ubicación y lotes recibidos (para reanudar envíos)."""
+    count = await db.get(CycleCount, count_id)
+    if not count:
+        raise HTTPException(404, "Conteo no encontrado")
+
+    E = CycleCountEntry
+    progress = (
+        await db.execute(
+            select(
+                Location.id,
+                Location.code,
+                func.count(E.product_id),
+                func.coalesce(func.sum(E.counted), 0),
+            )
+            .join(CycleCountLocation, CycleCountLocation.location_id == Location.id)
+            .outerjoin(E, (E.cycle_count_id == count_id) & (E.location_id == Location.id))
+            .where(CycleCountLocation.cycle_count_id == count_id)
+            .group_by(Location.id, Location.code)
+            .order_by(Location.code)
+        )
+    ).all()
+    batches = (
+        await db.execute(
+            select(CycleCountBatch.batch_id)
+            .where(CycleCountBatch.cycle_count_id == count_id)
+            .order_by(CycleCountBatch.received_at)
+        )
+    ).scalars().all()
+    return FastJSONResponse({
+        **cycle_count_to_dict(count),
+        "locations": [
+            {"location_id": lid, "code": code, "lines": lines, "units": int(units)}
+            for lid, code, lines, units in progress
+        ],
+        "batches": batches,
+    })
+
+
+# --- 2. ENVÍO DE LOTES ---
+@router.post("/{count_id}/batches")
+async def submit_count_batch(count_id: int, data: CountBatch, db: AsyncSession = Depends(get_db)):
+    """
+    Recibe un lote de conteos. Es idempotente por `batch_id`: si el lote ya se
+    recibió, responde `duplicate` sin volver a aplicarlo.
+    """
+    if data.mode not in BATCH_MODES:
+        raise HTTPException(400, f"mode debe ser uno de: {', '.join(BATCH_MODES)}")
+    count = await get_open_count(db, count_id)
+    allowed = set(
+        (
+            await db.execute(
+                select(CycleCountLocation.location_id).where(CycleCountLocation.cycle_count_id == count.id)
+            )
+        ).scalars().all()
+    )
+
+    # Códigos escaneados: índice en memoria de UPC/SKU y anaqueles
+    index = None
+    if any(line.code or line.location_code for line in data.entries):
+        index = await get_scan_index(db)
+
+    lines, rejected = [], []
+    for i, line in enumerate(data.entries):
+        lid = line.location_id
+        if lid is None and line.location_code:
+            loc = index.locations.get(normalize_location_code(line.location_code))
+            lid = loc[0] if loc else None
+        pid = line.product_id
+        if pid is None and line.code:
+            product = index.products.get(normalize_product_code(line.code))
+            pid = product[0] if product else None
+        if lid not in allowed:
+            rejected.append({"line": i, "reason": "ubicación fuera del conteo"})
+        elif pid is None:
+            rejected.append({"line": i, "reason": "producto no encontrado"})
+        else:
+            lines.append((lid, pid, line.quantity))
+
+    # product_id enviados directamente: descartar los que no existen
+    ids = {pid for _, pid, _ in lines}
+    known = set((await db.execute(select(Product.id).where(Product.id.in_(ids)))).scalars().all()) if ids else set()
+    if len(known) != len(ids):
+        rejected += [{"product_id": pid, "reason": "producto no encontrado"} for pid in sorted(ids - known)]
+        lines = [line for line in lines if line[1] in known]
+
+    if not await register_batch(db, count.id, data.batch_id, data.mode, len(lines), data.device):
+        await db.rollback()
+        return {"batch_id": data.batch_id, "duplicate": True, "accepted": 0, "rejected": []}
+
+    accepted = await upsert_entries(db, count.id, aggregate_counts(lines, data.mode), data.mode)
+    await db.commit()
+    return {"batch_id": data.batch_id, "duplicate": False, "accepted": accepted, "rejected": rejected}
+
+
+# --- 3. DIFERENCIAS Y CIERRE ---
+@router.get("/{count_id}/variances")
+async def get_count_variances(
+    count_id: int,
+    only_diff: bool = True,
+    limit: int = 100,
+    offset: int = 0,
+    db: AsyncSession = Depends(get_db),
+):
+    """Contado vs esperado. Con el conteo abierto, lo esperado es lo actual del anaquel."""
+    E, PL = CycleCountEntry, ProductLocation
+    current = (
+        select(PL.quantity)
+        .where(PL.location_id == E.location_id, PL.product_id == E.product_id)
+        .scalar_subquery()
+    )
+    expected = func.coalesce(E.expected, current, 0)
+    variance = (E.counted - expected).label("variance")
+    stmt = (
+        select(
+            E.location_id,
+            Location.code.label("location_code"),
+            E.product_id,
+            Product.name,
+            func.coalesce(Product.sku, "").label("sku"),
+            E.counted,
+            expected.label("expected"),
+            variance,
+        )
+        .join(Location, Location.id == E.location_id)
+        .join(Product, Product.id == E.product_id)
+        .where(E.cycle_count_id == count_id)
+    )
+    if only_diff:
+        stmt = stmt.where(E.counted != expected)
+    rows = (
+        await db.execute(
+            stmt.order_by(func.abs(variance).desc(), E.location_id, E.product_id)
+            .limit(min(max(limit, 1), 1000))
+            .offset(max(offset, 0))
+        )
+    ).all()
+    return FastJSONResponse([r._asdict() for r in rows])
+
+
+@router.post("/{count_id}/close")
+async def close_count(count_id: int, zero_missing: bool = True, db: AsyncSession = Depends(get_db)):
+    """
+    Cierra el conteo y aplica las diferencias en una sola transacción.
+    Con `zero_missing`, lo asignado a un anaquel contado que no se contó
+    queda en cero.
+    """
+    count = await get_open_count(db, count_id)
+    summary = await close_cycle_count(db, count, zero_missing=zero_missing)
+    await bump_catalog_version(db)
+    await db.commit()
+    await db.refresh(count)
+    return {**cycle_count_to_dict(count), **summary}
+
+
+@router.post("/{count_id}/cancel")
+async def cancel_count(count_id: int, db: AsyncSession = Depends(get_db)):
+    count = await get_open_count(db, count_id)
+    count.status = "cancelled"
+    count.closed_at = datetime.utcnow()
+    await db.commit()
+    return {"message": "Conteo cancelado"}
@@ -4,21 +4,51 @@ import logging
 import re
 import unicodedata
 import xml.etree.ElementTree as ET
-from datetime import datetime
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Body
+from datetime import datetime, timedelta
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Body, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import or_, func, case, update, delete
+from sqlalchemy import or_, func, case, update, delete, tuple_, Float, String
 from typing import List, Dict, Optional, Set
+from fastapi.responses import StreamingResponse
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array_agg
 from pydantic import BaseModel
 from app.core.database import get_db
+from app.core.serialization import FastJSONResponse
+from app.services.catalog_cache import bump_catalog_version, cached_json_response
+from app.services.catalog_export import EXPORT_MEDIA_TYPES, EXPORT_STREAMS
+from app.services.price_updates import bulk_update_products, insert_price_history
+from app.services.product_sync import sync_horizon
+from app.services.cursors import decode_cursor, encode_cursor
+from app.services.stock_rollups import add_stock_history
+from app.services.supplier_spend import refresh_supplier_spend
+from app.services.product_queries import (
+    BATCH_ITEM_FIELDS,
+    PRODUCT_LIST_FIELDS,
+    as_dicts,
+    columns,
+    parse_fields,
+)
 from app.services.xml_service import XmlInvoiceParser
-from app.domain.models import Product, PriceHistory, ImportBatch, ImportBatchItem, Supplier, StockHistory
+from app.domain.models import (
+    Product,
+    PriceHistory,
+    ImportBatch,
+    ImportBatchItem,
+    Supplier,
+    StockHistory,
+    ProductTombstone,
+    SupplierOffer,
+)
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 parser = XmlInvoiceParser()
 EXTRACTED_SKU_NAME_MATCH_CUTOFF = 0.55
+SYNC_COLUMNS = [
+    "id", "sku", "upc", "name", "alias", "price", "selling_price",
+    "stock", "supplier_id", "is_delicate",
+]
 
 
 def escape_like(value: str) -> str:
@@ -137,7 +167,7 @@ async def upload_invoice(
         supplier_id = supplier.id
 
     # 3. Crear Lote
-    new_batch = ImportBatch(filename=file.filename, created_at=datetime.now())
+    new_batch = ImportBatch(filename=file.filename, created_at=datetime.now(), supplier_id=supplier_id)
     db.add(new_batch)
     await db.flush()
     current_batch_id = new_batch.id
@@ -201,6 +231,7 @@ async def upload_invoice(
     price_history_buffer = []
     batch_items_buffer = []
     stock_history_buffer = []
+    offers_buffer = []  # Costo por proveedor (índice de ofertas)
     temp_new_products_map = []  # Memoria temporal para evitar error Greenlet
 
     for key, data in grouped_items.items():
@@ -288,9 +319,22 @@ async def upload_invoice(
             # Guardar cantidad específica en el lote
             batch_items_buffer.append(
                 ImportBatchItem(
-                    batch_id=current_batch_id, product_id=p_id, quantity=data["qty"]
+                    batch_id=current_batch_id,
+                    product_id=p_id,
+                    quantity=data["qty"],
+                    unit_cost=data["cost"],
                 )
             )
+            if supplier_id:
+                offers_buffer.append(
+                    SupplierOffer(
+                        supplier_id=supplier_id,
+                        product_id=p_id,
+                        batch_id=current_batch_id,
+                        unit_cost=data["cost"],
+                        quantity=data["qty"],
+                    )
+                )
 
         else:
             # --- PRODUCTO NUEVO (Sin ID aleatorio) ---
@@ -413,9 +457,22 @@ async def upload_invoice(
         )
         batch_items_buffer.append(
             ImportBatchItem(
-                batch_id=current_batch_id, product_id=new_p.id, quantity=item["qty"]
+                batch_id=current_batch_id,
+                product_id=new_p.id,
+                quantity=item["qty"],
+                unit_cost=item["cost"],
             )
         )
+        if supplier_id:
+            offers_buffer.append(
+                SupplierOffer(
+                    supplier_id=supplier_id,
+                    product_id=new_p.id,
+                    batch_id=current_batch_id,
+                    unit_cost=item["cost"],
+                    quantity=item["qty"],
+                )
+            )
         stock_history_buffer.append(
             StockHistory(
                 product_id=new_p.id,
@@ -437,9 +494,15 @@ async def upload_invoice(
 
     db.add_all(price_history_buffer)
     db.add_all(batch_items_buffer)
-    db.add_all(stock_history_buffer)
+    db.add_all(offers_buffer)
+    await add_stock_history(db, stock_history_buffer)
+    if supplier_id:
+        # Gasto mensual del proveedor: se recalcula desde el mes del lote
+        await db.flush()
+        await refresh_supplier_spend(db, supplier_id, new_batch.created_at.date().replace(day=1))
 
     try:
+        await bump_catalog_version(db)
         await db.commit()
     except Exception as e:
         await db.rollback()
@@ -465,47 +528,119 @@ async def upload_invoice(
 async def update_prices(
     updates: List[Dict] = Body(...), db: AsyncSession = Depends(get_db)
 ):
-    count = 0
+    """
+    Guarda precio de venta / alias / UPC de muchos productos a la vez.
+    Resuelve IDs y nombres en dos consultas, calcula los cambios en memoria y
+    los aplica con un solo UPDATE masivo. Devuelve el resultado por item.
+    """
+    results: List[Dict] = [{"index": i, "id": None, "status": "error"} for i in range(len(updates))]
+
+    # 1. Validar y resolver productos (una consulta por IDs, otra por nombres)
+    fields = (Product.id, Product.name, Product.selling_price, Product.alias, Product.upc)
+    ids = set()
     for item in updates:
-        p = None
-        if item.get("id"):
-            p = await db.get(Product, item["id"])
+        try:
+            if item.get("id"):
+                ids.add(int(item["id"]))
+        except (TypeError, ValueError):
+            pass
+    by_id = {}
+    if ids:
+        rows = (await db.execute(select(*fields).where(Product.id.in_(ids)))).all()
+        by_id = {r.id: r._asdict() for r in rows}
+
+    def find_by_id(item):
+        try:
+            return by_id.get(int(item["id"])) if item.get("id") else None
+        except (TypeError, ValueError):
+            return None
+
+    names = {
+        str(item["name"])
+        for item in updates
+        if item.get("name") and not find_by_id(item)
+    }
+    by_name: Dict[str, List[dict]] = {}
+    if names:
+        rows = (await db.execute(select(*fields).where(Product.name.in_(names)))).all()
+        for r in rows:
+            by_name.setdefault(r.name, []).append(by_id.setdefault(r.id, r._asdict()))
+
+    # 2. Calcular cambios en memoria (el último item de un mismo producto gana)
+    touched: Dict[int, dict] = {}
+    history_rows = []
+    for i, item in enumerate(updates):
+        current = find_by_id(item)
+        if not current:
+            matches = by_name.get(str(item.get("name") or ""), [])
+            if len(matches) > 1:
+                results[i]["error"] = "Nombre ambiguo: hay varios productos con ese nombre"
+                continue
+            current = matches[0] if matches else None
+        if not current:
+            results[i]["error"] = "Producto no encontrado"
+            continue
+        results[i]["id"] = current["id"]
 
-        if not p:
-            res = await db.execute(select(Product).where(Product.name == item["name"]))
-            p = res.scalar_one_or_none()
+        try:
+            new_price = float(item["selling_price"]) if "selling_price" in item else None
+        except (TypeError, ValueError):
+            results[i]["error"] = "Precio de venta inválido"
+            continue
 
-        if p:
-            try:
-                if "alias" in item:
-                    new_alias = str(item["alias"]).strip()
-                    p.alias = new_alias if new_alias else None
-                if "selling_price" in item:
-                    new_price = float(item["selling_price"])
-                    if abs((p.selling_price or 0) - new_price) > 0.01:
-                        db.add(
-                            PriceHistory(
-                                product_id=p.id,
-                                change_type="PRECIO",
-                                old_value=(p.selling_price or 0),
-                                new_value=new_price,
-                            )
-                        )
-                        p.selling_price = new_price
-                if "upc" in item:
-                    new_upc = str(item["upc"]).strip()
-                    if new_upc and new_upc != (p.upc or ""):
-                        p.upc = new_upc
-                count += 1
-            except:
-                continue
+        changed = False
+        if "alias" in item:
+            new_alias = str(item["alias"]).strip() or None
+            if new_alias != current["alias"]:
+                current["alias"] = new_alias
+                changed = True
+        if new_price is not None:
+            if abs((current["selling_price"] or 0) - new_price) > 0.01:
+                history_rows.append(
+                    {
+                        "product_id": current["id"],
+                        "change_type": "PRECIO",
+                        "old_value": current["selling_price"] or 0,
+                        "new_value": new_price,
+                    }
+                )
+                current["selling_price"] = new_price
+                changed = True
+        if "upc" in item:
+            new_upc = str(item["upc"]).strip()
+            if new_upc and new_upc != (current["upc"] or ""):
+                current["upc"] = new_upc
+                changed = True
+
+        if changed:
+            touched[current["id"]] = current
+        results[i]["status"] = "updated" if changed else "unchanged"
+        results[i].pop("error", None)
+
+    # 3. Escritura masiva: historial multi-fila + UPDATE ... FROM (VALUES ...)
+    await insert_price_history(db, history_rows)
+    await bulk_update_products(
+        db,
+        list(touched.values()),
+        {"selling_price": Float(), "alias": String(), "upc": String()},
+    )
+    await bump_catalog_version(db)
     await db.commit()
-    return {"message": f"{count} productos actualizados."}
+
+    count = sum(1 for r in results if r["status"] != "error")
+    failed = [r for r in results if r["status"] == "error"]
+    return {
+        "message": f"{count} productos actualizados.",
+        "updated": count,
+        "failed": len(failed),
+        "results": results,
+    }
 
 
 # --- 3. OBTENER PRODUCTOS ---
 @router.get("/products")
 async def get_products(
+    request: Request,
     q: Optional[str] = None,
     missing_price: bool = False,
     only_delicate: bool = False,
@@ -516,37 +651,10 @@ async def get_products(
     sort_order: str = "desc",
     limit: int = 50,
     offset: int = 0,
+    fields: Optional[str] = None,
     db: AsyncSession = Depends(get_db),
 ):
-    stmt = select(Product, Supplier.name.label("supplier_name")).outerjoin(
-        Supplier, Product.supplier_id == Supplier.id
-    )
-
-    # --- 2. LÓGICA DE BÚSQUEDA SIN ACENTOS ---
-    if q:
-        q_safe = escape_like(q[:200])  # Limitar longitud y escapar wildcards
-        stmt = stmt.where(
-            or_(
-                func.unaccent(Product.name).ilike(func.unaccent(f"%{q_safe}%")),
-                Product.sku.ilike(f"%{q_safe}%"),
-                Product.upc.ilike(f"%{q_safe}%"),
-                func.unaccent(Product.alias).ilike(func.unaccent(f"%{q_safe}%")),
-            )
-        )
-
-    # --- Filtros Restantes ---
-    if missing_price:
-        stmt = stmt.where(
-            or_(Product.selling_price == 0, Product.selling_price == None)
-        )
-    if only_delicate:
-        stmt = stmt.where(Product.is_delicate == True)
-    if min_price is not None:
-        stmt = stmt.where(Product.selling_price >= min_price)
-    if max_price is not None:
-        stmt = stmt.where(Product.selling_price <= max_price)
-    if min_stock is not None:
-        stmt = stmt.where(Product.stock_quantity <= min_stock)
+    keys = parse_fields(fields, PRODUCT_LIST_FIELDS)
 
     # --- Ordenamiento (whitelist de columnas permitidas) ---
     ALLOWED_SORT = {"id", "name", "price", "selling_price", "stock_quantity", "updated_at", "created_at", "sku"}
@@ -554,42 +662,174 @@ async def get_products(
         sort_by = "id"
     if sort_order not in ("asc", "desc"):
         sort_order = "desc"
-    sort_col = getattr(Product, sort_by, Product.id)
 
-    stmt = stmt.order_by(
-        sort_col.desc() if sort_order == "desc" else sort_col.asc()
-    )
+    async def build():
+        stmt = select(*columns(PRODUCT_LIST_FIELDS, keys)).select_from(Product)
+        # El JOIN con proveedores solo hace falta si se pidió su nombre
+        if "supplier_name" in keys:
+            stmt = stmt.outerjoin(Supplier, Product.supplier_id == Supplier.id)
+
+        # --- 2. LÓGICA DE BÚSQUEDA SIN ACENTOS ---
+        if q:
+            q_safe = escape_like(q[:200])  # Limitar longitud y escapar wildcards
+            stmt = stmt.where(
+                or_(
+                    func.unaccent(Product.name).ilike(func.unaccent(f"%{q_safe}%")),
+                    Product.sku.ilike(f"%{q_safe}%"),
+                    Product.upc.ilike(f"%{q_safe}%"),
+                    func.unaccent(Product.alias).ilike(func.unaccent(f"%{q_safe}%")),
+                )
+            )
 
-    # --- Conteo total (antes de limit/offset) ---
-    subq = stmt.order_by(None).subquery()
-    count_stmt = select(func.count(subq.c.id))
-    total_result = await db.execute(count_stmt)
-    total = total_result.scalar() or 0
+        # --- Filtros Restantes ---
+        if missing_price:
+            stmt = stmt.where(
+                or_(Product.selling_price == 0, Product.selling_price == None)
+            )
+        if only_delicate:
+            stmt = stmt.where(Product.is_delicate == True)
+        if min_price is not None:
+            stmt = stmt.where(Product.selling_price >= min_price)
+        if max_price is not None:
+            stmt = stmt.where(Product.selling_price <= max_price)
+        if min_stock is not None:
+            stmt = stmt.where(Product.stock_quantity <= min_stock)
+
+        # --- Ordenamiento ---
+        sort_col = getattr(Product, sort_by, Product.id)
+
+        stmt = stmt.order_by(
+            sort_col.desc() if sort_order == "desc" else sort_col.asc()
+        )
 
-    # --- Paginación ---
-    stmt = stmt.limit(min(limit, 500)).offset(max(offset, 0))
+        # --- Conteo total (antes de limit/offset) ---
+        subq = stmt.order_by(None).subquery()
+        count_stmt = select(func.count()).select_from(subq)
+        total_result = await db.execute(count_stmt)
+        total = total_result.scalar() or 0
 
-    # --- Ejecución ---
-    result = await db.execute(stmt)
+        # --- Paginación ---
+        stmt = stmt.limit(min(limit, 500)).offset(max(offset, 0))
 
-    items = [
-        {
-            "id": p.id,
-            "sku": p.sku,
-            "upc": p.upc or "",
-            "name": p.name,
-            "alias": p.alias or "",
-            "price": p.price,
-            "selling_price": p.selling_price,
-            "stock": p.stock_quantity,
-            "supplier_id": p.supplier_id,
-            "supplier_name": supplier_name or "",
-            "is_delicate": p.is_delicate or False,
-        }
-        for p, supplier_name in result.all()
-    ]
+        # --- Ejecución ---
+        result = await db.execute(stmt)
+
+        items = as_dicts(result.all())
 
-    return {"items": items, "total": total}
+        return {"items": items, "total": total}
+
+    return await cached_json_response(request, db, build)
+
+
+# --- 3B. SINCRONIZACIÓN INCREMENTAL (clientes offline) ---
+@router.get("/products/changes")
+async def get_product_changes(
+    since: Optional[str] = None,
+    limit: int = 500,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Feed de cambios para clientes que guardan el catálogo localmente.
+    Devuelve altas/modificaciones (`upserts`, como filas compactas según
+    `columns`) y bajas (`deleted`) posteriores al cursor, en orden de
+    transacción (ver app/services/product_sync.py). Sin `since` se obtiene
+    el catálogo completo.
+    """
+    limit = max(1, min(limit, 2000))
+    horizon = await sync_horizon(db)
+
+    # Orden total (xid, tipo, id): productos (tipo 0) antes que bajas (tipo 1)
+    prod_stmt = select(
+        Product.id,
+        Product.sku,
+        Product.upc,
+        Product.name,
+        Product.alias,
+        Product.price,
+        Product.selling_price,
+        Product.stock_quantity,
+        Product.supplier_id,
+        Product.is_delicate,
+        Product.sync_xid,
+    ).where(Product.sync_xid < horizon)
+    tomb_stmt = select(
+        ProductTombstone.id, ProductTombstone.product_id, ProductTombstone.sync_xid
+    ).where(ProductTombstone.sync_xid < horizon)
+
+    if since:
+        c_xid, c_kind, c_id = decode_cursor(since, int, int, int)
+        if c_kind == 0:
+            prod_stmt = prod_stmt.where(tuple_(Product.sync_xid, Product.id) > (c_xid, c_id))
+            tomb_stmt = tomb_stmt.where(ProductTombstone.sync_xid >= c_xid)
+        else:
+            prod_stmt = prod_stmt.where(Product.sync_xid > c_xid)
+            tomb_stmt = tomb_stmt.where(
+                tuple_(ProductTombstone.sync_xid, ProductTombstone.id) > (c_xid, c_id)
+            )
+
+    prod_rows = (
+        await db.execute(
+            prod_stmt.order_by(Product.sync_xid, Product.id).limit(limit + 1)
+        )
+    ).all()
+    tomb_rows = (
+        await db.execute(
+            tomb_stmt.order_by(ProductTombstone.sync_xid, ProductTombstone.id).limit(limit + 1)
+        )
+    ).all()
+
+    events = [(r.sync_xid, 0, r.id, r) for r in prod_rows]
+    events += [(t.sync_xid, 1, t.id, t) for t in tomb_rows]
+    events.sort(key=lambda e: e[:3])
+    has_more = len(events) > limit
+    events = events[:limit]
+
+    upserts = []
+    deleted = []
+    for _, kind, _, row in events:
+        if kind == 0:
+            upserts.append([
+                row.id,
+                row.sku,
+                row.upc or "",
+                row.name,
+                row.alias or "",
+                row.price,
+                row.selling_price,
+                row.stock_quantity,
+                row.supplier_id,
+                row.is_delicate or False,
+            ])
+        else:
+            deleted.append(row.product_id)
+
+    if events:
+        last_xid, last_kind, last_id, _ = events[-1]
+        next_cursor = encode_cursor(last_xid, last_kind, last_id)
+    else:
+        next_cursor = since
+
+    return {
+        "columns": SYNC_COLUMNS,
+        "upserts": upserts,
+        "deleted": deleted,
+        "cursor": next_cursor,
+        "has_more": has_more,
+    }
+
+
+# --- 3C. EXPORTACIÓN COMPLETA DEL CATÁLOGO ---
+@router.get("/products/export")
+async def export_products(format: str = "csv"):
+    fmt = format.lower()
+    if fmt not in EXPORT_STREAMS:
+        raise HTTPException(400, "Formato inválido (csv, ndjson, xlsx)")
+    filename = f"catalogo_{datetime.now():%Y%m%d_%H%M}.{fmt}"
+    return StreamingResponse(
+        EXPORT_STREAMS[fmt](),
+        media_type=EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 
 # --- 4. ACTUALIZAR INDIVIDUAL ---
@@ -630,6 +870,7 @@ async def update_product_single(
             p.image_url = data["image_url"] if data["image_url"] else None
         if "is_delicate" in data:
             p.is_delicate = bool(data["is_delicate"])
+        await bump_catalog_version(db)
         await db.commit()
         await db.refresh(p)
         return {"msg": "Actualizado", "id": p.id, "new_price": p.selling_price}
@@ -656,6 +897,8 @@ async def merge_products(data: dict = Body(...), db: AsyncSession = Depends(get_
         raise HTTPException(404, "Producto no encontrado")
 
     qty_to_add = d.stock_quantity
+    # Antes del UPDATE: la sesión sincroniza k.stock_quantity con el valor nuevo
+    keep_stock = k.stock_quantity or 0
     price_discard = d.price
     price_keep = k.price
     new_price = price_keep
@@ -672,38 +915,111 @@ async def merge_products(data: dict = Body(...), db: AsyncSession = Depends(get_
         .where(PriceHistory.product_id == discard_id)
         .values(product_id=keep_id)
     )
+    await db.execute(
+        update(SupplierOffer)
+        .where(SupplierOffer.product_id == discard_id)
+        .values(product_id=keep_id)
+    )
     await db.execute(
         update(Product)
         .where(Product.id == keep_id)
-        .values(stock_quantity=Product.stock_quantity + qty_to_add, price=new_price, updated_at=datetime.now())
+        .values(stock_quantity=Product.stock_quantity + qty_to_add, price=new_price, updated_at=datetime.utcnow())
     )
     await db.execute(delete(Product).where(Product.id == discard_id))
+    db.add(ProductTombstone(product_id=discard_id, reason=f"merge:{keep_id}"))
 
     if qty_to_add > 0:
-        db.add(StockHistory(
+        await add_stock_history(db, [StockHistory(
             product_id=keep_id,
             change_type="MERGE",
-            old_value=k.stock_quantity,
-            new_value=k.stock_quantity + qty_to_add,
+            old_value=keep_stock,
+            new_value=keep_stock + qty_to_add,
             source=f"merge:{discard_id}",
-        ))
+        )])
 
+    await bump_catalog_version(db)
     await db.commit()
     return {"message": "Fusionado correctamente"}
 
 
 # --- 6. HISTORIAL ---
+HISTORY_TYPES = ("COSTO", "PRECIO")
+
+
 @router.get("/products/{product_id}/history")
-async def get_product_history(product_id: int, db: AsyncSession = Depends(get_db)):
+async def get_product_history(
+    product_id: int,
+    type: Optional[str] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Historial de costo/precio, más reciente primero, paginado por (fecha, id)
+    sobre el índice (product_id, date, id). La primera página trae además
+    `stats`, calculadas en una sola consulta agregada.
+    """
+    if type:
+        type = type.upper()
+        if type not in HISTORY_TYPES:
+            raise HTTPException(400, "type debe ser COSTO o PRECIO")
+    limit = min(max(limit, 1), 200)
+
     stmt = (
-        select(PriceHistory)
+        select(PriceHistory.id, PriceHistory.date, PriceHistory.change_type, PriceHistory.old_value, PriceHistory.new_value)
         .where(PriceHistory.product_id == product_id)
-        .order_by(PriceHistory.date.desc())
+        .order_by(PriceHistory.date.desc(), PriceHistory.id.desc())
+        .limit(limit)
     )
-    return [
-        {"date": h.date, "type": h.change_type, "old": h.old_value, "new": h.new_value}
-        for h in (await db.execute(stmt)).scalars().all()
-    ]
+    if type:
+        stmt = stmt.where(PriceHistory.change_type == type)
+    if cursor:
+        last_date, last_id = decode_cursor(cursor, datetime, int)
+        stmt = stmt.where(tuple_(PriceHistory.date, PriceHistory.id) < (last_date, last_id))
+    rows = (await db.execute(stmt)).all()
+
+    data = {
+        "items": [
+            {"date": r.date, "type": r.change_type, "old": r.old_value, "new": r.new_value}
+            for r in rows
+        ],
+        "next_cursor": encode_cursor(rows[-1].date, rows[-1].id) if len(rows) == limit else None,
+    }
+
+    if not cursor:
+        is_cost = PriceHistory.change_type == "COSTO"
+        since_90d = datetime.utcnow() - timedelta(days=90)
+        s = (
+            await db.execute(
+                select(
+                    func.count().label("change_count"),
+                    func.count().filter(is_cost).label("cost_changes"),
+                    func.count().filter(PriceHistory.change_type == "PRECIO").label("price_changes"),
+                    func.max(PriceHistory.date).filter(is_cost).label("last_cost_change_at"),
+                    array_agg(aggregate_order_by(PriceHistory.old_value, PriceHistory.date.desc()))
+                    .filter(is_cost)[1]
+                    .label("last_cost_old"),
+                    array_agg(aggregate_order_by(PriceHistory.new_value, PriceHistory.date.desc()))
+                    .filter(is_cost)[1]
+                    .label("last_cost_new"),
+                    func.avg(PriceHistory.new_value)
+                    .filter(is_cost, PriceHistory.date >= since_90d)
+                    .label("avg_cost_90d"),
+                ).where(PriceHistory.product_id == product_id)
+            )
+        ).one()
+        data["stats"] = {
+            "change_count": s.change_count,
+            "cost_changes": s.cost_changes,
+            "price_changes": s.price_changes,
+            "last_cost_change": (
+                {"date": s.last_cost_change_at, "old": s.last_cost_old, "new": s.last_cost_new}
+                if s.last_cost_change_at
+                else None
+            ),
+            "avg_cost_90d": round(s.avg_cost_90d, 2) if s.avg_cost_90d is not None else None,
+        }
+    return data
 
 
 # --- 7. MANUAL ---
@@ -727,13 +1043,14 @@ async def create_manual(item: ManualProductSchema, db: AsyncSession = Depends(ge
     db.add(new_p)
     await db.flush()
     if item.stock > 0:
-        db.add(StockHistory(
+        await add_stock_history(db, [StockHistory(
             product_id=new_p.id,
             change_type="ENTRADA",
             old_value=0,
             new_value=item.stock,
             source="manual",
-        ))
+        )])
+    await bump_catalog_version(db)
     await db.commit()
     await db.refresh(new_p)
     return {"message": "Creado", "id": new_p.id, "name": new_p.name, "sku": new_p.sku or ""}
@@ -748,8 +1065,9 @@ async def bulk_touch_products(data: dict = Body(...), db: AsyncSession = Depends
     await db.execute(
         update(Product)
         .where(Product.id.in_(ids))
-        .values(updated_at=datetime.now())
+        .values(updated_at=datetime.utcnow())
     )
+    await bump_catalog_version(db)
     await db.commit()
     return {"updated": len(ids)}
 
@@ -771,9 +1089,12 @@ async def delete_product(product_id: int, db: AsyncSession = Depends(get_db)):
 
     # B) Eliminar el historial de precios de este producto
     await db.execute(delete(PriceHistory).where(PriceHistory.product_id == product_id))
+    await db.execute(delete(SupplierOffer).where(SupplierOffer.product_id == product_id))
 
     # 3. Ahora sí, eliminar el producto de forma segura
     await db.delete(p)
+    db.add(ProductTombstone(product_id=product_id, reason="delete"))
+    await bump_catalog_version(db)
     await db.commit()
 
     return {"message": "Producto eliminado correctamente"}
@@ -867,6 +1188,7 @@ async def upload_catalog(
             if final_id:
                 db.add(ImportBatchItem(batch_id=new_batch.id, product_id=final_id))
 
+        await bump_catalog_version(db)
         await db.commit()
         return {"message": "Carga OK", "created": count_new, "updated": count_upd}
     except Exception as e:
@@ -883,6 +1205,7 @@ async def update_batch(
     if not batch:
         raise HTTPException(status_code=404, detail="Lote no encontrado")
     batch.filename = data.filename
+    await bump_catalog_version(db)
     await db.commit()
     return {"message": "Nombre actualizado"}
 
@@ -906,6 +1229,7 @@ async def delete_batch(batch_id: int, db: AsyncSession = Depends(get_db)):
 
     # 2. Revertir stock por producto
     reverted = 0
+    reversals = []
     for it in items:
         if not it.product_id or not it.quantity:
             continue
@@ -915,7 +1239,7 @@ async def delete_batch(batch_id: int, db: AsyncSession = Depends(get_db)):
         old_stock = product.stock_quantity or 0
         new_stock = max(0, old_stock - int(it.quantity))
         product.stock_quantity = new_stock
-        db.add(
+        reversals.append(
             StockHistory(
                 product_id=product.id,
                 change_type="REVERSA",
@@ -925,14 +1249,21 @@ async def delete_batch(batch_id: int, db: AsyncSession = Depends(get_db)):
             )
         )
         reverted += 1
+    await add_stock_history(db, reversals)
 
     # 3. Borrar líneas y lote
     await db.execute(
         delete(ImportBatchItem).where(ImportBatchItem.batch_id == batch_id)
     )
+    await db.execute(delete(SupplierOffer).where(SupplierOffer.batch_id == batch_id))
+    spend_key = (batch.supplier_id, batch.created_at)
     await db.delete(batch)
+    if spend_key[0] and spend_key[1]:
+        await db.flush()
+        await refresh_supplier_spend(db, spend_key[0], spend_key[1].date().replace(day=1))
 
     try:
+        await bump_catalog_version(db)
         await db.commit()
     except Exception as e:
         await db.rollback()
@@ -977,41 +1308,20 @@ async def get_batches(db: AsyncSession = Depends(get_db)):
 
 
 @router.get("/batches/{batch_id}/products")
-async def get_batch_items(batch_id: int, db: AsyncSession = Depends(get_db)):
+async def get_batch_items(
+    batch_id: int, fields: Optional[str] = None, db: AsyncSession = Depends(get_db)
+):
     """
     Versión MEJORADA: Trae el producto Y la cantidad específica de este lote.
     """
-    # Hacemos un JOIN para traer el Producto y la columna 'quantity' de la tabla intermedia
+    # Solo las columnas que se devuelven, más la cantidad guardada en la tabla intermedia
+    keys = parse_fields(fields, BATCH_ITEM_FIELDS)
     stmt = (
-        select(
-            Product,
-            ImportBatchItem.quantity.label(
-                "batch_qty"
-            ),  # <--- Aquí recuperamos el dato guardado
-        )
+        select(*columns(BATCH_ITEM_FIELDS, keys))
+        .select_from(Product)
         .join(ImportBatchItem, ImportBatchItem.product_id == Product.id)
         .where(ImportBatchItem.batch_id == batch_id)
     )
 
     result = await db.execute(stmt)
-    rows = result.all()  # Esto nos da una lista de parejas: (Producto, Cantidad)
-
-    return [
-        {
-            "id": p.id,
-            "sku": p.sku,
-            "upc": p.upc,
-            "name": p.name,
-            "alias": p.alias or "",
-            "price": p.price,
-            "selling_price": p.selling_price,
-            "stock": p.stock_quantity,  # Stock total global
-            "quantity": (
-                batch_qty if batch_qty is not None else 0
-            ),  # <--- Enviamos la cantidad al Frontend
-            "missing_price": (
-                True if (not p.selling_price or p.selling_price <= 0) else False
-            ),
-        }
-        for p, batch_qty in rows
-    ]
+    return FastJSONResponse(as_dicts(result.all()))
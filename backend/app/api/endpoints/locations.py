@@ -1,13 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException
+import json
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket, WebSocketDisconnect, status
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import func, or_
+from sqlalchemy import false, func, or_
 from typing import Optional, List
 from pydantic import BaseModel, Field
 
-from app.core.database import get_db
-from app.domain.models import Location, ProductLocation, Product
+from app.core.database import SessionLocal, get_db
+from app.core.serialization import FastJSONResponse, dumps
+from app.services.catalog_cache import bump_catalog_version, cached_json_response
+from app.services.location_scans import apply_scans
+from app.services.product_locations import delete_pairs, upsert_quantities
+from app.services.product_queries import LOCATION_PRODUCT_FIELDS, as_dicts, columns, parse_fields
+from app.domain.models import CycleCount, CycleCountLocation, Location, ProductLocation, Product
 
+logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
@@ -39,24 +49,27 @@ class AddProductToLocation(BaseModel):
 # --- RUTAS FIJAS PRIMERO ---
 
 @router.get("")
-async def get_locations(db: AsyncSession = Depends(get_db)):
-    stmt = (
-        select(Location, func.count(ProductLocation.id).label("product_count"))
-        .outerjoin(ProductLocation, Location.id == ProductLocation.location_id)
-        .group_by(Location.id)
-        .order_by(Location.code.asc())
-    )
-    result = await db.execute(stmt)
-    return [
-        {
-            "id": loc.id,
-            "code": loc.code,
-            "description": loc.description,
-            "created_at": loc.created_at,
-            "product_count": count,
-        }
-        for loc, count in result.all()
-    ]
+async def get_locations(request: Request, db: AsyncSession = Depends(get_db)):
+    async def build():
+        stmt = (
+            select(Location, func.count(ProductLocation.id).label("product_count"))
+            .outerjoin(ProductLocation, Location.id == ProductLocation.location_id)
+            .group_by(Location.id)
+            .order_by(Location.code.asc())
+        )
+        result = await db.execute(stmt)
+        return [
+            {
+                "id": loc.id,
+                "code": loc.code,
+                "description": loc.description,
+                "created_at": loc.created_at,
+                "product_count": count,
+            }
+            for loc, count in result.all()
+        ]
+
+    return await cached_json_response(request, db, build)
 
 
 @router.post("")
@@ -76,6 +89,7 @@ async def create_location(data: LocationCreate, db: AsyncSession = Depends(get_d
         description=data.description.strip() if data.description else None,
     )
     db.add(location)
+    await bump_catalog_version(db)
     await db.commit()
     await db.refresh(location)
     return {"id": location.id, "code": location.code, "description": location.description}
@@ -127,7 +141,23 @@ async def search_products_for_location(
     with_locations: bool = False,
     db: AsyncSession = Depends(get_db),
 ):
-    stmt = select(Product)
+    # 1) Productos con la marca "ya está en esta ubicación" en la misma consulta
+    already = (
+        select(ProductLocation.id)
+        .where(ProductLocation.location_id == location_id, ProductLocation.product_id == Product.id)
+        .exists()
+        if location_id
+        else false()
+    )
+    stmt = select(
+        Product.id,
+        Product.name,
+        func.coalesce(Product.sku, "").label("sku"),
+        Product.price,
+        Product.selling_price,
+        func.coalesce(Product.image_url, "").label("image_url"),
+        already.label("already_in_location"),
+    )
     if q:
         q_safe = escape_like(q[:200])
         stmt = stmt.where(
@@ -139,46 +169,190 @@ async def search_products_for_location(
             )
         )
     stmt = stmt.order_by(Product.name.asc()).limit(50)
-    result = await db.execute(stmt)
-    products = result.scalars().all()
-
-    existing_ids = set()
-    if location_id:
-        existing = await db.execute(
-            select(ProductLocation.product_id).where(
-                ProductLocation.location_id == location_id
-            )
-        )
-        existing_ids = {row[0] for row in existing.all()}
-
-    items = []
-    for p in products:
-        item = {
-            "id": p.id,
-            "name": p.name,
-            "sku": p.sku or "",
-            "price": p.price,
-            "selling_price": p.selling_price,
-            "image_url": p.image_url or "",
-            "already_in_location": p.id in existing_ids,
-        }
-        if with_locations:
-            loc_stmt = (
-                select(ProductLocation, Location)
+    items = as_dicts((await db.execute(stmt)).all())
+
+    # 2) Ubicaciones de todos los resultados en una sola consulta (IN)
+    if with_locations:
+        by_product = {item["id"]: [] for item in items}
+        if by_product:
+            loc_rows = await db.execute(
+                select(ProductLocation.product_id, Location.code, ProductLocation.quantity)
                 .join(Location, ProductLocation.location_id == Location.id)
-                .where(ProductLocation.product_id == p.id)
-                .order_by(Location.code.asc())
+                .where(ProductLocation.product_id.in_(list(by_product)))
+                .order_by(ProductLocation.product_id, Location.code.asc())
             )
-            loc_result = await db.execute(loc_stmt)
-            item["locations"] = [
-                {"code": loc.code, "quantity": pl.quantity}
-                for pl, loc in loc_result.all()
-            ]
-        items.append(item)
+            for product_id, code, quantity in loc_rows.all():
+                by_product[product_id].append({"code": code, "quantity": quantity})
+        for item in items:
+            item["locations"] = by_product[item["id"]]
 
     return items
 
 
+class ScanBatch(BaseModel):
+    scans: List[str] = Field(..., min_length=1, max_length=5000)
+    location_code: Optional[str] = Field(None, max_length=50)
+
+
+@router.post("/scan")
+async def scan_to_locations(data: ScanBatch, db: AsyncSession = Depends(get_db)):
+    """
+    Aplica una secuencia de escaneos: un código de ubicación fija el anaquel y
+    cada UPC/SKU posterior suma una pieza en él.
+    """
+    return await apply_scans(db, data.scans, data.location_code)
+
+
+@router.websocket("/scan/ws")
+async def scan_stream(websocket: WebSocket):
+    """
+    Igual que POST /scan, por mensajes: cada mensaje es un código suelto o un
+    JSON {"scans": [...], "location_code": "..."}. La ubicación activa se
+    conserva entre mensajes. Si falla la base de datos, el mensaje en curso
+    no se aplica: se avisa al cliente y se cierra con 1011 para que reconecte
+    y lo reenvíe.
+    """
+    await websocket.accept()
+    location_code = websocket.query_params.get("location_code")
+    try:
+        while True:
+            raw = await websocket.receive_text()
+            try:
+                message = json.loads(raw)
+            except ValueError:
+                message = raw
+            if isinstance(message, dict):
+                scans = [str(s) for s in message.get("scans") or []][:5000]
+                location_code = message.get("location_code") or location_code
+            else:
+                scans = [str(message)]
+            try:
+                async with SessionLocal() as db:
+                    result = await apply_scans(db, scans, location_code)
+            except (SQLAlchemyError, OSError) as e:
+                logger.warning("Escaneo por WebSocket falló: %s", e)
+                await websocket.send_text(
+                    dumps({"error": "Error de base de datos; reenvía el lote", "location_code": location_code}).decode()
+                )
+                await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+                return
+            location_code = result["location_code"]
+            await websocket.send_text(dumps(result).decode())
+    except WebSocketDisconnect:
+        pass
+
+
+# Operaciones de /batch: move (todo el renglón), transfer (N piezas) y set (cantidad fija)
+BATCH_OPS = ("move", "transfer", "set")
+
+
+class LocationOperation(BaseModel):
+    op: str
+    product_id: int = Field(..., gt=0)
+    location_id: int = Field(..., gt=0)  # Origen en move/transfer; destino en set
+    to_location_id: Optional[int] = Field(None, gt=0)
+    quantity: Optional[int] = Field(None, ge=0, le=999999)
+
+
+class LocationBatch(BaseModel):
+    operations: List[LocationOperation] = Field(..., min_length=1, max_length=2000)
+
+
+@router.post("/batch")
+async def apply_location_batch(data: LocationBatch, db: AsyncSession = Depends(get_db)):
+    """
+    Aplica varias operaciones en una sola transacción. Se validan todas
+    juntas sobre el estado actual (en orden) y, si alguna falla, no se
+    aplica ninguna.
+    """
+    ops = data.operations
+    location_ids = {op.location_id for op in ops} | {op.to_location_id for op in ops if op.to_location_id}
+    product_ids = {op.product_id for op in ops}
+    found_locations = set(
+        (await db.execute(select(Location.id).where(Location.id.in_(location_ids)))).scalars().all()
+    )
+    found_products = set(
+        (await db.execute(select(Product.id).where(Product.id.in_(product_ids)))).scalars().all()
+    )
+
+    # Estado actual de los productos involucrados, bloqueado hasta el commit
+    state = {
+        (lid, pid): qty or 0
+        for lid, pid, qty in (
+            await db.execute(
+                select(ProductLocation.location_id, ProductLocation.product_id, ProductLocation.quantity)
+                .where(ProductLocation.product_id.in_(product_ids))
+                .with_for_update()
+            )
+        ).all()
+    }
+    original = dict(state)
+
+    errors = []
+    for i, op in enumerate(ops, start=1):
+        source = (op.location_id, op.product_id)
+        if op.op not in BATCH_OPS:
+            errors.append(f"#{i}: op debe ser uno de: {', '.join(BATCH_OPS)}")
+            continue
+        if op.product_id not in found_products:
+            errors.append(f"#{i}: producto {op.product_id} no encontrado")
+            continue
+        if op.location_id not in found_locations:
+            errors.append(f"#{i}: ubicación {op.location_id} no encontrada")
+            continue
+        if op.op == "set":
+            if op.quantity is None:
+                errors.append(f"#{i}: set requiere quantity")
+                continue
+            state[source] = op.quantity
+            continue
+
+        if not op.to_location_id or op.to_location_id not in found_locations:
+            errors.append(f"#{i}: ubicación destino no válida")
+            continue
+        if op.to_location_id == op.location_id:
+            errors.append(f"#{i}: origen y destino son la misma ubicación")
+            continue
+        if source not in state:
+            errors.append(f"#{i}: el producto {op.product_id} no está en la ubicación {op.location_id}")
+            continue
+        target = (op.to_location_id, op.product_id)
+        if op.op == "move":
+            state[target] = state.get(target, 0) + state.pop(source)
+        else:
+            if not op.quantity:
+                errors.append(f"#{i}: transfer requiere quantity > 0")
+                continue
+            if op.quantity > state[source]:
+                errors.append(f"#{i}: solo hay {state[source]} en la ubicación {op.location_id}")
+                continue
+            state[source] -= op.quantity
+            state[target] = state.get(target, 0) + op.quantity
+
+    if errors:
+        raise HTTPException(400, "Operaciones inválidas: " + "; ".join(errors[:20]))
+
+    # Solo se escriben las diferencias contra el estado original
+    removed = [pair for pair in original if pair not in state]
+    changed = [
+        {"location_id": lid, "product_id": pid, "quantity": qty}
+        for (lid, pid), qty in state.items()
+        if original.get((lid, pid)) != qty
+    ]
+    deleted = await delete_pairs(db, removed)
+    if changed:
+        await upsert_quantities(db, changed)
+    if deleted or changed:
+        await bump_catalog_version(db)
+    await db.commit()
+    return {
+        "message": f"{len(ops)} operación(es) aplicada(s)",
+        "operations": len(ops),
+        "upserted": len(changed),
+        "removed": deleted,
+    }
+
+
 @router.get("/product/{product_id}/locations")
 async def get_product_locations(product_id: int, db: AsyncSession = Depends(get_db)):
     """Obtiene todas las ubicaciones donde está un producto."""
@@ -203,41 +377,32 @@ async def get_product_locations(product_id: int, db: AsyncSession = Depends(get_
 # --- RUTAS DINÁMICAS ---
 
 @router.get("/{location_id}")
-async def get_location_detail(location_id: int, db: AsyncSession = Depends(get_db)):
+async def get_location_detail(
+    location_id: int, fields: Optional[str] = None, db: AsyncSession = Depends(get_db)
+):
+    keys = parse_fields(fields, LOCATION_PRODUCT_FIELDS)
     location = await db.get(Location, location_id)
     if not location:
         raise HTTPException(404, "Ubicación no encontrada")
 
     stmt = (
-        select(ProductLocation, Product)
+        select(*columns(LOCATION_PRODUCT_FIELDS, keys))
+        .select_from(ProductLocation)
         .join(Product, ProductLocation.product_id == Product.id)
         .where(ProductLocation.location_id == location_id)
         .order_by(Product.name.asc())
     )
     result = await db.execute(stmt)
-    products = [
-        {
-            "id": pl.id,
-            "product_id": p.id,
-            "name": p.name,
-            "sku": p.sku or "",
-            "alias": p.alias or "",
-            "image_url": p.image_url or "",
-            "price": p.price,
-            "selling_price": p.selling_price,
-            "quantity": pl.quantity,
-        }
-        for pl, p in result.all()
-    ]
+    products = as_dicts(result.all())
 
-    return {
+    return FastJSONResponse({
         "id": location.id,
         "code": location.code,
         "description": location.description,
         "created_at": location.created_at,
         "products": products,
         "product_count": len(products),
-    }
+    })
 
 
 @router.put("/{location_id}")
@@ -262,6 +427,7 @@ async def update_location(
     if data.description is not None:
         location.description = data.description.strip() if data.description.strip() else None
 
+    await bump_catalog_version(db)
     await db.commit()
     return {"message": "Ubicación actualizada"}
 
@@ -280,7 +446,18 @@ async def delete_location(location_id: int, db: AsyncSession = Depends(get_db)):
     if count.scalar() > 0:
         raise HTTPException(400, "No se puede eliminar: tiene productos asignados")
 
+    # Los conteos cerrados o cancelados pierden sus renglones de esta ubicación (CASCADE)
+    in_open_count = await db.execute(
+        select(CycleCountLocation.cycle_count_id)
+        .join(CycleCount, CycleCount.id == CycleCountLocation.cycle_count_id)
+        .where(CycleCountLocation.location_id == location_id, CycleCount.status == "open")
+        .limit(1)
+    )
+    if in_open_count.scalar() is not None:
+        raise HTTPException(400, "No se puede eliminar: está en un conteo cíclico abierto")
+
     await db.delete(location)
+    await bump_catalog_version(db)
     await db.commit()
     return {"message": "Ubicación eliminada"}
 
@@ -297,26 +474,16 @@ async def add_product_to_location(
     if not product:
         raise HTTPException(404, "Producto no encontrado")
 
-    existing = await db.execute(
-        select(ProductLocation).where(
-            ProductLocation.location_id == location_id,
-            ProductLocation.product_id == data.product_id,
-        )
+    # Upsert: suma a la cantidad existente o crea el renglón
+    await upsert_quantities(
+        db,
+        [{"location_id": location_id, "product_id": data.product_id, "quantity": data.quantity}],
+        increment=True,
     )
-    item = existing.scalar_one_or_none()
-
-    if item:
-        item.quantity += data.quantity
-    else:
-        item = ProductLocation(
-            location_id=location_id,
-            product_id=data.product_id,
-            quantity=data.quantity,
-        )
-        db.add(item)
 
     product_name = product.name
     location_code = location.code
+    await bump_catalog_version(db)
     await db.commit()
 
     return {"message": f"{product_name} agregado a {location_code}"}
@@ -341,6 +508,7 @@ async def update_product_quantity(
         raise HTTPException(404, "Producto no encontrado en esta ubicación")
 
     item.quantity = data.quantity
+    await bump_catalog_version(db)
     await db.commit()
     return {"message": "Cantidad actualizada"}
 
@@ -360,5 +528,6 @@ async def remove_product_from_location(
         raise HTTPException(404, "Producto no encontrado en esta ubicación")
 
     await db.delete(item)
+    await bump_catalog_version(db)
     await db.commit()
     return {"message": "Producto removido de la ubicación"}
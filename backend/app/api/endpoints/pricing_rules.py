@@ -0,0 +1,179 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import Float
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from typing import Optional, List
+from pydantic import BaseModel, Field, model_validator
+
+from app.core.database import get_db
+from app.services.catalog_cache import bump_catalog_version
+from app.services.price_updates import bulk_update_products, insert_price_history
+from app.services.pricing_rules import evaluate_rules
+from app.domain.models import PricingRule, Supplier, Category
+
+router = APIRouter()
+
+RULE_MODES = ("markup", "margin")
+
+
+# --- Schemas ---
+
+class PricingRuleData(BaseModel):
+    name: str = Field(..., min_length=1, max_length=100)
+    supplier_id: Optional[int] = None
+    category_id: Optional[int] = None
+    min_cost: Optional[float] = Field(None, ge=0)
+    max_cost: Optional[float] = Field(None, gt=0)
+    mode: str = "markup"
+    value: float = Field(..., ge=0, le=1000)
+    rounding_step: Optional[float] = Field(None, gt=0)
+    price_ending: Optional[float] = Field(None, ge=0)
+    priority: int = 100
+    is_active: bool = True
+
+    @model_validator(mode="after")
+    def check_rule(self):
+        if self.mode not in RULE_MODES:
+            raise ValueError("mode debe ser 'markup' o 'margin'")
+        if self.mode == "margin" and self.value >= 100:
+            raise ValueError("El margen debe ser menor a 100%")
+        if self.min_cost is not None and self.max_cost is not None and self.min_cost >= self.max_cost:
+            raise ValueError("min_cost debe ser menor que max_cost")
+        return self
+
+
+class RepricingRequest(BaseModel):
+    rule_ids: Optional[List[int]] = None  # Solo estas reglas (por defecto todas las activas)
+    product_ids: Optional[List[int]] = None  # Una lista vacía no reprecia nada
+    supplier_id: Optional[int] = None
+    only_missing_price: bool = False
+    limit: int = Field(200, ge=1, le=5000)  # Filas de detalle en la vista previa
+
+
+def rule_to_dict(rule: PricingRule) -> dict:
+    return {
+        "id": rule.id,
+        "name": rule.name,
+        "supplier_id": rule.supplier_id,
+        "category_id": rule.category_id,
+        "min_cost": rule.min_cost,
+        "max_cost": rule.max_cost,
+        "mode": rule.mode,
+        "value": rule.value,
+        "rounding_step": rule.rounding_step,
+        "price_ending": rule.price_ending,
+        "priority": rule.priority,
+        "is_active": rule.is_active,
+        "created_at": rule.created_at,
+    }
+
+
+async def validate_refs(data: PricingRuleData, db: AsyncSession):
+    if data.supplier_id and not await db.get(Supplier, data.supplier_id):
+        raise HTTPException(404, "Proveedor no encontrado")
+    if data.category_id and not await db.get(Category, data.category_id):
+        raise HTTPException(404, "Categoría no encontrada")
+
+
+# --- RUTAS FIJAS PRIMERO ---
+
+@router.get("")
+async def get_pricing_rules(db: AsyncSession = Depends(get_db)):
+    result = await db.execute(
+        select(PricingRule).order_by(PricingRule.priority.asc(), PricingRule.id.asc())
+    )
+    return [rule_to_dict(r) for r in result.scalars().all()]
+
+
+@router.post("")
+async def create_pricing_rule(data: PricingRuleData, db: AsyncSession = Depends(get_db)):
+    await validate_refs(data, db)
+    rule = PricingRule(**data.model_dump())
+    rule.name = data.name.strip()
+    db.add(rule)
+    await db.commit()
+    await db.refresh(rule)
+    return rule_to_dict(rule)
+
+
+@router.post("/preview")
+async def preview_repricing(data: RepricingRequest, db: AsyncSession = Depends(get_db)):
+    """Calcula los nuevos precios sin guardar nada."""
+    result = await evaluate_rules(
+        db,
+        rule_ids=data.rule_ids,
+        product_ids=data.product_ids,
+        supplier_id=data.supplier_id,
+        only_missing_price=data.only_missing_price,
+    )
+    return {
+        "evaluated": result.evaluated,
+        "matched": result.matched,
+        "changed": int(result.changed.sum()),
+        "items": result.changes(limit=data.limit),
+    }
+
+
+@router.post("/apply")
+async def apply_repricing(data: RepricingRequest, db: AsyncSession = Depends(get_db)):
+    """Aplica los precios calculados y registra el historial en bloque."""
+    result = await evaluate_rules(
+        db,
+        rule_ids=data.rule_ids,
+        product_ids=data.product_ids,
+        supplier_id=data.supplier_id,
+        only_missing_price=data.only_missing_price,
+    )
+    changes = result.changes()
+    await insert_price_history(
+        db,
+        [
+            {
+                "product_id": c["id"],
+                "change_type": "PRECIO",
+                "old_value": c["old_price"],
+                "new_value": c["new_price"],
+            }
+            for c in changes
+        ],
+    )
+    await bulk_update_products(
+        db,
+        [{"id": c["id"], "selling_price": c["new_price"]} for c in changes],
+        {"selling_price": Float()},
+    )
+    await bump_catalog_version(db)
+    await db.commit()
+    return {
+        "message": f"{len(changes)} precios actualizados",
+        "evaluated": result.evaluated,
+        "matched": result.matched,
+        "updated": len(changes),
+    }
+
+
+# --- RUTAS DINÁMICAS ---
+
+@router.put("/{rule_id}")
+async def update_pricing_rule(
+    rule_id: int, data: PricingRuleData, db: AsyncSession = Depends(get_db)
+):
+    rule = await db.get(PricingRule, rule_id)
+    if not rule:
+        raise HTTPException(404, "Regla no encontrada")
+    await validate_refs(data, db)
+    for key, value in data.model_dump().items():
+        setattr(rule, key, value)
+    rule.name = data.name.strip()
+    await db.commit()
+    return {"message": "Regla actualizada"}
+
+
+@router.delete("/{rule_id}")
+async def delete_pricing_rule(rule_id: int, db: AsyncSession = Depends(get_db)):
+    rule = await db.get(PricingRule, rule_id)
+    if not rule:
+        raise HTTPException(404, "Regla no encontrada")
+    await db.delete(rule)
+    await db.commit()
+    return {"message": "Regla eliminada"}
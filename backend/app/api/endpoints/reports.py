@@ -1,20 +1,100 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import func, desc
+from sqlalchemy import func, desc, cast, tuple_, Date, literal_column
+from typing import List, Optional
+from pydantic import BaseModel
 from app.core.database import get_db
-from app.domain.models import StockHistory, Product, Supplier
+from app.core.serialization import FastJSONResponse
+from app.domain.models import StockHistory, StockDailyRollup, InventorySnapshot, Product, Supplier
+from app.services.catalog_analytics import catalog_analytics
+from app.services.catalog_cache import bump_catalog_version, get_catalog_version
+from app.services.cursors import decode_cursor, encode_cursor
+from app.services.inventory_snapshots import snapshot_to_dict, take_snapshot, valuation_at
+from app.services.history_partitions import HISTORY_RETENTION_MONTHS, archived_until, run_history_maintenance
+from app.services.stock_reconciliation import apply_reconciliation, reconciliation_report
+from app.services.stock_rollups import COUNTERS, rebuild_stock_rollups
+from datetime import datetime, date, timedelta, timezone
 
 router = APIRouter()
 
+_summary_cache: dict = {}
+_history_totals: dict = {}
+
+TREND_BUCKETS = ("day", "week", "month", "quarter", "year")
+TREND_GROUPS = ("none", "product", "supplier")
+
+
+def escape_like(value: str) -> str:
+    """Escapa caracteres especiales de LIKE para evitar inyección en patrones."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
 
 @router.get("/stock-history")
 async def get_stock_history(
     q: str = None,
+    product_id: Optional[int] = None,
+    source: Optional[str] = None,
+    change_type: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
     limit: int = 50,
     offset: int = 0,
+    cursor: Optional[str] = None,
+    with_total: bool = True,
     db: AsyncSession = Depends(get_db),
 ):
+    """
+    Movimientos de stock, más recientes primero. Paginación keyset por
+    (fecha, id) con `cursor` (usa `next_cursor` de la página anterior);
+    `offset` se mantiene para la paginación numerada. `total` cuenta los
+    movimientos que cumplen todos los filtros (null con `with_total=false`).
+    """
+    limit = min(max(limit, 1), 200)
+
+    filters = []
+    if product_id:
+        filters.append(StockHistory.product_id == product_id)
+    if source:
+        filters.append(StockHistory.source == source)
+    if change_type:
+        filters.append(StockHistory.change_type == change_type.upper())
+    if date_from:
+        filters.append(StockHistory.date >= datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        filters.append(
+            StockHistory.date < datetime.combine(date_to + timedelta(days=1), datetime.min.time())
+        )
+    if q:
+        # Se resuelven primero los productos: el recorrido de stock_history
+        # sigue el índice (fecha, id) / (producto, fecha, id)
+        q_safe = escape_like(q[:200])
+        filters.append(
+            StockHistory.product_id.in_(
+                select(Product.id).where(
+                    Product.name.ilike(f"%{q_safe}%") | Product.sku.ilike(f"%{q_safe}%")
+                )
+            )
+        )
+
+    # Total opcional, guardado por versión del catálogo (toda escritura de stock la incrementa)
+    total = None
+    if with_total:
+        version = await get_catalog_version(db)
+        key = (version, q, product_id, source, change_type, date_from, date_to)
+        if key not in _history_totals:
+            if len(_history_totals) >= 256 or any(k[0] != version for k in _history_totals):
+                _history_totals.clear()
+            # Mismo JOIN que el listado: el total coincide con las filas paginables
+            _history_totals[key] = (
+                await db.execute(
+                    select(func.count(StockHistory.id))
+                    .join(Product, StockHistory.product_id == Product.id)
+                    .where(*filters)
+                )
+            ).scalar() or 0
+        total = _history_totals[key]
+
     stmt = (
         select(
             StockHistory.id,
@@ -28,20 +108,22 @@ async def get_stock_history(
             Product.sku,
         )
         .join(Product, StockHistory.product_id == Product.id)
-        .order_by(desc(StockHistory.date))
+        .where(*filters)
+        .order_by(desc(StockHistory.date), desc(StockHistory.id))
+        .limit(limit)
     )
+    if cursor:
+        last_date, last_id = decode_cursor(cursor, datetime, int)
+        stmt = stmt.where(tuple_(StockHistory.date, StockHistory.id) < (last_date, last_id))
+    elif offset > 0:
+        stmt = stmt.offset(offset)
 
-    if q:
-        stmt = stmt.where(Product.name.ilike(f"%{q}%") | Product.sku.ilike(f"%{q}%"))
-
-    count_subq = stmt.subquery()
-    total = (await db.execute(select(func.count(count_subq.c.id)))).scalar() or 0
-
-    stmt = stmt.limit(min(limit, 200)).offset(max(offset, 0))
     rows = (await db.execute(stmt)).all()
+    next_cursor = encode_cursor(rows[-1].date, rows[-1].id) if len(rows) == limit else None
 
     return {
         "total": total,
+        "next_cursor": next_cursor,
         "items": [
             {
                 "id": r.id,
@@ -62,60 +144,224 @@ async def get_stock_history(
 
 @router.get("/summary")
 async def get_inventory_summary(db: AsyncSession = Depends(get_db)):
-    # Total productos
-    total_products = (await db.execute(select(func.count(Product.id)))).scalar() or 0
+    # Todas las escrituras de stock y precios incrementan la versión del
+    # catálogo; mientras no cambie (ni el día) el resumen sale de memoria.
+    today_start = datetime.combine(date.today(), datetime.min.time())
+    key = (await get_catalog_version(db), today_start)
+    if _summary_cache.get("key") == key:
+        return _summary_cache["data"]
 
-    # Valor de inventario (stock × costo y stock × precio venta)
-    value_result = (
+    # Movimientos hoy
+    movements_today = (
+        select(func.count(StockHistory.id))
+        .where(StockHistory.date >= today_start)
+        .scalar_subquery()
+    )
+    # Un solo recorrido de products con FILTER para cada conteo
+    row = (
         await db.execute(
             select(
+                func.count(Product.id).label("total_products"),
                 func.sum(Product.stock_quantity * Product.price).label("cost_value"),
                 func.sum(Product.stock_quantity * Product.selling_price).label("sale_value"),
+                func.count(Product.id)
+                .filter((Product.selling_price == None) | (Product.selling_price == 0))
+                .label("no_price"),
+                func.count(Product.id)
+                .filter(Product.selling_price > 0, Product.price > Product.selling_price)
+                .label("negative_margin"),
+                func.count(Product.id).filter(Product.stock_quantity <= 0).label("no_stock"),
+                movements_today.label("movements_today"),
             )
         )
     ).one()
 
-    # Sin precio de venta
-    no_price = (
-        await db.execute(
-            select(func.count(Product.id)).where(
-                (Product.selling_price == None) | (Product.selling_price == 0)
-            )
-        )
-    ).scalar() or 0
+    data = {
+        "total_products": row.total_products or 0,
+        "cost_value": round(row.cost_value or 0, 2),
+        "sale_value": round(row.sale_value or 0, 2),
+        "no_price": row.no_price or 0,
+        "negative_margin": row.negative_margin or 0,
+        "no_stock": row.no_stock or 0,
+        "movements_today": row.movements_today or 0,
+    }
+    _summary_cache.update(key=key, data=data)
+    return data
 
-    # Margen negativo (costo > precio venta)
-    negative_margin = (
-        await db.execute(
-            select(func.count(Product.id)).where(
-                Product.selling_price > 0,
-                Product.price > Product.selling_price,
-            )
-        )
-    ).scalar() or 0
 
-    # Sin stock
-    no_stock = (
-        await db.execute(
-            select(func.count(Product.id)).where(Product.stock_quantity <= 0)
-        )
-    ).scalar() or 0
+@router.get("/analytics")
+async def get_catalog_analytics(top: int = 20, db: AsyncSession = Depends(get_db)):
+    """
+    Distribución de márgenes, atípicos por categoría, precios rezagados frente
+    a alzas de costo y productos con mayor valor en riesgo. Se recalcula solo
+    cuando cambia la versión del catálogo.
+    """
+    data = await catalog_analytics(db, top=min(max(top, 1), 100))
+    return FastJSONResponse(data)
 
-    # Movimientos hoy
-    from datetime import datetime, date
-    today_start = datetime.combine(date.today(), datetime.min.time())
-    movements_today = (
-        await db.execute(
-            select(func.count(StockHistory.id)).where(StockHistory.date >= today_start)
-        )
-    ).scalar() or 0
 
+@router.get("/stock-trends")
+async def get_stock_trends(
+    bucket: str = "day",
+    group_by: str = "none",
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    product_id: Optional[int] = None,
+    supplier_id: Optional[int] = None,
+    limit: int = 5000,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Series de entradas/salidas por periodo, leídas del resumen diario
+    (stock_daily_rollups), nunca del historial crudo.
+    """
+    if bucket not in TREND_BUCKETS:
+        raise HTTPException(400, f"bucket debe ser uno de: {', '.join(TREND_BUCKETS)}")
+    if group_by not in TREND_GROUPS:
+        raise HTTPException(400, f"group_by debe ser uno de: {', '.join(TREND_GROUPS)}")
+    end = end or date.today()
+    start = start or end - timedelta(days=365)
+    if start > end:
+        raise HTTPException(400, "start debe ser anterior a end")
+
+    r = StockDailyRollup
+    # bucket ya validado: literal para que SELECT y GROUP BY sean la misma expresión
+    period = cast(func.date_trunc(literal_column(f"'{bucket}'"), r.day), Date).label("period")
+    keys = [period]
+    if group_by == "product":
+        keys.append(r.product_id.label("key"))
+    elif group_by == "supplier":
+        keys.append(Product.supplier_id.label("key"))
+
+    stmt = (
+        select(*keys, *[func.sum(getattr(r, c)).label(c) for c in COUNTERS])
+        .where(r.day >= start, r.day <= end)
+        .group_by(*keys)
+        .order_by(*keys)
+        .limit(min(max(limit, 1), 20000))
+    )
+    if supplier_id or group_by == "supplier":
+        stmt = stmt.join(Product, Product.id == r.product_id)
+    if supplier_id:
+        stmt = stmt.where(Product.supplier_id == supplier_id)
+    if product_id:
+        stmt = stmt.where(r.product_id == product_id)
+
+    rows = (await db.execute(stmt)).all()
     return {
-        "total_products": total_products,
-        "cost_value": round(value_result.cost_value or 0, 2),
-        "sale_value": round(value_result.sale_value or 0, 2),
-        "no_price": no_price,
-        "negative_margin": negative_margin,
-        "no_stock": no_stock,
-        "movements_today": movements_today,
+        "bucket": bucket,
+        "group_by": group_by,
+        "start": start,
+        "end": end,
+        "items": [
+            {
+                "period": row.period,
+                **({"key": row.key} if group_by != "none" else {}),
+                **{c: int(getattr(row, c) or 0) for c in COUNTERS},
+                "net": int((row.qty_in or 0) - (row.qty_out or 0)),
+            }
+            for row in rows
+        ],
     }
+
+
+@router.post("/stock-trends/rebuild")
+async def rebuild_stock_trends(since: Optional[date] = None, db: AsyncSession = Depends(get_db)):
+    """
+    Recalcula el resumen diario desde el historial (desde `since` o desde el
+    mes más antiguo que sigue en la tabla). Los meses archivados por la
+    retención solo existen en el resumen, así que no se tocan.
+    """
+    floor = await archived_until(db, StockHistory.__tablename__)
+    if floor and since and since < floor:
+        raise HTTPException(
+            400, f"El historial anterior a {floor.isoformat()} está archivado; usa since >= esa fecha"
+        )
+    since = since or floor
+    rows = await rebuild_stock_rollups(db, since)
+    await db.commit()
+    return {"message": "Resumen diario reconstruido", "rows": rows, "since": since}
+
+
+@router.post("/history-maintenance")
+async def run_history_retention(
+    retention_months: int = HISTORY_RETENTION_MONTHS, db: AsyncSession = Depends(get_db)
+):
+    """
+    Crea las particiones mensuales próximas del historial y archiva las que
+    superan la retención (se resumen y se separan de la tabla).
+    """
+    if retention_months < 1:
+        raise HTTPException(400, "retention_months debe ser al menos 1")
+    result = await run_history_maintenance(db, retention_months)
+    await db.commit()
+    return result
+
+
+@router.post("/snapshots")
+async def create_inventory_snapshot(full: bool = False, db: AsyncSession = Depends(get_db)):
+    """Toma un snapshot ahora (delta salvo que toque completo o `full=true`)."""
+    snap = await take_snapshot(db, source="manual", force_full=full)
+    await db.commit()
+    await db.refresh(snap)
+    return snapshot_to_dict(snap)
+
+
+@router.get("/snapshots")
+async def get_inventory_snapshots(limit: int = 50, offset: int = 0, db: AsyncSession = Depends(get_db)):
+    result = await db.execute(
+        select(InventorySnapshot)
+        .order_by(desc(InventorySnapshot.taken_at), desc(InventorySnapshot.id))
+        .limit(min(max(limit, 1), 200))
+        .offset(max(offset, 0))
+    )
+    return [snapshot_to_dict(s) for s in result.scalars().all()]
+
+
+@router.get("/valuation")
+async def get_inventory_valuation(
+    at: datetime,
+    detail: bool = False,
+    limit: int = 50,
+    offset: int = 0,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Valor del inventario en la fecha `at` (ej: 2025-03-31T23:59:59), desde el
+    último snapshot anterior más los movimientos posteriores a él.
+    """
+    if at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    return await valuation_at(
+        db, at, detail=detail, limit=min(max(limit, 1), 500), offset=max(offset, 0)
+    )
+
+
+class ReconciliationApply(BaseModel):
+    product_ids: Optional[List[int]] = None  # Sin lista: todos los que difieren
+    include_unlocated: bool = False
+
+
+@router.get("/reconciliation")
+async def get_stock_reconciliation(
+    include_unlocated: bool = False,
+    limit: int = 50,
+    offset: int = 0,
+    db: AsyncSession = Depends(get_db),
+):
+    """Productos cuyo stock global no coincide con la suma de sus anaqueles."""
+    return FastJSONResponse(
+        await reconciliation_report(
+            db, include_unlocated, limit=min(max(limit, 1), 500), offset=max(offset, 0)
+        )
+    )
+
+
+@router.post("/reconciliation/apply")
+async def apply_stock_reconciliation(data: ReconciliationApply, db: AsyncSession = Depends(get_db)):
+    """Iguala el stock a los anaqueles y registra cada corrección como AJUSTE."""
+    adjusted = await apply_reconciliation(db, data.product_ids, data.include_unlocated)
+    if adjusted:
+        await bump_catalog_version(db)
+    await db.commit()
+    return {"message": f"{adjusted} producto(s) ajustado(s)", "adjusted": adjusted}
@@ -7,6 +7,8 @@ from typing import Optional
 from pydantic import BaseModel
 
 from app.core.database import get_db
+from app.services.catalog_cache import bump_catalog_version
+from app.services.supplier_offers import cheapest_supplier_id
 from app.domain.models import ShoppingList, ShoppingListItem, Product, Supplier
 
 router = APIRouter()
@@ -15,6 +17,7 @@ router = APIRouter()
 class AddItemRequest(BaseModel):
     product_id: int
     quantity: int = 1
+    prefer_cheapest: bool = False  # Usar el proveedor con el último costo más bajo
 
 
 class UpdateItemRequest(BaseModel):
@@ -123,12 +126,16 @@ async def add_item_to_list(data: AddItemRequest, db: AsyncSession = Depends(get_
     if not product:
         raise HTTPException(404, "Producto no encontrado")
 
-    if not product.supplier_id:
+    supplier_id = product.supplier_id
+    if data.prefer_cheapest:
+        supplier_id = await cheapest_supplier_id(db, product.id) or supplier_id
+
+    if not supplier_id:
         raise HTTPException(400, "Este producto no tiene proveedor asignado")
 
     # 2. Buscar lista activa del proveedor
     stmt = select(ShoppingList).where(
-        ShoppingList.supplier_id == product.supplier_id,
+        ShoppingList.supplier_id == supplier_id,
         ShoppingList.status == "active",
     )
     result = await db.execute(stmt)
@@ -137,7 +144,7 @@ async def add_item_to_list(data: AddItemRequest, db: AsyncSession = Depends(get_
     # 3. Si no hay lista activa, crear una
     if not shopping_list:
         shopping_list = ShoppingList(
-            supplier_id=product.supplier_id,
+            supplier_id=supplier_id,
             status="active",
         )
         db.add(shopping_list)
@@ -165,9 +172,10 @@ async def add_item_to_list(data: AddItemRequest, db: AsyncSession = Depends(get_
     shopping_list.updated_at = datetime.utcnow()
 
     # Guardar valores antes del commit para evitar MissingGreenlet
-    saved_supplier_id = product.supplier_id
+    saved_supplier_id = supplier_id
     saved_list_id = shopping_list.id
 
+    await bump_catalog_version(db)
     await db.commit()
 
     # Obtener nombre del proveedor usando el valor guardado
@@ -202,6 +210,7 @@ async def update_item(
     if sl:
         sl.updated_at = datetime.utcnow()
 
+    await bump_catalog_version(db)
     await db.commit()
     return {"message": "Actualizado"}
 
@@ -216,6 +225,7 @@ async def delete_item(
         raise HTTPException(404, "Item no encontrado")
 
     await db.delete(item)
+    await bump_catalog_version(db)
     await db.commit()
     return {"message": "Item eliminado"}
 
@@ -234,6 +244,7 @@ async def update_status(
 
     sl.status = data.status
     sl.updated_at = datetime.utcnow()
+    await bump_catalog_version(db)
     await db.commit()
     return {"message": f"Lista marcada como {data.status}"}
 
@@ -249,6 +260,7 @@ async def update_notes(
 
     sl.notes = data.notes
     sl.updated_at = datetime.utcnow()
+    await bump_catalog_version(db)
     await db.commit()
     return {"message": "Notas actualizadas"}
 
@@ -261,5 +273,6 @@ async def delete_shopping_list(list_id: int, db: AsyncSession = Depends(get_db))
         raise HTTPException(404, "Lista no encontrada")
 
     await db.delete(sl)
+    await bump_catalog_version(db)
     await db.commit()
     return {"message": "Lista eliminada"}
@@ -1,12 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, Body
+from datetime import date, datetime, timedelta
+from fastapi import APIRouter, Depends, HTTPException, Body, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import func, update, or_
+from sqlalchemy import func, update, delete, or_, and_, cast, Date, literal_column, tuple_
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array_agg
 from typing import Optional, List
-from pydantic import BaseModel
-
-from app.core.database import get_db
-from app.domain.models import Supplier, Product
+from pydantic import BaseModel, Field
+
+from app.core.database import SessionLocal, get_db
+from app.core.serialization import FastJSONResponse, dumps
+from app.services.catalog_cache import bump_catalog_version, cached_json_response
+from app.services.catalog_export import EXPORT_CHUNK_SIZE, EXPORT_MEDIA_TYPES
+from app.services.cursors import decode_cursor, encode_cursor
+from app.services.product_queries import SUPPLIER_PRODUCT_FIELDS, as_dicts, columns, parse_fields
+from app.services.supplier_offers import cheapest_offers, latest_offers
+from app.services.supplier_inference import INFERENCE_MIN_CONFIDENCE, apply_inferred_suppliers, preview_statement
+from app.services.supplier_spend import refresh_supplier_spend
+from app.domain.models import Supplier, Product, SupplierOffer, SupplierMonthlySpend
 
 router = APIRouter()
 
@@ -33,24 +44,27 @@ class BulkAssignRequest(BaseModel):
 # --- RUTAS FIJAS PRIMERO (antes de /{supplier_id}) ---
 
 @router.get("")
-async def get_suppliers(db: AsyncSession = Depends(get_db)):
-    stmt = (
-        select(Supplier, func.count(Product.id).label("product_count"))
-        .outerjoin(Product, Supplier.id == Product.supplier_id)
-        .group_by(Supplier.id)
-        .order_by(Supplier.name.asc())
-    )
-    result = await db.execute(stmt)
-    return [
-        {
-            "id": s.id,
-            "rfc": s.rfc,
-            "name": s.name,
-            "created_at": s.created_at,
-            "product_count": count,
-        }
-        for s, count in result.all()
-    ]
+async def get_suppliers(request: Request, db: AsyncSession = Depends(get_db)):
+    async def build():
+        stmt = (
+            select(Supplier, func.count(Product.id).label("product_count"))
+            .outerjoin(Product, Supplier.id == Product.supplier_id)
+            .group_by(Supplier.id)
+            .order_by(Supplier.name.asc())
+        )
+        result = await db.execute(stmt)
+        return [
+            {
+                "id": s.id,
+                "rfc": s.rfc,
+                "name": s.name,
+                "created_at": s.created_at,
+                "product_count": count,
+            }
+            for s, count in result.all()
+        ]
+
+    return await cached_json_response(request, db, build)
 
 
 @router.post("")
@@ -66,6 +80,7 @@ async def create_supplier(data: SupplierCreate, db: AsyncSession = Depends(get_d
 
     supplier = Supplier(rfc=clean_rfc, name=data.name.strip())
     db.add(supplier)
+    await bump_catalog_version(db)
     await db.commit()
     await db.refresh(supplier)
     return {"id": supplier.id, "rfc": supplier.rfc, "name": supplier.name}
@@ -86,6 +101,7 @@ async def bulk_assign_supplier(
         .where(Product.id.in_(data.product_ids))
         .values(supplier_id=data.supplier_id)
     )
+    await bump_catalog_version(db)
     await db.commit()
     return {"message": f"{len(data.product_ids)} productos asignados a {supplier_name}"}
 
@@ -118,42 +134,345 @@ async def get_unassigned_products(
     ]
 
 
-# --- RUTAS DINÁMICAS CON /{supplier_id} ---
+class InferenceApply(BaseModel):
+    min_confidence: float = Field(INFERENCE_MIN_CONFIDENCE, gt=0, le=1)
+    product_ids: Optional[List[int]] = None  # Sin lista: todos los que pasen el umbral
+
+
+@router.get("/inference")
+async def preview_supplier_inference(
+    min_confidence: float = Query(INFERENCE_MIN_CONFIDENCE, ge=0, le=1),
+    limit: int = 100,
+    offset: int = 0,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Proveedor sugerido para productos sin asignar según los lotes en que
+    aparecen. `confidence` es la parte de la evidencia que apoya al candidato.
+    """
+    stmt = preview_statement(min_confidence).subquery()
+    total = (await db.execute(select(func.count()).select_from(stmt))).scalar() or 0
+    rows = (
+        await db.execute(
+            select(stmt)
+            .order_by(stmt.c.confidence.desc(), stmt.c.batches.desc(), stmt.c.product_id)
+            .limit(min(max(limit, 1), 1000))
+            .offset(max(offset, 0))
+        )
+    ).all()
+    return FastJSONResponse({
+        "total": total,
+        "items": [
+            {**r._asdict(), "confidence": round(r.confidence, 3)}
+            for r in rows
+        ],
+    })
+
+
+@router.post("/inference/apply")
+async def apply_supplier_inference(data: InferenceApply, db: AsyncSession = Depends(get_db)):
+    """Asigna en un solo UPDATE el proveedor sugerido a los que pasen el umbral."""
+    assigned = await apply_inferred_suppliers(db, data.min_confidence, data.product_ids)
+    if assigned:
+        await bump_catalog_version(db)
+    await db.commit()
+    return {"message": f"{assigned} productos asignados", "assigned": assigned}
 
-@router.get("/{supplier_id}")
-async def get_supplier_detail(supplier_id: int, db: AsyncSession = Depends(get_db)):
-    supplier = await db.get(Supplier, supplier_id)
-    if not supplier:
-        raise HTTPException(404, "Proveedor no encontrado")
 
+@router.get("/offers/cheapest")
+async def get_cheapest_offers(
+    only_savings: bool = True,
+    supplier_id: Optional[int] = None,
+    limit: int = 100,
+    offset: int = 0,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Proveedor más barato por producto según el último costo facturado por
+    cada uno, comparado con el último costo del proveedor asignado.
+    `only_savings` deja solo los productos donde otro proveedor es más barato.
+    """
+    cheapest = cheapest_offers()
+    current = latest_offers()
+    cheap_sup = Supplier.__table__.alias("cheap_sup")
+    savings = (current.c.unit_cost - cheapest.c.unit_cost).label("savings")
     stmt = (
-        select(Product)
-        .where(Product.supplier_id == supplier_id)
-        .order_by(Product.name.asc())
+        select(
+            Product.id,
+            Product.name,
+            Product.sku,
+            Product.supplier_id,
+            current.c.unit_cost.label("current_cost"),
+            cheapest.c.supplier_id.label("cheapest_supplier_id"),
+            cheap_sup.c.name.label("cheapest_supplier_name"),
+            cheapest.c.unit_cost.label("cheapest_cost"),
+            cheapest.c.date.label("cheapest_date"),
+            cheapest.c.supplier_count,
+            savings,
+        )
+        .join(cheapest, cheapest.c.product_id == Product.id)
+        .join(cheap_sup, cheap_sup.c.id == cheapest.c.supplier_id)
+        .outerjoin(
+            current,
+            and_(current.c.product_id == Product.id, current.c.supplier_id == Product.supplier_id),
+        )
     )
-    result = await db.execute(stmt)
-    products = [
+    if supplier_id:
+        stmt = stmt.where(Product.supplier_id == supplier_id)
+    if only_savings:
+        stmt = stmt.where(cheapest.c.supplier_id != Product.supplier_id, savings > 0)
+    stmt = (
+        stmt.order_by(savings.desc().nullslast(), Product.id)
+        .limit(min(max(limit, 1), 500))
+        .offset(max(offset, 0))
+    )
+    rows = (await db.execute(stmt)).all()
+    return [
         {
-            "id": p.id,
-            "name": p.name,
-            "alias": p.alias or "",
-            "sku": p.sku or "",
-            "upc": p.upc or "",
-            "price": p.price,
-            "selling_price": p.selling_price,
-            "stock": p.stock_quantity,
+            "product_id": r.id,
+            "name": r.name,
+            "sku": r.sku or "",
+            "supplier_id": r.supplier_id,
+            "current_cost": r.current_cost,
+            "cheapest_supplier_id": r.cheapest_supplier_id,
+            "cheapest_supplier_name": r.cheapest_supplier_name or "",
+            "cheapest_cost": r.cheapest_cost,
+            "cheapest_date": r.cheapest_date,
+            "supplier_count": r.supplier_count,
+            "savings": round(r.savings, 2) if r.savings is not None else None,
         }
-        for p in result.scalars().all()
+        for r in rows
     ]
 
-    return {
+
+@router.get("/analytics/spend")
+async def get_supplier_spend(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    supplier_id: Optional[int] = None,
+    monthly: bool = False,
+    limit: int = 50,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Gasto, lotes, piezas y cambio promedio de costo por proveedor, desde el
+    resumen mensual (supplier_monthly_spend). Las fechas se redondean al mes.
+    Con `monthly` se agrega la serie mes a mes.
+    """
+    S = SupplierMonthlySpend
+    filters = []
+    if date_from:
+        filters.append(S.month >= date_from.replace(day=1))
+    if date_to:
+        filters.append(S.month <= date_to.replace(day=1))
+    if supplier_id:
+        filters.append(S.supplier_id == supplier_id)
+
+    def totals(*group):
+        return (
+            *group,
+            func.sum(S.batches).label("batches"),
+            func.sum(S.lines).label("lines"),
+            func.sum(S.units).label("units"),
+            func.sum(S.spend).label("spend"),
+            (func.sum(S.cost_change_sum) / func.nullif(func.sum(S.cost_change_lines), 0)).label(
+                "avg_cost_change"
+            ),
+        )
+
+    spend = func.sum(S.spend)
+    rows = (
+        await db.execute(
+            select(*totals(S.supplier_id, Supplier.name, func.sum(spend).over().label("grand_total")))
+            .outerjoin(Supplier, Supplier.id == S.supplier_id)
+            .where(*filters)
+            .group_by(S.supplier_id, Supplier.name)
+            .order_by(spend.desc(), S.supplier_id)
+            .limit(min(max(limit, 1), 500))
+        )
+    ).all()
+    grand_total = rows[0].grand_total if rows else 0
+
+    def as_dict(r) -> dict:
+        return {
+            "batches": int(r.batches or 0),
+            "lines": int(r.lines or 0),
+            "units": round(r.units or 0, 2),
+            "spend": round(r.spend or 0, 2),
+            "avg_cost_change_pct": round(r.avg_cost_change * 100, 2) if r.avg_cost_change is not None else None,
+        }
+
+    data = {
+        "total_spend": round(grand_total or 0, 2),
+        "suppliers": [
+            {
+                "supplier_id": r.supplier_id,
+                "name": r.name or "",
+                **as_dict(r),
+                "share_pct": round(100 * (r.spend or 0) / grand_total, 2) if grand_total else 0,
+            }
+            for r in rows
+        ],
+    }
+    if monthly:
+        months = (
+            await db.execute(select(*totals(S.month)).where(*filters).group_by(S.month).order_by(S.month))
+        ).all()
+        data["months"] = [{"month": r.month, **as_dict(r)} for r in months]
+    return FastJSONResponse(data)
+
+
+@router.post("/analytics/spend/rebuild")
+async def rebuild_supplier_spend(db: AsyncSession = Depends(get_db)):
+    """Recalcula el resumen mensual completo desde las líneas de lote."""
+    rows = await refresh_supplier_spend(db)
+    await db.commit()
+    return {"message": "Gasto por proveedor recalculado", "rows": rows}
+
+
+@router.get("/offers/products/{product_id}")
+async def get_product_offers(product_id: int, db: AsyncSession = Depends(get_db)):
+    """Comparativo de proveedores para un producto: último costo y rango histórico."""
+    O = SupplierOffer
+    rows = (
+        await db.execute(
+            select(
+                O.supplier_id,
+                Supplier.name,
+                array_agg(aggregate_order_by(O.unit_cost, O.date.desc()))[1].label("last_cost"),
+                func.max(O.date).label("last_date"),
+                func.min(O.unit_cost).label("min_cost"),
+                func.max(O.unit_cost).label("max_cost"),
+                func.avg(O.unit_cost).label("avg_cost"),
+                func.count().label("offers"),
+            )
+            .join(Supplier, Supplier.id == O.supplier_id)
+            .where(O.product_id == product_id)
+            .group_by(O.supplier_id, Supplier.name)
+        )
+    ).all()
+    items = sorted(
+        (
+            {
+                "supplier_id": r.supplier_id,
+                "supplier_name": r.name or "",
+                "last_cost": r.last_cost,
+                "last_date": r.last_date,
+                "min_cost": r.min_cost,
+                "max_cost": r.max_cost,
+                "avg_cost": round(r.avg_cost, 4),
+                "offers": r.offers,
+            }
+            for r in rows
+        ),
+        key=lambda x: x["last_cost"],
+    )
+    return {"product_id": product_id, "suppliers": items}
+
+
+# --- RUTAS DINÁMICAS CON /{supplier_id} ---
+
+def supplier_products_statement(supplier_id: int, keys: List[str], q: Optional[str] = None):
+    stmt = select(*columns(SUPPLIER_PRODUCT_FIELDS, keys)).where(Product.supplier_id == supplier_id)
+    if q:
+        q_safe = escape_like(q[:200])
+        stmt = stmt.where(
+            or_(
+                func.unaccent(Product.name).ilike(func.unaccent(f"%{q_safe}%")),
+                Product.sku.ilike(f"%{q_safe}%"),
+                Product.upc.ilike(f"%{q_safe}%"),
+                func.unaccent(Product.alias).ilike(func.unaccent(f"%{q_safe}%")),
+            )
+        )
+    return stmt
+
+
+@router.get("/{supplier_id}")
+async def get_supplier_detail(
+    supplier_id: int,
+    fields: Optional[str] = None,
+    q: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Proveedor y sus productos ordenados por nombre. Con `limit` se pagina
+    por keyset: `next_cursor` se pasa como `cursor` para la página siguiente.
+    Sin `limit` se devuelven todos (compatibilidad).
+    """
+    keys = parse_fields(fields, SUPPLIER_PRODUCT_FIELDS)
+    # Total de productos del proveedor en la misma consulta (agregado)
+    count = select(func.count(Product.id)).where(Product.supplier_id == Supplier.id).scalar_subquery()
+    row = (
+        await db.execute(select(Supplier, count.label("product_count")).where(Supplier.id == supplier_id))
+    ).first()
+    if not row:
+        raise HTTPException(404, "Proveedor no encontrado")
+    supplier, product_count = row
+
+    # id y nombre hacen falta para el cursor aunque no se hayan pedido
+    paged = limit is not None or cursor is not None
+    sql_keys = [k for k in SUPPLIER_PRODUCT_FIELDS if k in keys or (paged and k in ("id", "name"))]
+    # Literal en línea: así la expresión coincide con ix_products_supplier_name_id
+    name = func.coalesce(Product.name, literal_column("''"))
+    stmt = supplier_products_statement(supplier_id, sql_keys, q).order_by(name, Product.id)
+    if cursor:
+        c_name, c_id = decode_cursor(cursor, str, int)
+        stmt = stmt.where(tuple_(name, Product.id) > (c_name, c_id))
+    if paged:
+        limit = min(max(limit or 100, 1), 1000)
+        stmt = stmt.limit(limit + 1)
+    products = as_dicts((await db.execute(stmt)).all())
+
+    next_cursor = None
+    if paged and len(products) > limit:
+        products = products[:limit]
+        last = products[-1]
+        next_cursor = encode_cursor(last["name"] or "", last["id"])
+    if paged:
+        for item in products:
+            for k in ("id", "name"):
+                if k not in keys:
+                    item.pop(k, None)
+
+    return FastJSONResponse({
         "id": supplier.id,
         "rfc": supplier.rfc,
         "name": supplier.name,
         "created_at": supplier.created_at,
         "products": products,
-        "product_count": len(products),
-    }
+        "product_count": product_count,
+        "next_cursor": next_cursor,
+    })
+
+
+@router.get("/{supplier_id}/products/export")
+async def export_supplier_products(
+    supplier_id: int,
+    fields: Optional[str] = None,
+    q: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Productos del proveedor en NDJSON, una línea por producto, en streaming."""
+    keys = parse_fields(fields, SUPPLIER_PRODUCT_FIELDS)
+    if not await db.get(Supplier, supplier_id):
+        raise HTTPException(404, "Proveedor no encontrado")
+    stmt = supplier_products_statement(supplier_id, keys, q).order_by(Product.name, Product.id)
+
+    async def stream():
+        # Sesión propia: el streaming sigue después de que termina la petición
+        async with SessionLocal() as session:
+            result = await session.stream(stmt.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+            async for rows in result.partitions():
+                yield b"".join(dumps(r._asdict()) + b"\n" for r in rows)
+
+    filename = f"proveedor_{supplier_id}_{datetime.now():%Y%m%d_%H%M}.ndjson"
+    return StreamingResponse(
+        stream(),
+        media_type=EXPORT_MEDIA_TYPES["ndjson"],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 
 @router.put("/{supplier_id}")
@@ -176,6 +495,7 @@ async def update_supplier(
     if data.name is not None:
         supplier.name = data.name.strip()
 
+    await bump_catalog_version(db)
     await db.commit()
     return {"message": "Proveedor actualizado"}
 
@@ -192,6 +512,63 @@ async def delete_supplier(supplier_id: int, db: AsyncSession = Depends(get_db)):
     if count.scalar() > 0:
         raise HTTPException(400, "No se puede eliminar: tiene productos asociados")
 
+    await db.execute(delete(SupplierOffer).where(SupplierOffer.supplier_id == supplier_id))
+    # Los lotes quedan sin proveedor (ON DELETE SET NULL); su resumen de gasto se va
+    await db.execute(delete(SupplierMonthlySpend).where(SupplierMonthlySpend.supplier_id == supplier_id))
     await db.delete(supplier)
+    await bump_catalog_version(db)
     await db.commit()
     return {"message": "Proveedor eliminado"}
+
+
+TREND_BUCKETS = ("week", "month", "quarter", "year")
+
+
+@router.get("/{supplier_id}/price-trend")
+async def get_supplier_price_trend(
+    supplier_id: int,
+    bucket: str = "month",
+    product_id: Optional[int] = None,
+    months: int = 12,
+    db: AsyncSession = Depends(get_db),
+):
+    """Costo unitario promedio facturado por el proveedor en cada periodo."""
+    if bucket not in TREND_BUCKETS:
+        raise HTTPException(400, f"bucket debe ser uno de: {', '.join(TREND_BUCKETS)}")
+    O = SupplierOffer
+    period = cast(func.date_trunc(literal_column(f"'{bucket}'"), O.date), Date).label("period")
+    stmt = (
+        select(
+            period,
+            func.count().label("offers"),
+            func.count(func.distinct(O.product_id)).label("products"),
+            func.avg(O.unit_cost).label("avg_cost"),
+            func.min(O.unit_cost).label("min_cost"),
+            func.max(O.unit_cost).label("max_cost"),
+        )
+        .where(
+            O.supplier_id == supplier_id,
+            O.date >= datetime.utcnow() - timedelta(days=31 * max(months, 1)),
+        )
+        .group_by(period)
+        .order_by(period)
+    )
+    if product_id:
+        stmt = stmt.where(O.product_id == product_id)
+    rows = (await db.execute(stmt)).all()
+    return {
+        "supplier_id": supplier_id,
+        "product_id": product_id,
+        "bucket": bucket,
+        "items": [
+            {
+                "period": r.period,
+                "offers": r.offers,
+                "products": r.products,
+                "avg_cost": round(r.avg_cost, 4),
+                "min_cost": r.min_cost,
+                "max_cost": r.max_cost,
+            }
+            for r in rows
+        ],
+    }
@@ -0,0 +1,22 @@
+"""
+Serialización JSON rápida para las respuestas de lectura.
+
+Los endpoints de listados devuelven `FastJSONResponse` directamente: FastAPI
+no pasa el contenido por `jsonable_encoder` y orjson serializa datetime,
+floats y dicts en C.
+"""
+from typing import Any
+
+import orjson
+from fastapi import Response
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, Float, Date, DateTime, ForeignKey, Boolean, Index, func
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.core.database import Base
@@ -37,20 +37,48 @@ class Product(Base):
     is_delicate = Column(Boolean, default=False, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=True)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=True)
+    # Transacción que escribió la fila (trigger, ver app/services/product_sync.py)
+    sync_xid = Column(BigInteger, default=0, server_default="0", nullable=False)
 
     supplier = relationship("Supplier", back_populates="products")
 
+    # Feed de sincronización incremental: keyset sobre (sync_xid, id)
+    __table_args__ = (
+        Index("ix_products_updated_at_id", "updated_at", "id"),
+        Index("ix_products_sync_xid_id", "sync_xid", "id"),
+        # Productos de un proveedor ordenados por nombre (detalle del proveedor)
+        Index("ix_products_supplier_name_id", supplier_id, func.coalesce(name, ""), id),
+    )
+
     # Relación con el historial
     history = relationship(
         "PriceHistory", back_populates="product", cascade="all, delete-orphan"
     )
 
 
+# --- BAJAS DE PRODUCTOS (para clientes que sincronizan offline) ---
+class ProductTombstone(Base):
+    __tablename__ = "product_tombstones"
+
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, nullable=False, index=True)  # Sin FK: el producto ya no existe
+    reason = Column(String, nullable=True)  # "delete" o "merge:<keep_id>"
+    deleted_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    sync_xid = Column(BigInteger, default=0, server_default="0", nullable=False)
+
+    __table_args__ = (
+        Index("ix_product_tombstones_deleted_at_id", "deleted_at", "id"),
+        Index("ix_product_tombstones_sync_xid_id", "sync_xid", "id"),
+    )
+
+
 # --- NUEVA TABLA: HISTORIAL ---
+# stock_history y price_history están particionadas por mes sobre `date`
+# (ver app/services/history_partitions.py); la PK incluye la fecha.
 class PriceHistory(Base):
     __tablename__ = "price_history"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     product_id = Column(Integer, ForeignKey("products.id"))
 
     change_type = Column(String)  # "COSTO" (XML) o "PRECIO" (Manual)
@@ -58,24 +86,67 @@ class PriceHistory(Base):
     old_value = Column(Float)  # Cuánto costaba antes
     new_value = Column(Float)  # Cuánto cuesta ahora
 
-    date = Column(DateTime, default=datetime.utcnow)  # Fecha del cambio
+    date = Column(DateTime, primary_key=True, default=datetime.utcnow)  # Fecha del cambio
 
     product = relationship("Product", back_populates="history")
 
+    __table_args__ = (
+        Index("ix_price_history_product_date_id", "product_id", "date", "id"),
+        {"postgresql_partition_by": "RANGE (date)"},
+    )
+
+
+# --- HISTORIAL DE PRECIOS COMPACTADO (particiones archivadas) ---
+class PriceHistoryMonthly(Base):
+    __tablename__ = "price_history_monthly"
+
+    month = Column(Date, primary_key=True)
+    product_id = Column(Integer, primary_key=True)
+    change_type = Column(String, primary_key=True)
+    changes = Column(Integer, nullable=False, default=0)
+    first_old_value = Column(Float)
+    last_new_value = Column(Float)
+    min_value = Column(Float)
+    max_value = Column(Float)
+    avg_value = Column(Float)
+
 
 class StockHistory(Base):
     __tablename__ = "stock_history"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     product_id = Column(Integer, ForeignKey("products.id"))
     change_type = Column(String)  # "ENTRADA", "AJUSTE", "MERGE"
     old_value = Column(Integer)
     new_value = Column(Integer)
     source = Column(String, nullable=True)  # nombre del batch o "manual"
-    date = Column(DateTime, default=datetime.utcnow)
+    date = Column(DateTime, primary_key=True, default=datetime.utcnow)
 
     product = relationship("Product")
 
+    __table_args__ = (
+        Index("ix_stock_history_date_id", "date", "id"),
+        Index("ix_stock_history_product_date_id", "product_id", "date", "id"),
+        {"postgresql_partition_by": "RANGE (date)"},
+    )
+
+
+# --- RESUMEN DIARIO DE MOVIMIENTOS (alimentado junto con StockHistory) ---
+class StockDailyRollup(Base):
+    __tablename__ = "stock_daily_rollups"
+
+    day = Column(Date, primary_key=True)
+    product_id = Column(Integer, primary_key=True)  # Sin FK: sobrevive a borrados y fusiones
+    qty_in = Column(Integer, nullable=False, default=0)  # Suma de incrementos
+    qty_out = Column(Integer, nullable=False, default=0)  # Suma de decrementos (positivo)
+    entrada = Column(Integer, nullable=False, default=0)  # Neto por tipo de movimiento
+    ajuste = Column(Integer, nullable=False, default=0)
+    merge = Column(Integer, nullable=False, default=0)
+    reversa = Column(Integer, nullable=False, default=0)
+    movements = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (Index("ix_stock_daily_rollups_product_day", "product_id", "day"),)
+
 
 class ImportBatch(Base):
     __tablename__ = "import_batches"
@@ -83,12 +154,16 @@ class ImportBatch(Base):
     id = Column(Integer, primary_key=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     filename = Column(String)  # Nombre del archivo XML o "Carga Masiva Manual test"
+    # Emisor del XML; si se borra el proveedor, el lote queda sin proveedor
+    supplier_id = Column(Integer, ForeignKey("suppliers.id", ondelete="SET NULL"), nullable=True)
 
     # Relación para borrar en cascada si borras el historial
     items = relationship(
         "ImportBatchItem", back_populates="batch", cascade="all, delete-orphan"
     )
 
+    __table_args__ = (Index("ix_import_batches_supplier_created", "supplier_id", "created_at"),)
+
 
 class ImportBatchItem(Base):
     __tablename__ = "import_batch_items"
@@ -97,9 +172,52 @@ class ImportBatchItem(Base):
     batch_id = Column(Integer, ForeignKey("import_batches.id"))
     product_id = Column(Integer, ForeignKey("products.id"))
     quantity = Column(Float, default=0)
+    unit_cost = Column(Float, nullable=True)  # Costo unitario sin impuestos de la factura
     batch = relationship("ImportBatch", back_populates="items")
     product = relationship("Product")  # Para poder acceder a los datos del producto
 
+    __table_args__ = (
+        Index("ix_import_batch_items_batch", "batch_id"),
+        Index("ix_import_batch_items_product_batch", "product_id", "batch_id"),
+    )
+
+
+# --- GASTO MENSUAL POR PROVEEDOR (alimentado por upload / delete_batch) ---
+class SupplierMonthlySpend(Base):
+    __tablename__ = "supplier_monthly_spend"
+
+    month = Column(Date, primary_key=True)  # Primer día del mes
+    supplier_id = Column(Integer, primary_key=True)
+    batches = Column(Integer, default=0, nullable=False)
+    lines = Column(Integer, default=0, nullable=False)
+    units = Column(Float, default=0, nullable=False)
+    spend = Column(Float, default=0, nullable=False)  # Sin impuestos
+    # Cambio de costo contra la compra anterior del mismo producto al mismo proveedor
+    cost_change_lines = Column(Integer, default=0, nullable=False)
+    cost_change_sum = Column(Float, default=0, nullable=False)  # Suma de (nuevo - anterior) / anterior
+
+    __table_args__ = (Index("ix_supplier_monthly_spend_supplier_month", "supplier_id", "month"),)
+
+
+# --- OFERTAS POR PROVEEDOR (costo unitario de cada factura) ---
+class SupplierOffer(Base):
+    __tablename__ = "supplier_offers"
+
+    id = Column(Integer, primary_key=True, index=True)
+    supplier_id = Column(Integer, ForeignKey("suppliers.id"), nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    batch_id = Column(Integer, ForeignKey("import_batches.id", ondelete="CASCADE"), nullable=True, index=True)
+    unit_cost = Column(Float, nullable=False)  # Sin impuestos, como Product.price
+    quantity = Column(Float, default=0)
+    date = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        # Último costo de cada proveedor por producto (DISTINCT ON product, supplier)
+        Index("ix_supplier_offers_product_supplier_date", "product_id", "supplier_id", "date"),
+        # Tendencia de precios por proveedor
+        Index("ix_supplier_offers_supplier_date", "supplier_id", "date"),
+    )
+
 
 # --- LISTA DE COMPRAS ---
 class ShoppingList(Base):
@@ -170,6 +288,11 @@ class ProductCategory(Base):
     category = relationship("Category", back_populates="product_categories")
     product = relationship("Product")
 
+    # Un producto aparece una sola vez por categoría (ON CONFLICT en asignaciones masivas)
+    __table_args__ = (
+        Index("uq_product_categories_category_product", "category_id", "product_id", unique=True),
+    )
+
 
 class ProductLocation(Base):
     __tablename__ = "product_locations"
@@ -182,3 +305,114 @@ class ProductLocation(Base):
 
     location = relationship("Location", back_populates="product_locations")
     product = relationship("Product")
+
+    # Un renglón por (ubicación, producto): los cambios de cantidad son upserts
+    __table_args__ = (
+        Index("uq_product_locations_location_product", "location_id", "product_id", unique=True),
+    )
+
+
+
+# --- CONTEOS CÍCLICOS ---
+class CycleCount(Base):
+    __tablename__ = "cycle_counts"
+
+    id = Column(Integer, primary_key=True, index=True)
+    status = Column(String, default="open", nullable=False)  # open, closed, cancelled
+    notes = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    closed_at = Column(DateTime, nullable=True)
+    # Resumen al cerrar
+    variance_lines = Column(Integer, default=0)
+    units_over = Column(Integer, default=0)
+    units_short = Column(Integer, default=0)
+
+
+class CycleCountLocation(Base):
+    __tablename__ = "cycle_count_locations"
+
+    cycle_count_id = Column(Integer, ForeignKey("cycle_counts.id", ondelete="CASCADE"), primary_key=True)
+    location_id = Column(Integer, ForeignKey("locations.id", ondelete="CASCADE"), primary_key=True)
+
+
+class CycleCountBatch(Base):
+    """Lotes recibidos: reenviar el mismo batch_id no vuelve a aplicarlo."""
+    __tablename__ = "cycle_count_batches"
+
+    cycle_count_id = Column(Integer, ForeignKey("cycle_counts.id", ondelete="CASCADE"), primary_key=True)
+    batch_id = Column(String, primary_key=True)
+    device = Column(String, nullable=True)
+    mode = Column(String, default="set")  # set: cantidad contada, add: piezas escaneadas
+    entries = Column(Integer, default=0)
+    received_at = Column(DateTime, default=datetime.utcnow)
+
+
+class CycleCountEntry(Base):
+    __tablename__ = "cycle_count_entries"
+
+    cycle_count_id = Column(Integer, ForeignKey("cycle_counts.id", ondelete="CASCADE"), primary_key=True)
+    location_id = Column(Integer, ForeignKey("locations.id", ondelete="CASCADE"), primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True)
+    counted = Column(Integer, default=0, nullable=False)
+    expected = Column(Integer, nullable=True)  # Se fija al cerrar
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+# --- ESTADO DEL CATÁLOGO (versión para caché / ETag) ---
+class CatalogState(Base):
+    __tablename__ = "catalog_state"
+
+    id = Column(Integer, primary_key=True)  # Siempre una sola fila (id=1)
+    version = Column(BigInteger, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+# --- REGLAS DE PRECIO (markup / margen por proveedor, categoría o rango de costo) ---
+class PricingRule(Base):
+    __tablename__ = "pricing_rules"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String)
+    # Filtros opcionales: la regla aplica si se cumplen todos los que estén puestos.
+    # Si se borra el proveedor o la categoría, la regla se borra con ellos
+    # (sin el filtro aplicaría a todo el catálogo).
+    supplier_id = Column(Integer, ForeignKey("suppliers.id", ondelete="CASCADE"), nullable=True)
+    category_id = Column(Integer, ForeignKey("categories.id", ondelete="CASCADE"), nullable=True)
+    min_cost = Column(Float, nullable=True)  # Incluyente
+    max_cost = Column(Float, nullable=True)  # Excluyente
+    mode = Column(String, default="markup")  # "markup" (% sobre costo) o "margin" (% del precio)
+    value = Column(Float, default=0.0)
+    rounding_step = Column(Float, nullable=True)  # Ej: 1, 5, 10 (siempre hacia arriba)
+    price_ending = Column(Float, nullable=True)  # Ej: 0.90 -> 19.90
+    priority = Column(Integer, default=100)  # Menor número = se evalúa primero
+    is_active = Column(Boolean, default=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+# --- SNAPSHOTS DE INVENTARIO (valuación histórica) ---
+class InventorySnapshot(Base):
+    __tablename__ = "inventory_snapshots"
+
+    id = Column(Integer, primary_key=True, index=True)
+    taken_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    kind = Column(String, default="full")  # "full" o "delta" (solo productos que cambiaron)
+    base_id = Column(Integer, nullable=True)  # Snapshot completo del que parte la cadena
+    source = Column(String, default="manual")  # "manual" o "schedule"
+    # Totales al momento del snapshot
+    product_count = Column(Integer, default=0)
+    total_units = Column(BigInteger, default=0)
+    cost_value = Column(Float, default=0.0)
+    sale_value = Column(Float, default=0.0)
+    items_written = Column(Integer, default=0)
+
+
+class InventorySnapshotItem(Base):
+    __tablename__ = "inventory_snapshot_items"
+
+    snapshot_id = Column(Integer, ForeignKey("inventory_snapshots.id", ondelete="CASCADE"), primary_key=True)
+    product_id = Column(Integer, primary_key=True)  # Sin FK: el snapshot sobrevive al producto
+    stock = Column(Integer, default=0)
+    cost = Column(Float, default=0.0)
+    selling_price = Column(Float, default=0.0)
+
+    __table_args__ = (Index("ix_inventory_snapshot_items_product", "product_id", "snapshot_id"),)
@@ -1,3 +1,4 @@
+import asyncio
 import json
 from datetime import datetime, timedelta, timezone
 from typing import List, Optional
@@ -13,8 +14,13 @@ from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 # --- IMPORTS ---
 # Asegúrate de que estos archivos existen y son correctos
-from app.api.endpoints import invoices, suppliers, shopping_lists, locations, categories, reports
+from app.api.endpoints import invoices, suppliers, shopping_lists, locations, categories, reports, pricing_rules, cycle_counts
 from app.core.database import engine, Base
+from app.services.history_partitions import history_maintenance_loop, setup_history_partitions
+from app.services.inventory_snapshots import snapshot_loop
+from app.services.product_sync import setup_sync_xid
+from app.services.stock_rollups import backfill_stock_rollups
+from app.services.supplier_spend import backfill_supplier_spend
 
 # --- 1. SECURITY CONFIGURATION ---
 import os
@@ -108,6 +114,34 @@ async def get_db():
 
 
 # --- 6. INITIALIZATION ---
+_background_tasks: List[asyncio.Task] = []
+FK_DELETE_ACTIONS = {"CASCADE": "c", "SET NULL": "n"}
+
+
+async def ensure_fk_ondelete(conn, table: str, column: str, ref_table: str, action: str):
+    """Recrea la FK de `table.column` si su ON DELETE no es `action`."""
+    rows = (
+        await conn.execute(
+            text(
+                "SELECT c.conname, c.confdeltype::text FROM pg_constraint c "
+                "JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey) "
+                "WHERE c.contype = 'f' AND c.conrelid = to_regclass(:table) AND a.attname = :column"
+            ),
+            {"table": table, "column": column},
+        )
+    ).all()
+    if rows and all(kind == FK_DELETE_ACTIONS[action] for _, kind in rows):
+        return
+    for name, _ in rows:
+        await conn.execute(text(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"'))
+    await conn.execute(
+        text(
+            f"ALTER TABLE {table} ADD CONSTRAINT {table}_{column}_fkey "
+            f"FOREIGN KEY ({column}) REFERENCES {ref_table}(id) ON DELETE {action}"
+        )
+    )
+
+
 async def startup_event():
     async with engine.begin() as conn:
         try:
@@ -115,6 +149,8 @@ async def startup_event():
         except Exception:
             pass
         await conn.run_sync(Base.metadata.create_all)
+        # Historial particionado por mes (convierte tablas antiguas)
+        await setup_history_partitions(conn)
         # Migración: agregar supplier_id a products si no existe
         try:
             await conn.execute(
@@ -140,6 +176,202 @@ async def startup_event():
             )
         except Exception:
             pass
+        # Gasto por proveedor: proveedor del lote y costo unitario por línea
+        try:
+            await conn.execute(
+                text(
+                    "ALTER TABLE import_batches ADD COLUMN IF NOT EXISTS supplier_id INTEGER "
+                    "REFERENCES suppliers(id) ON DELETE SET NULL"
+                )
+            )
+            await conn.execute(
+                text(
+                    "ALTER TABLE import_batch_items ADD COLUMN IF NOT EXISTS unit_cost DOUBLE PRECISION"
+                )
+            )
+            await conn.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS ix_import_batches_supplier_created "
+                    "ON import_batches (supplier_id, created_at)"
+                )
+            )
+            await conn.execute(
+                text("CREATE INDEX IF NOT EXISTS ix_import_batch_items_batch ON import_batch_items (batch_id)")
+            )
+            await conn.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS ix_import_batch_items_product_batch "
+                    "ON import_batch_items (product_id, batch_id)"
+                )
+            )
+        except Exception:
+            pass
+        # Detalle de proveedor: sus productos paginados por nombre
+        try:
+            async with conn.begin_nested():
+                await conn.execute(
+                    text(
+                        "CREATE INDEX IF NOT EXISTS ix_products_supplier_name_id "
+                        "ON products (supplier_id, coalesce(name, ''), id)"
+                    )
+                )
+        except Exception:
+            pass
+        # Sync incremental: índice sobre updated_at y relleno de nulos antiguos
+        try:
+            await conn.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS ix_products_updated_at_id ON products (updated_at, id)"
+                )
+            )
+            await conn.execute(
+                text(
+                    "UPDATE products SET updated_at = COALESCE(created_at, now()) WHERE updated_at IS NULL"
+                )
+            )
+        except Exception:
+            pass
+        # Lotes: al borrar su proveedor quedan sin proveedor
+        try:
+            async with conn.begin_nested():
+                await ensure_fk_ondelete(conn, "import_batches", "supplier_id", "suppliers", "SET NULL")
+        except Exception:
+            pass
+        # Reglas de precio: se borran junto con su proveedor o categoría
+        try:
+            async with conn.begin_nested():
+                await ensure_fk_ondelete(conn, "pricing_rules", "supplier_id", "suppliers", "CASCADE")
+                await ensure_fk_ondelete(conn, "pricing_rules", "category_id", "categories", "CASCADE")
+        except Exception:
+            pass
+        # Conteos cíclicos: sus renglones se borran junto con la ubicación
+        try:
+            async with conn.begin_nested():
+                await ensure_fk_ondelete(conn, "cycle_count_locations", "location_id", "locations", "CASCADE")
+                await conn.execute(
+                    text(
+                        "DELETE FROM cycle_count_entries e WHERE NOT EXISTS "
+                        "(SELECT 1 FROM locations l WHERE l.id = e.location_id)"
+                    )
+                )
+                await ensure_fk_ondelete(conn, "cycle_count_entries", "location_id", "locations", "CASCADE")
+        except Exception:
+            pass
+        # Feed de sincronización: orden por transacción escritora (trigger)
+        try:
+            async with conn.begin_nested():
+                await setup_sync_xid(conn)
+        except Exception:
+            pass
+        # Fila única con la versión del catálogo (caché / ETag de listados)
+        try:
+            await conn.execute(
+                text(
+                    "INSERT INTO catalog_state (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING"
+                )
+            )
+        except Exception:
+            pass
+        # Historial de stock y precios: índices para paginación por (fecha, id) y por producto
+        try:
+            await conn.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS ix_stock_history_date_id ON stock_history (date, id)"
+                )
+            )
+            await conn.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS ix_stock_history_product_date_id "
+                    "ON stock_history (product_id, date, id)"
+                )
+            )
+            await conn.execute(
+                text(
+                    "CREATE INDEX IF NOT EXISTS ix_price_history_product_date_id "
+                    "ON price_history (product_id, date, id)"
+                )
+            )
+        except Exception:
+            pass
+        # Categorías: quitar asignaciones duplicadas y volverlas únicas
+        try:
+            async with conn.begin_nested():
+                await conn.execute(
+                    text(
+                        "DELETE FROM product_categories pc USING product_categories dup "
+                        "WHERE pc.category_id = dup.category_id "
+                        "AND pc.product_id = dup.product_id AND pc.id > dup.id"
+                    )
+                )
+                await conn.execute(
+                    text(
+                        "CREATE UNIQUE INDEX IF NOT EXISTS uq_product_categories_category_product "
+                        "ON product_categories (category_id, product_id)"
+                    )
+                )
+        except Exception:
+            pass
+        # Ubicaciones: fusionar renglones duplicados (sumando cantidades) y volverlos únicos
+        try:
+            async with conn.begin_nested():
+                await conn.execute(
+                    text(
+                        "UPDATE product_locations pl SET quantity = d.total FROM ("
+                        "SELECT min(id) AS keep_id, sum(COALESCE(quantity, 0)) AS total "
+                        "FROM product_locations GROUP BY location_id, product_id HAVING count(*) > 1"
+                        ") d WHERE pl.id = d.keep_id"
+                    )
+                )
+                await conn.execute(
+                    text(
+                        "DELETE FROM product_locations pl USING product_locations dup "
+                        "WHERE pl.location_id = dup.location_id "
+                        "AND pl.product_id = dup.product_id AND pl.id > dup.id"
+                    )
+                )
+                await conn.execute(
+                    text(
+                        "CREATE UNIQUE INDEX IF NOT EXISTS uq_product_locations_location_product "
+                        "ON product_locations (location_id, product_id)"
+                    )
+                )
+        except Exception:
+            pass
+        # Búsqueda por nombre/SKU con ILIKE '%q%' (requiere pg_trgm; opcional)
+        try:
+            async with conn.begin_nested():
+                await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                await conn.execute(
+                    text(
+                        "CREATE INDEX IF NOT EXISTS ix_products_name_trgm "
+                        "ON products USING gin (name gin_trgm_ops)"
+                    )
+                )
+                await conn.execute(
+                    text(
+                        "CREATE INDEX IF NOT EXISTS ix_products_sku_trgm "
+                        "ON products USING gin (sku gin_trgm_ops)"
+                    )
+                )
+        except Exception:
+            pass
+        # Resumen diario de movimientos: relleno inicial desde stock_history
+        try:
+            async with conn.begin_nested():
+                await backfill_stock_rollups(conn)
+        except Exception:
+            pass
+        # Gasto mensual por proveedor: relleno desde lotes y ofertas existentes
+        try:
+            async with conn.begin_nested():
+                await backfill_supplier_spend(conn)
+        except Exception:
+            pass
+
+    # Tareas periódicas: mantenimiento del historial y snapshots de inventario
+    if not _background_tasks:
+        _background_tasks.append(asyncio.create_task(history_maintenance_loop()))
+        _background_tasks.append(asyncio.create_task(snapshot_loop()))
 
 
 app = FastAPI(on_startup=[startup_event])
@@ -151,7 +383,8 @@ app.add_middleware(
     allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization"],
+    allow_headers=["Content-Type", "Authorization", "If-None-Match"],
+    expose_headers=["ETag", "Content-Disposition"],
 )
 
 
@@ -380,3 +613,5 @@ app.include_router(shopping_lists.router, prefix="/shopping-lists", tags=["shopp
 app.include_router(locations.router, prefix="/locations", tags=["locations"])
 app.include_router(categories.router, prefix="/categories", tags=["categories"])
 app.include_router(reports.router, prefix="/inventory/reports", tags=["reports"])
+app.include_router(pricing_rules.router, prefix="/pricing-rules", tags=["pricing-rules"])
+app.include_router(cycle_counts.router, prefix="/cycle-counts", tags=["cycle-counts"])
@@ -0,0 +1,190 @@
+"""
+Analítica de márgenes y anomalías de precio sobre todo el catálogo.
+
+Carga costo, precio de venta, stock, categorías y el último cambio de
+`PriceHistory` de cada producto en un DataFrame (cuatro consultas) y calcula
+todo de forma vectorizada. El resultado se guarda por versión del catálogo:
+mientras nadie escriba, refrescar el dashboard no vuelve a consultar la BD.
+"""
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.domain.models import PriceHistory, Product, ProductCategory
+from app.services.catalog_cache import get_catalog_version
+
+# Bordes del histograma de margen (% sobre precio de venta)
+MARGIN_BIN_EDGES = [-100, -50, -25, 0, 10, 20, 30, 40, 50, 60, 75, 100]
+OUTLIER_Z = 3.5  # z robusta (mediana / MAD) contra la categoría
+MIN_PEERS = 5
+
+_cache: Dict[Tuple[int, int], dict] = {}
+
+
+async def load_frames(db: AsyncSession):
+    products = pd.DataFrame(
+        (
+            await db.execute(
+                select(
+                    Product.id,
+                    Product.name,
+                    Product.sku,
+                    Product.price.label("cost"),
+                    Product.selling_price,
+                    Product.stock_quantity.label("stock"),
+                )
+            )
+        ).all(),
+        columns=["id", "name", "sku", "cost", "selling_price", "stock"],
+    )
+    categories = pd.DataFrame(
+        (await db.execute(select(ProductCategory.product_id, ProductCategory.category_id))).all(),
+        columns=["id", "category_id"],
+    )
+
+    def last_change(change_type: str):
+        return (
+            select(
+                PriceHistory.product_id,
+                PriceHistory.date,
+                PriceHistory.old_value,
+                PriceHistory.new_value,
+            )
+            .where(PriceHistory.change_type == change_type)
+            .distinct(PriceHistory.product_id)
+            .order_by(PriceHistory.product_id, PriceHistory.date.desc())
+        )
+
+    last_cost = pd.DataFrame(
+        (await db.execute(last_change("COSTO"))).all(),
+        columns=["id", "cost_changed_at", "cost_old", "cost_new"],
+    )
+    last_price = pd.DataFrame(
+        (await db.execute(last_change("PRECIO"))).all(),
+        columns=["id", "price_changed_at", "price_old", "price_new"],
+    )
+    return products, categories, last_cost, last_price
+
+
+def compute(products, categories, last_cost, last_price, top: int) -> dict:
+    df = products.merge(last_cost, on="id", how="left").merge(
+        last_price[["id", "price_changed_at"]], on="id", how="left"
+    )
+    for col in ("cost", "selling_price", "cost_old", "cost_new"):
+        df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+    df["cost"] = df["cost"].fillna(0.0)
+    df["selling_price"] = df["selling_price"].fillna(0.0)
+    df["stock"] = pd.to_numeric(df["stock"], errors="coerce").fillna(0).astype("float64")
+
+    cost = df["cost"].to_numpy()
+    sp = df["selling_price"].to_numpy()
+    stock = np.clip(df["stock"].to_numpy(), 0, None)
+    priced = sp > 0
+    margin = np.full(len(df), np.nan)
+    np.divide((sp - cost) * 100.0, sp, out=margin, where=priced)
+    df["margin_pct"] = margin
+
+    # 1. Distribución de márgenes
+    counts, edges = np.histogram(
+        np.clip(margin[priced], MARGIN_BIN_EDGES[0], MARGIN_BIN_EDGES[-1]), bins=MARGIN_BIN_EDGES
+    )
+    histogram = [
+        {"from": float(edges[i]), "to": float(edges[i + 1]), "count": int(counts[i])}
+        for i in range(len(counts))
+    ]
+    sale_value = float((sp * stock).sum())
+    cost_value = float((cost * stock).sum())
+
+    # 2. Atípicos contra la categoría (z robusta con mediana y MAD)
+    peers = categories.merge(df.loc[priced, ["id", "name", "sku", "margin_pct"]], on="id")
+    outliers = []
+    if not peers.empty:
+        grouped = peers.groupby("category_id")["margin_pct"]
+        peers["median"] = grouped.transform("median")
+        peers["mad"] = (peers["margin_pct"] - peers["median"]).abs().groupby(peers["category_id"]).transform("median")
+        peers["size"] = grouped.transform("size")
+        valid = (peers["size"] >= MIN_PEERS) & (peers["mad"] > 0)
+        peers["z"] = np.where(
+            valid, 0.6745 * (peers["margin_pct"] - peers["median"]) / peers["mad"].where(valid, 1), 0.0
+        )
+        flagged = peers[peers["z"].abs() >= OUTLIER_Z]
+        flagged = flagged.reindex(flagged["z"].abs().sort_values(ascending=False).index).head(top)
+        outliers = [
+            {
+                "id": int(r.id),
+                "name": r.name,
+                "sku": r.sku or "",
+                "category_id": int(r.category_id),
+                "margin_pct": round(float(r.margin_pct), 2),
+                "category_median_pct": round(float(r.median), 2),
+                "z_score": round(float(r.z), 2),
+            }
+            for r in flagged.itertuples()
+        ]
+
+    # 3. Precios rezagados: el costo subió después del último cambio de precio
+    cost_up = (df["cost_new"] > df["cost_old"]).to_numpy()
+    price_older = (
+        df["price_changed_at"].isna() | (df["price_changed_at"] < df["cost_changed_at"])
+    ).to_numpy()
+    stale = cost_up & price_older & priced
+    increase = np.where(stale, df["cost_new"].to_numpy() - df["cost_old"].to_numpy(), 0.0)
+
+    # 4. Valor en riesgo: pérdida por margen negativo o alza de costo no trasladada
+    negative_loss = np.where(priced, np.clip(cost - sp, 0, None), 0.0) * stock
+    stale_gap = increase * stock
+    df["value_at_risk"] = np.maximum(negative_loss, stale_gap)
+    df["stale"] = stale
+    df["cost_increase"] = increase
+
+    def rows(frame):
+        return [
+            {
+                "id": int(r.id),
+                "name": r.name,
+                "sku": r.sku or "",
+                "cost": float(r.cost),
+                "selling_price": float(r.selling_price),
+                "stock": int(r.stock),
+                "margin_pct": None if np.isnan(r.margin_pct) else round(float(r.margin_pct), 2),
+                "cost_increase": round(float(r.cost_increase), 2),
+                "value_at_risk": round(float(r.value_at_risk), 2),
+            }
+            for r in frame.itertuples()
+        ]
+
+    stale_df = df[df["stale"]].sort_values("value_at_risk", ascending=False).head(top)
+    risk_df = df[df["value_at_risk"] > 0].sort_values("value_at_risk", ascending=False).head(top)
+
+    return {
+        "summary": {
+            "products": int(len(df)),
+            "priced": int(priced.sum()),
+            "median_margin_pct": None if not priced.any() else round(float(np.nanmedian(margin)), 2),
+            "weighted_margin_pct": (
+                round((sale_value - cost_value) * 100.0 / sale_value, 2) if sale_value > 0 else None
+            ),
+            "negative_margin": int((priced & (cost > sp)).sum()),
+            "stale_prices": int(stale.sum()),
+            "value_at_risk": round(float(df["value_at_risk"].sum()), 2),
+        },
+        "margin_histogram": histogram,
+        "category_outliers": outliers,
+        "stale_prices": rows(stale_df),
+        "top_value_at_risk": rows(risk_df),
+    }
+
+
+async def catalog_analytics(db: AsyncSession, top: int = 20) -> dict:
+    version = await get_catalog_version(db)
+    key = (version, top)
+    if key not in _cache:
+        frames = await load_frames(db)
+        # Solo se conserva la versión vigente
+        for old in [k for k in _cache if k[0] != version]:
+            del _cache[old]
+        _cache[key] = {"catalog_version": version, **compute(*frames, top=top)}
+    return _cache[key]
@@ -0,0 +1,125 @@
+"""
+Caché de listados del catálogo (productos, proveedores, categorías, ubicaciones).
+
+Cada endpoint de escritura llama a `bump_catalog_version` antes de su commit,
+así la versión cambia en la misma transacción que los datos. Los listados se
+guardan ya serializados por firma de consulta (ruta + query string) en un LRU
+acotado por número de entradas y bytes, y se sirven con ETag / 304.
+"""
+import hashlib
+import os
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from fastapi import Request, Response
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.serialization import dumps
+from app.domain.models import CatalogState
+
+CACHE_MAX_ENTRIES = int(os.environ.get("CATALOG_CACHE_MAX_ENTRIES", "256"))
+CACHE_MAX_BYTES = int(os.environ.get("CATALOG_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+
+# --- VERSIÓN DEL CATÁLOGO ---
+async def bump_catalog_version(db: AsyncSession) -> None:
+    """Incrementa la versión del catálogo. Llamar antes de `db.commit()`."""
+    await db.execute(
+        update(CatalogState)
+        .where(CatalogState.id == 1)
+        .values(version=CatalogState.version + 1, updated_at=datetime.utcnow())
+    )
+
+
+async def get_catalog_version(db: AsyncSession) -> int:
+    result = await db.execute(select(CatalogState.version).where(CatalogState.id == 1))
+    return result.scalar() or 0
+
+
+# --- LRU DE RESPUESTAS SERIALIZADAS ---
+class ResponseLRU:
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[str, Tuple[int, bytes]]" = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: str, version: int) -> Optional[bytes]:
+        entry = self._items.get(key)
+        if entry is None:
+            return None
+        if entry[0] != version:
+            # Versión vieja: ya no sirve, liberamos espacio
+            self._discard(key)
+            return None
+        self._items.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: str, version: int, body: bytes) -> None:
+        if len(body) > self.max_bytes:
+            return
+        self._discard(key)
+        self._items[key] = (version, body)
+        self._bytes += len(body)
+        while self._items and (
+            len(self._items) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            oldest = next(iter(self._items))
+            self._discard(oldest)
+
+    def clear(self) -> None:
+        self._items.clear()
+        self._bytes = 0
+
+    def _discard(self, key: str) -> None:
+        entry = self._items.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+
+response_cache = ResponseLRU(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES)
+
+
+def query_signature(request: Request) -> str:
+    params = sorted(request.query_params.multi_items())
+    return request.url.path + "?" + "&".join(f"{k}={v}" for k, v in params)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # Comparación débil: ignoramos el prefijo W/
+    bare = etag[2:] if etag.startswith("W/") else etag
+    return "*" in candidates or any(
+        (c[2:] if c.startswith("W/") else c) == bare for c in candidates
+    )
+
+
+async def cached_json_response(
+    request: Request,
+    db: AsyncSession,
+    build: Callable[[], Awaitable[Any]],
+) -> Response:
+    """
+    Sirve un listado desde caché mientras la versión del catálogo no cambie.
+    `build` solo se ejecuta si no hay entrada vigente para esta consulta.
+    """
+    version = await get_catalog_version(db)
+    signature = query_signature(request)
+    digest = hashlib.sha1(signature.encode("utf-8")).hexdigest()[:16]
+    etag = f'W/"{version}-{digest}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    body = response_cache.get(signature, version)
+    if body is None:
+        payload = await build()
+        body = dumps(payload)
+        response_cache.put(signature, version, body)
+
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,162 @@
+"""
+Exportación completa del catálogo en streaming (CSV, NDJSON, XLSX).
+
+Las filas salen de un cursor del servidor por bloques de EXPORT_CHUNK_SIZE,
+así la memoria no depende del tamaño del catálogo. Cada exportación abre su
+propia sesión porque vive más que la petición que la inició.
+"""
+import csv
+import io
+import os
+import tempfile
+from typing import AsyncIterator, List
+
+import xlsxwriter
+from sqlalchemy import String, cast, func, literal_column, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from starlette.concurrency import run_in_threadpool
+
+from app.core.database import SessionLocal
+from app.core.serialization import dumps
+from app.domain.models import Category, Location, Product, ProductCategory, ProductLocation, Supplier
+
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_COLUMNS = [
+    "id", "sku", "upc", "name", "alias", "price", "selling_price", "stock",
+    "supplier_name", "categories", "locations", "is_delicate", "updated_at",
+]
+EXPORT_HEADERS = [
+    "ID", "SKU", "UPC", "Nombre", "Alias", "Costo", "Precio Venta", "Stock",
+    "Proveedor", "Categorías", "Ubicaciones", "Delicado", "Actualizado",
+]
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+def export_statement():
+    categories = (
+        select(
+            ProductCategory.product_id,
+            func.string_agg(
+                Category.name, aggregate_order_by(literal_column("', '"), Category.name)
+            ).label("names"),
+        )
+        .join(Category, ProductCategory.category_id == Category.id)
+        .group_by(ProductCategory.product_id)
+        .subquery()
+    )
+    locations = (
+        select(
+            ProductLocation.product_id,
+            func.string_agg(
+                Location.code + ":" + cast(ProductLocation.quantity, String),
+                aggregate_order_by(literal_column("', '"), Location.code),
+            ).label("codes"),
+        )
+        .join(Location, ProductLocation.location_id == Location.id)
+        .group_by(ProductLocation.product_id)
+        .subquery()
+    )
+    return (
+        select(
+            Product.id,
+            Product.sku,
+            Product.upc,
+            Product.name,
+            Product.alias,
+            Product.price,
+            Product.selling_price,
+            Product.stock_quantity,
+            Supplier.name.label("supplier_name"),
+            categories.c.names,
+            locations.c.codes,
+            Product.is_delicate,
+            Product.updated_at,
+        )
+        .outerjoin(Supplier, Product.supplier_id == Supplier.id)
+        .outerjoin(categories, categories.c.product_id == Product.id)
+        .outerjoin(locations, locations.c.product_id == Product.id)
+        .order_by(Product.id.asc())
+    )
+
+
+def row_values(r) -> List:
+    return [
+        r.id,
+        r.sku or "",
+        r.upc or "",
+        r.name or "",
+        r.alias or "",
+        r.price,
+        r.selling_price,
+        r.stock_quantity,
+        r.supplier_name or "",
+        r.names or "",
+        r.codes or "",
+        bool(r.is_delicate),
+        r.updated_at,
+    ]
+
+
+async def iter_export_chunks() -> AsyncIterator[List]:
+    async with SessionLocal() as session:
+        stmt = export_statement().execution_options(yield_per=EXPORT_CHUNK_SIZE)
+        result = await session.stream(stmt)
+        async for rows in result.partitions():
+            yield rows
+
+
+async def stream_csv() -> AsyncIterator[bytes]:
+    # BOM para que Excel detecte UTF-8; el encabezado sale antes de consultar
+    buf = io.StringIO()
+    csv.writer(buf).writerow(EXPORT_HEADERS)
+    yield ("\ufeff" + buf.getvalue()).encode("utf-8")
+
+    async for rows in iter_export_chunks():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerows(row_values(r) for r in rows)
+        yield buf.getvalue().encode("utf-8")
+
+
+async def stream_ndjson() -> AsyncIterator[bytes]:
+    async for rows in iter_export_chunks():
+        yield b"".join(dumps(dict(zip(EXPORT_COLUMNS, row_values(r)))) + b"\n" for r in rows)
+
+
+async def stream_xlsx() -> AsyncIterator[bytes]:
+    # Un .xlsx es un zip: solo puede enviarse al cerrarlo. Las filas se escriben
+    # a disco en modo constant_memory y después se envía el archivo por bloques.
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        workbook = xlsxwriter.Workbook(
+            path, {"constant_memory": True, "default_date_format": "yyyy-mm-dd hh:mm"}
+        )
+        sheet = workbook.add_worksheet("Catalogo")
+        sheet.write_row(0, 0, EXPORT_HEADERS)
+        row_idx = 1
+        async for rows in iter_export_chunks():
+            for r in rows:
+                sheet.write_row(row_idx, 0, row_values(r))
+                row_idx += 1
+        await run_in_threadpool(workbook.close)
+
+        with open(path, "rb") as fh:
+            while True:
+                chunk = fh.read(64 * 1024)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
+
+
+EXPORT_STREAMS = {
+    "csv": stream_csv,
+    "ndjson": stream_ndjson,
+    "xlsx": stream_xlsx,
+}
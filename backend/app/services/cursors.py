@@ -0,0 +1,36 @@
+"""
+Cursores opacos para paginación keyset.
+
+Un cursor guarda los valores de la clave de orden de la última fila devuelta
+(ej: fecha e id). Se codifica en base64 url-safe para viajar como query param.
+"""
+import base64
+import json
+from datetime import date, datetime
+from typing import Any
+
+from fastapi import HTTPException
+
+
+def encode_cursor(*values: Any) -> str:
+    raw = json.dumps(
+        [v.isoformat() if isinstance(v, (date, datetime)) else v for v in values],
+        separators=(",", ":"),
+    )
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, *types: type) -> tuple:
+    """Decodifica y convierte cada valor al tipo indicado (datetime, int, str...)."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+        if len(values) != len(types):
+            raise ValueError
+        return tuple(
+            None if v is None
+            else t.fromisoformat(v) if t in (datetime, date)
+            else t(v)
+            for t, v in zip(types, values)
+        )
+    except Exception:
+        raise HTTPException(400, "Cursor inválido")
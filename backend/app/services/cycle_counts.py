@@ -0,0 +1,205 @@
+"""
+Conteos cíclicos por anaquel.
+
+Una sesión abarca un conjunto de ubicaciones. Los dispositivos envían lotes
+de conteos con un `batch_id` propio: el lote se registra con ON CONFLICT DO
+NOTHING, así que reenviarlo (por ejemplo tras perder la conexión) no lo
+aplica dos veces. Cada lote es `set` (cantidad contada) o `add` (piezas
+escaneadas que se suman).
+
+Al cerrar, todo es por conjuntos dentro de una transacción: los productos
+asignados a un anaquel contado que nadie contó quedan en cero (si se pide),
+se fija la cantidad esperada de cada renglón, se ajusta el stock global
+con la diferencia neta por producto (AJUSTE en StockHistory) y
+product_locations toma las cantidades contadas.
+"""
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, func, literal, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.domain.models import (
+    CycleCount,
+    CycleCountBatch,
+    CycleCountEntry,
+    CycleCountLocation,
+    Product,
+    ProductLocation,
+    StockHistory,
+)
+from app.services.price_updates import MAX_PARAMS_PER_STATEMENT
+from app.services.stock_rollups import add_stock_history
+
+BATCH_MODES = ("set", "add")
+
+
+def cycle_count_source(count_id: int) -> str:
+    return f"conteo #{count_id}"
+
+
+# --- LOTES ---
+async def register_batch(
+    db: AsyncSession, count_id: int, batch_id: str, mode: str, entries: int, device: Optional[str]
+) -> bool:
+    """True si el lote es nuevo; False si ya se había recibido."""
+    result = await db.execute(
+        pg_insert(CycleCountBatch)
+        .values(
+            cycle_count_id=count_id,
+            batch_id=batch_id,
+            mode=mode,
+            entries=entries,
+            device=device,
+            received_at=datetime.utcnow(),
+        )
+        .on_conflict_do_nothing(index_elements=["cycle_count_id", "batch_id"])
+        .returning(CycleCountBatch.batch_id)
+    )
+    return result.first() is not None
+
+
+async def upsert_entries(
+    db: AsyncSession, count_id: int, counts: Dict[Tuple[int, int], int], mode: str
+) -> int:
+    """`counts`: (location_id, product_id) -> cantidad."""
+    table = CycleCountEntry.__table__
+    now = datetime.utcnow()
+    rows = [
+        {"cycle_count_id": count_id, "location_id": lid, "product_id": pid, "counted": qty, "updated_at": now}
+        for (lid, pid), qty in counts.items()
+    ]
+    size = MAX_PARAMS_PER_STATEMENT // 5
+    for start in range(0, len(rows), size):
+        stmt = pg_insert(table).values(rows[start:start + size])
+        counted = stmt.excluded.counted
+        if mode == "add":
+            counted = table.c.counted + stmt.excluded.counted
+        await db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["cycle_count_id", "location_id", "product_id"],
+                set_={"counted": counted, "updated_at": now},
+            )
+        )
+    return len(rows)
+
+
+def aggregate_counts(lines: List[Tuple[int, int, int]], mode: str) -> Dict[Tuple[int, int], int]:
+    """En `add` se suman las líneas repetidas; en `set` gana la última."""
+    if mode == "add":
+        totals: Counter = Counter()
+        for lid, pid, qty in lines:
+            totals[(lid, pid)] += qty
+        return dict(totals)
+    return {(lid, pid): qty for lid, pid, qty in lines}
+
+
+# --- CIERRE ---
+async def close_cycle_count(db: AsyncSession, count: CycleCount, zero_missing: bool = True) -> dict:
+    """Calcula diferencias y las aplica. `count` debe venir bloqueado. No hace commit."""
+    E, PL, CL = CycleCountEntry, ProductLocation, CycleCountLocation
+    cid = count.id
+    now = datetime.utcnow()
+
+    # 1. Lo asignado en los anaqueles de la sesión que nadie contó cuenta como 0
+    if zero_missing:
+        missing = (
+            select(literal(cid), PL.location_id, PL.product_id, literal(0), literal(now))
+            .join(CL, and_(CL.location_id == PL.location_id, CL.cycle_count_id == cid))
+        )
+        await db.execute(
+            pg_insert(E)
+            .from_select(["cycle_count_id", "location_id", "product_id", "counted", "updated_at"], missing)
+            .on_conflict_do_nothing(index_elements=["cycle_count_id", "location_id", "product_id"])
+        )
+
+    # 2. Cantidad esperada = lo que había en el anaquel al cerrar
+    expected = (
+        select(PL.quantity)
+        .where(PL.location_id == E.location_id, PL.product_id == E.product_id)
+        .scalar_subquery()
+    )
+    await db.execute(
+        update(E)
+        .where(E.cycle_count_id == cid)
+        .values(expected=func.coalesce(expected, 0))
+        .execution_options(synchronize_session=False)
+    )
+
+    # 3. Stock global: diferencia neta por producto
+    variance = E.counted - E.expected
+    deltas = (
+        select(E.product_id, func.sum(variance).label("delta"))
+        .where(E.cycle_count_id == cid)
+        .group_by(E.product_id)
+        .having(func.sum(variance) != 0)
+        .subquery("deltas")
+    )
+    new_stock = func.coalesce(Product.stock_quantity, 0) + deltas.c.delta
+    result = await db.execute(
+        update(Product)
+        .where(Product.id == deltas.c.product_id)
+        .values(stock_quantity=new_stock, updated_at=now)
+        .returning(Product.id, Product.stock_quantity - deltas.c.delta, Product.stock_quantity)
+        .execution_options(synchronize_session=False)
+    )
+    history = [
+        StockHistory(
+            product_id=pid,
+            change_type="AJUSTE",
+            old_value=old,
+            new_value=new,
+            source=cycle_count_source(cid),
+            date=now,
+        )
+        for pid, old, new in result.all()
+    ]
+    await add_stock_history(db, history)
+
+    # 4. Anaqueles: cantidades contadas; los renglones en cero se quitan
+    counted = (
+        select(E.location_id, E.product_id, E.counted, literal(now))
+        .where(E.cycle_count_id == cid, E.counted > 0, E.counted != E.expected)
+    )
+    stmt = pg_insert(PL).from_select(["location_id", "product_id", "quantity", "added_at"], counted)
+    await db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["location_id", "product_id"],
+            set_={"quantity": stmt.excluded.quantity},
+        )
+    )
+    emptied = (
+        select(E.location_id)
+        .where(
+            E.cycle_count_id == cid,
+            E.counted == 0,
+            E.location_id == PL.location_id,
+            E.product_id == PL.product_id,
+        )
+        .exists()
+    )
+    await db.execute(delete(PL).where(emptied).execution_options(synchronize_session=False))
+
+    # 5. Resumen
+    summary = (
+        await db.execute(
+            select(
+                func.count().filter(variance != 0),
+                func.coalesce(func.sum(func.greatest(variance, 0)), 0),
+                func.coalesce(func.sum(func.greatest(-variance, 0)), 0),
+            ).where(E.cycle_count_id == cid)
+        )
+    ).one()
+    count.status = "closed"
+    count.closed_at = now
+    count.variance_lines = summary[0]
+    count.units_over = int(summary[1])
+    count.units_short = int(summary[2])
+    return {
+        "variance_lines": count.variance_lines,
+        "units_over": count.units_over,
+        "units_short": count.units_short,
+        "products_adjusted": len(history),
+    }
@@ -0,0 +1,314 @@
+"""
+Particionado mensual y retención de stock_history y price_history.
+
+Ambas tablas están particionadas por rango sobre `date`, una partición por
+mes (`stock_history_p2025_03`) más una partición DEFAULT de respaldo. Al
+arrancar se convierten las tablas antiguas (no particionadas) y se crean las
+particiones de los próximos meses; el mantenimiento periódico sigue creando
+particiones por adelantado y, para las que superan la retención, compacta
+su contenido en los resúmenes (stock_daily_rollups / price_history_monthly)
+y las separa de la tabla (DETACH). La partición separada queda como tabla
+de archivo sin llaves foráneas: así borrar o fusionar un producto no choca
+con su historial archivado, que conserva el product_id original.
+
+Todas las funciones reciben una conexión o sesión async en una transacción.
+"""
+import asyncio
+import logging
+import os
+import re
+from datetime import date
+from typing import Dict, List, Optional
+
+from sqlalchemy import Table, text
+
+from app.core.database import engine
+from app.domain.models import PriceHistory, StockHistory
+from app.services.stock_rollups import rebuild_stock_rollups
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_MODELS = (StockHistory, PriceHistory)
+PARTITION_MONTHS_AHEAD = int(os.environ.get("HISTORY_PARTITION_MONTHS_AHEAD", "3"))
+HISTORY_RETENTION_MONTHS = int(os.environ.get("HISTORY_RETENTION_MONTHS", "24"))
+HISTORY_MAINTENANCE_HOURS = float(os.environ.get("HISTORY_MAINTENANCE_HOURS", "24"))
+MAINTENANCE_LOCK_KEY = 72_410_037  # pg advisory lock: un solo worker a la vez
+
+_PARTITION_RE = re.compile(r"_p(\d{4})_(\d{2})$")
+
+
+# --- FECHAS ---
+def month_start(d: date) -> date:
+    return d.replace(day=1)
+
+
+def add_months(d: date, months: int) -> date:
+    total = d.year * 12 + d.month - 1 + months
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month.year:04d}_{month.month:02d}"
+
+
+# --- CATÁLOGO DE POSTGRES ---
+async def relkind(conn, name: str) -> Optional[str]:
+    """'r' tabla normal, 'p' particionada, None si no existe."""
+    return (
+        await conn.execute(
+            text("SELECT c.relkind::text FROM pg_class c WHERE c.oid = to_regclass(:name)"),
+            {"name": name},
+        )
+    ).scalar()
+
+
+async def list_partitions(conn, table: str) -> Dict[date, str]:
+    """Particiones mensuales adjuntas a `table`, por mes."""
+    rows = (
+        await conn.execute(
+            text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = to_regclass(:table)"
+            ),
+            {"table": table},
+        )
+    ).scalars().all()
+    months = {}
+    for name in rows:
+        m = _PARTITION_RE.search(name)
+        if m:
+            months[date(int(m.group(1)), int(m.group(2)), 1)] = name
+    return months
+
+
+async def list_archives(conn, table: str) -> Dict[date, str]:
+    """Particiones mensuales ya separadas de `table` (tablas de archivo), por mes."""
+    rows = (
+        await conn.execute(
+            text(
+                "SELECT relname FROM pg_class "
+                "WHERE relkind = 'r' AND NOT relispartition AND relname LIKE :prefix"
+            ),
+            {"prefix": f"{table}_p%"},
+        )
+    ).scalars().all()
+    months = {}
+    for name in rows:
+        m = _PARTITION_RE.search(name)
+        if m and name == table + m.group(0):
+            months[date(int(m.group(1)), int(m.group(2)), 1)] = name
+    return months
+
+
+async def archived_until(conn, table: str) -> Optional[date]:
+    """
+    Primer día posterior al último mes archivado (partición separada) de
+    `table`, o None si no hay ninguno. Antes de esa fecha el historial crudo
+    ya no está en la tabla: sus resúmenes son la única copia.
+    """
+    months = await list_archives(conn, table)
+    return add_months(max(months), 1) if months else None
+
+
+async def drop_foreign_keys(conn, name: str) -> None:
+    """Quita las llaves foráneas que una partición separada hereda de su tabla."""
+    rows = (
+        await conn.execute(
+            text("SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:name) AND contype = 'f'"),
+            {"name": name},
+        )
+    ).scalars().all()
+    for conname in rows:
+        await conn.execute(text(f'ALTER TABLE {name} DROP CONSTRAINT "{conname}"'))
+
+
+# --- CREACIÓN ---
+async def create_partition(conn, table: str, month: date) -> bool:
+    name = partition_name(table, month)
+    try:
+        async with conn.begin_nested():
+            await conn.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+                    f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+                )
+            )
+        return True
+    except Exception as e:
+        # Ej: la partición DEFAULT ya tiene filas de ese mes
+        logger.warning("No se pudo crear la partición %s: %s", name, e)
+        return False
+
+
+async def ensure_partitions(conn, table: str, months_ahead: int = PARTITION_MONTHS_AHEAD) -> List[str]:
+    """Partición DEFAULT + mes actual + `months_ahead` meses siguientes."""
+    await conn.execute(
+        text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT")
+    )
+    existing = await list_partitions(conn, table)
+    current = month_start(date.today())
+    created = []
+    for i in range(months_ahead + 1):
+        month = add_months(current, i)
+        if month not in existing and await create_partition(conn, table, month):
+            created.append(partition_name(table, month))
+    return created
+
+
+async def convert_to_partitioned(conn, table: Table) -> bool:
+    """
+    Migra una tabla de historial no particionada: crea `<tabla>_part`
+    particionada con las mismas columnas y la secuencia del id, crea las
+    particiones de los meses con datos, copia las filas, borra la original
+    y renombra. Llamar dentro de un savepoint.
+    """
+    name = table.name
+    if await relkind(conn, name) != "r":
+        return False
+    tmp = f"{name}_part"
+    seq = (
+        await conn.execute(text("SELECT pg_get_serial_sequence(:t, 'id')"), {"t": name})
+    ).scalar()
+    if not seq:
+        raise RuntimeError(f"{name}.id no tiene secuencia")
+
+    await conn.execute(
+        text(f"CREATE TABLE {tmp} (LIKE {name} INCLUDING DEFAULTS) PARTITION BY RANGE (date)")
+    )
+    await conn.execute(text(f"ALTER TABLE {tmp} ALTER COLUMN date SET NOT NULL"))
+    await conn.execute(text(f"ALTER TABLE {tmp} ADD PRIMARY KEY (id, date)"))
+    await conn.execute(
+        text(f"ALTER TABLE {tmp} ADD FOREIGN KEY (product_id) REFERENCES products (id)")
+    )
+    # La secuencia pasa a la tabla nueva para que no se borre con la vieja
+    await conn.execute(text(f"ALTER SEQUENCE {seq} OWNED BY {tmp}.id"))
+
+    await conn.execute(text(f"CREATE TABLE {tmp}_default PARTITION OF {tmp} DEFAULT"))
+    months = (
+        await conn.execute(
+            text(f"SELECT DISTINCT date_trunc('month', date)::date FROM {name} WHERE date IS NOT NULL")
+        )
+    ).scalars().all()
+    current = month_start(date.today())
+    months = sorted(set(months) | {add_months(current, i) for i in range(PARTITION_MONTHS_AHEAD + 1)})
+    for month in months:
+        await conn.execute(
+            text(
+                f"CREATE TABLE {partition_name(name, month)} PARTITION OF {tmp} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+            )
+        )
+
+    cols = [c.name for c in table.columns]
+    select_cols = ", ".join("COALESCE(date, now())" if c == "date" else c for c in cols)
+    await conn.execute(
+        text(f"INSERT INTO {tmp} ({', '.join(cols)}) SELECT {select_cols} FROM {name}")
+    )
+    await conn.execute(text(f"DROP TABLE {name}"))
+
+    await conn.execute(text(f"ALTER TABLE {tmp} RENAME TO {name}"))
+    await conn.execute(text(f"ALTER TABLE {tmp}_default RENAME TO {name}_default"))
+    await conn.execute(text(f"ALTER TABLE {name} RENAME CONSTRAINT {tmp}_pkey TO {name}_pkey"))
+    await conn.execute(
+        text(
+            f"ALTER TABLE {name} RENAME CONSTRAINT {tmp}_product_id_fkey TO {name}_product_id_fkey"
+        )
+    )
+    await conn.run_sync(lambda sync_conn: [i.create(sync_conn, checkfirst=True) for i in table.indexes])
+    return True
+
+
+async def setup_history_partitions(conn) -> None:
+    """Arranque: migrar tablas antiguas y asegurar particiones próximas."""
+    for model in PARTITIONED_MODELS:
+        table = model.__table__
+        try:
+            async with conn.begin_nested():
+                if await convert_to_partitioned(conn, table):
+                    logger.info("%s convertida a tabla particionada", table.name)
+        except Exception as e:
+            logger.warning("No se pudo particionar %s: %s", table.name, e)
+        try:
+            async with conn.begin_nested():
+                if await relkind(conn, table.name) == "p":
+                    await ensure_partitions(conn, table.name)
+        except Exception as e:
+            logger.warning("No se pudieron crear particiones de %s: %s", table.name, e)
+        # Archivos separados antes de que el mantenimiento quitara sus FKs
+        try:
+            async with conn.begin_nested():
+                for archive in (await list_archives(conn, table.name)).values():
+                    await drop_foreign_keys(conn, archive)
+        except Exception as e:
+            logger.warning("No se pudieron limpiar los archivos de %s: %s", table.name, e)
+
+
+# --- RETENCIÓN ---
+async def compact_price_partition(conn, partition: str, month: date) -> None:
+    """Resume una partición de price_history en price_history_monthly."""
+    await conn.execute(
+        text("DELETE FROM price_history_monthly WHERE month = :month"), {"month": month}
+    )
+    await conn.execute(
+        text(
+            "INSERT INTO price_history_monthly "
+            "(month, product_id, change_type, changes, first_old_value, last_new_value, "
+            "min_value, max_value, avg_value) "
+            "SELECT :month, product_id, COALESCE(change_type, ''), count(*), "
+            "(array_agg(old_value ORDER BY date, id))[1], "
+            "(array_agg(new_value ORDER BY date DESC, id DESC))[1], "
+            "min(new_value), max(new_value), avg(new_value) "
+            f"FROM {partition} WHERE product_id IS NOT NULL "
+            "GROUP BY product_id, COALESCE(change_type, '')"
+        ),
+        {"month": month},
+    )
+
+
+async def run_history_maintenance(conn, retention_months: int = HISTORY_RETENTION_MONTHS) -> dict:
+    """
+    Crea particiones por adelantado y archiva las que tienen más de
+    `retention_months` meses: resume su contenido, las separa (DETACH) y
+    les quita las llaves foráneas.
+    """
+    cutoff = add_months(month_start(date.today()), -max(retention_months, 1))
+    result = {"created": [], "detached": []}
+    for model in PARTITIONED_MODELS:
+        table = model.__table__.name
+        if await relkind(conn, table) != "p":
+            continue
+        result["created"] += await ensure_partitions(conn, table)
+        for month, partition in sorted((await list_partitions(conn, table)).items()):
+            if month >= cutoff:
+                continue
+            if model is StockHistory:
+                await rebuild_stock_rollups(conn, since=month, until=add_months(month, 1))
+            else:
+                await compact_price_partition(conn, partition, month)
+            await conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {partition}"))
+            await drop_foreign_keys(conn, partition)
+            result["detached"].append(partition)
+    result["cutoff"] = cutoff
+    return result
+
+
+async def history_maintenance_loop() -> None:
+    """Tarea de fondo: mantenimiento cada HISTORY_MAINTENANCE_HOURS horas."""
+    if HISTORY_MAINTENANCE_HOURS <= 0:
+        return
+    while True:
+        await asyncio.sleep(HISTORY_MAINTENANCE_HOURS * 3600)
+        try:
+            async with engine.begin() as conn:
+                locked = (
+                    await conn.execute(
+                        text("SELECT pg_try_advisory_xact_lock(:key)"),
+                        {"key": MAINTENANCE_LOCK_KEY},
+                    )
+                ).scalar()
+                if locked:
+                    result = await run_history_maintenance(conn)
+                    logger.info("Mantenimiento de historial: %s", result)
+        except Exception as e:
+            logger.warning("Mantenimiento de historial falló: %s", e)
@@ -0,0 +1,326 @@
+"""
+Snapshots de inventario para valuación histórica.
+
+Un snapshot guarda stock, costo y precio de venta por producto. Los
+completos (`full`) guardan todo el catálogo; los `delta` solo los productos
+que cambiaron respecto al estado anterior de su cadena (los borrados quedan
+en cero). El estado en un snapshot se reconstruye con un DISTINCT ON sobre
+la cadena completo + deltas.
+
+La valuación en una fecha D parte del último snapshot <= D y aplica el último
+valor de StockHistory / PriceHistory en (snapshot, D]. Si no hay snapshot
+previo, parte del catálogo actual y retrocede con el primer `old_value`
+posterior a D. En ambos casos se excluyen los productos que en D ya estaban
+borrados o fusionados (su stock pasó al producto que se conservó) y los que
+todavía no existían.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import Integer, and_, func, insert, literal, or_, select, text, union
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.database import SessionLocal
+from app.domain.models import (
+    InventorySnapshot,
+    InventorySnapshotItem,
+    PriceHistory,
+    Product,
+    ProductTombstone,
+    StockHistory,
+)
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FULL_EVERY = int(os.environ.get("SNAPSHOT_FULL_EVERY", "7"))  # deltas entre completos
+SNAPSHOT_INTERVAL_HOURS = float(os.environ.get("SNAPSHOT_INTERVAL_HOURS", "24"))
+SNAPSHOT_LOCK_KEY = 72_410_038
+# Un snapshot tomado poco antes de vencer el periodo cuenta como el del
+# periodo: el timer puede despertar unos segundos antes de tiempo
+SNAPSHOT_SLACK_SECONDS = 300
+
+
+def snapshot_to_dict(s: InventorySnapshot) -> dict:
+    return {
+        "id": s.id,
+        "taken_at": s.taken_at,
+        "kind": s.kind,
+        "base_id": s.base_id,
+        "source": s.source,
+        "product_count": s.product_count,
+        "total_units": s.total_units,
+        "cost_value": round(s.cost_value or 0, 2),
+        "sale_value": round(s.sale_value or 0, 2),
+        "items_written": s.items_written,
+    }
+
+
+def snapshot_state(snapshot: InventorySnapshot):
+    """Estado por producto en `snapshot`: último valor de su cadena."""
+    I, S = InventorySnapshotItem, InventorySnapshot
+    return (
+        select(I.product_id, I.stock, I.cost, I.selling_price)
+        .join(S, S.id == I.snapshot_id)
+        .where(S.base_id == snapshot.base_id, S.id <= snapshot.id)
+        .distinct(I.product_id)
+        .order_by(I.product_id, I.snapshot_id.desc())
+        .subquery("state")
+    )
+
+
+# --- TOMA DE SNAPSHOTS ---
+async def take_snapshot(db: AsyncSession, source: str = "manual", force_full: bool = False) -> InventorySnapshot:
+    P = Product
+    prev = (
+        await db.execute(select(InventorySnapshot).order_by(InventorySnapshot.id.desc()).limit(1))
+    ).scalar_one_or_none()
+    full = force_full or prev is None
+    if not full:
+        chain = (
+            await db.execute(
+                select(func.count()).where(InventorySnapshot.base_id == prev.base_id)
+            )
+        ).scalar()
+        full = chain > SNAPSHOT_FULL_EVERY
+
+    totals = (
+        await db.execute(
+            select(
+                func.count(P.id),
+                func.sum(P.stock_quantity),
+                func.sum(P.stock_quantity * P.price),
+                func.sum(P.stock_quantity * P.selling_price),
+            )
+        )
+    ).one()
+    snap = InventorySnapshot(
+        taken_at=datetime.utcnow(),
+        kind="full" if full else "delta",
+        source=source,
+        product_count=totals[0] or 0,
+        total_units=totals[1] or 0,
+        cost_value=totals[2] or 0.0,
+        sale_value=totals[3] or 0.0,
+    )
+    db.add(snap)
+    await db.flush()
+    snap.base_id = snap.id if full else prev.base_id
+
+    stock = func.coalesce(P.stock_quantity, 0)
+    cost = func.coalesce(P.price, 0.0)
+    sp = func.coalesce(P.selling_price, 0.0)
+    cols = ["snapshot_id", "product_id", "stock", "cost", "selling_price"]
+    sid = literal(snap.id, Integer)
+    table = InventorySnapshotItem.__table__
+
+    if full:
+        result = await db.execute(insert(table).from_select(cols, select(sid, P.id, stock, cost, sp)))
+        written = result.rowcount or 0
+    else:
+        state = snapshot_state(prev)
+        changed = (
+            select(sid, P.id, stock, cost, sp)
+            .outerjoin(state, state.c.product_id == P.id)
+            .where(
+                or_(
+                    state.c.product_id == None,
+                    state.c.stock.is_distinct_from(stock),
+                    state.c.cost.is_distinct_from(cost),
+                    state.c.selling_price.is_distinct_from(sp),
+                )
+            )
+        )
+        # Productos borrados desde el snapshot anterior: quedan en cero
+        removed = select(sid, state.c.product_id, literal(0), literal(0.0), literal(0.0)).where(
+            ~select(P.id).where(P.id == state.c.product_id).exists(),
+            or_(state.c.stock != 0, state.c.cost != 0, state.c.selling_price != 0),
+        )
+        written = (await db.execute(insert(table).from_select(cols, changed))).rowcount or 0
+        written += (await db.execute(insert(table).from_select(cols, removed))).rowcount or 0
+
+    snap.items_written = written
+    return snap
+
+
+# --- VALUACIÓN HISTÓRICA ---
+def _first_or_last(model, value_col, where, last: bool):
+    order = (model.date.desc(), model.id.desc()) if last else (model.date.asc(), model.id.asc())
+    return (
+        select(model.product_id, value_col.label("v"))
+        .where(model.product_id != None, *where)
+        .distinct(model.product_id)
+        .order_by(model.product_id, *order)
+        .subquery()
+    )
+
+
+def removed_by(product_id, at: datetime):
+    """El producto ya estaba borrado o fusionado en `at` (tiene lápida)."""
+    T = ProductTombstone
+    return select(T.id).where(T.product_id == product_id, T.deleted_at <= at).exists()
+
+
+def history_until(product_id, at: datetime):
+    """El producto tiene algún movimiento de stock o precio en o antes de `at`."""
+    SH, PH = StockHistory, PriceHistory
+    return or_(
+        select(SH.id).where(SH.product_id == product_id, SH.date <= at).exists(),
+        select(PH.id).where(PH.product_id == product_id, PH.date <= at).exists(),
+    )
+
+
+def valuation_rows(at: datetime, snapshot: Optional[InventorySnapshot]):
+    """Subconsulta (product_id, stock, cost, selling_price) en la fecha `at`."""
+    P, SH, PH = Product, StockHistory, PriceHistory
+    if snapshot is not None:
+        state = snapshot_state(snapshot)
+        window = (SH.date > snapshot.taken_at, SH.date <= at)
+        pwindow = (PH.date > snapshot.taken_at, PH.date <= at)
+        ls = _first_or_last(SH, SH.new_value, window, last=True)
+        lc = _first_or_last(PH, PH.new_value, (*pwindow, PH.change_type == "COSTO"), last=True)
+        lp = _first_or_last(PH, PH.new_value, (*pwindow, PH.change_type == "PRECIO"), last=True)
+        universe = union(select(state.c.product_id), select(ls.c.product_id)).subquery("u")
+        return (
+            select(
+                universe.c.product_id,
+                func.coalesce(ls.c.v, state.c.stock, 0).label("stock"),
+                func.coalesce(lc.c.v, state.c.cost, P.price, 0.0).label("cost"),
+                func.coalesce(lp.c.v, state.c.selling_price, P.selling_price, 0.0).label("selling_price"),
+            )
+            .select_from(universe)
+            .outerjoin(state, state.c.product_id == universe.c.product_id)
+            .outerjoin(ls, ls.c.product_id == universe.c.product_id)
+            .outerjoin(lc, lc.c.product_id == universe.c.product_id)
+            .outerjoin(lp, lp.c.product_id == universe.c.product_id)
+            .outerjoin(P, P.id == universe.c.product_id)
+            # Fusionado en (snapshot, at]: su stock ya cuenta en el que se conservó
+            .where(~removed_by(universe.c.product_id, at))
+            .subquery("valuation")
+        )
+
+    # Sin snapshot previo: catálogo actual, retrocediendo con el primer old_value posterior
+    fs = _first_or_last(SH, SH.old_value, (SH.date > at,), last=False)
+    fc = _first_or_last(PH, PH.old_value, (PH.date > at, PH.change_type == "COSTO"), last=False)
+    fp = _first_or_last(PH, PH.old_value, (PH.date > at, PH.change_type == "PRECIO"), last=False)
+    return (
+        select(
+            P.id.label("product_id"),
+            func.coalesce(fs.c.v, P.stock_quantity, 0).label("stock"),
+            func.coalesce(fc.c.v, P.price, 0.0).label("cost"),
+            func.coalesce(fp.c.v, P.selling_price, 0.0).label("selling_price"),
+        )
+        .outerjoin(fs, fs.c.product_id == P.id)
+        .outerjoin(fc, fc.c.product_id == P.id)
+        .outerjoin(fp, fp.c.product_id == P.id)
+        # Sin fecha de alta, existía solo si ya tenía movimientos en `at`
+        .where(or_(P.created_at <= at, and_(P.created_at == None, history_until(P.id, at))))
+        .subquery("valuation")
+    )
+
+
+async def valuation_at(
+    db: AsyncSession, at: datetime, detail: bool = False, limit: int = 50, offset: int = 0
+) -> dict:
+    snapshot = (
+        await db.execute(
+            select(InventorySnapshot)
+            .where(InventorySnapshot.taken_at <= at)
+            .order_by(InventorySnapshot.taken_at.desc(), InventorySnapshot.id.desc())
+            .limit(1)
+        )
+    ).scalar_one_or_none()
+    v = valuation_rows(at, snapshot)
+    totals = (
+        await db.execute(
+            select(
+                func.count().filter(v.c.stock > 0),
+                func.sum(v.c.stock),
+                func.sum(v.c.stock * v.c.cost),
+                func.sum(v.c.stock * v.c.selling_price),
+            )
+        )
+    ).one()
+    data = {
+        "at": at,
+        "method": "snapshot" if snapshot else "live",
+        "snapshot": snapshot_to_dict(snapshot) if snapshot else None,
+        "products_in_stock": totals[0] or 0,
+        "total_units": int(totals[1] or 0),
+        "cost_value": round(totals[2] or 0, 2),
+        "sale_value": round(totals[3] or 0, 2),
+    }
+    if detail:
+        value = (v.c.stock * v.c.cost).label("cost_value")
+        rows = (
+            await db.execute(
+                select(
+                    v.c.product_id,
+                    Product.name,
+                    Product.sku,
+                    v.c.stock,
+                    v.c.cost,
+                    v.c.selling_price,
+                    value,
+                )
+                .outerjoin(Product, Product.id == v.c.product_id)
+                .where(v.c.stock != 0)
+                .order_by(value.desc(), v.c.product_id)
+                .limit(limit)
+                .offset(offset)
+            )
+        ).all()
+        data["items"] = [
+            {
+                "product_id": r.product_id,
+                "name": r.name or "",
+                "sku": r.sku or "",
+                "stock": r.stock,
+                "cost": r.cost,
+                "selling_price": r.selling_price,
+                "cost_value": round(r.cost_value or 0, 2),
+            }
+            for r in rows
+        ]
+    return data
+
+
+async def run_scheduled_snapshot() -> Optional[datetime]:
+    """Toma el snapshot del periodo si falta. Devuelve la fecha del último."""
+    async with SessionLocal() as db:
+        locked = (
+            await db.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": SNAPSHOT_LOCK_KEY})
+        ).scalar()
+        last = (await db.execute(select(func.max(InventorySnapshot.taken_at)))).scalar()
+        # Con varios workers, solo uno toma el snapshot del periodo
+        age = (datetime.utcnow() - last).total_seconds() if last else None
+        recent = age is not None and age < SNAPSHOT_INTERVAL_HOURS * 3600 - SNAPSHOT_SLACK_SECONDS
+        if locked and not recent:
+            snap = await take_snapshot(db, source="schedule")
+            snap_id, kind, last = snap.id, snap.kind, snap.taken_at
+            await db.commit()
+            logger.info("Snapshot de inventario %s (%s)", snap_id, kind)
+        return last
+
+
+async def snapshot_loop() -> None:
+    """
+    Tarea de fondo: un snapshot cada SNAPSHOT_INTERVAL_HOURS horas. Revisa al
+    arrancar (así los reinicios frecuentes no se saltan el del periodo) y
+    luego duerme hasta que toque el siguiente.
+    """
+    if SNAPSHOT_INTERVAL_HOURS <= 0:
+        return
+    interval = SNAPSHOT_INTERVAL_HOURS * 3600
+    while True:
+        wait = interval
+        try:
+            last = await run_scheduled_snapshot()
+            if last:
+                due_in = interval - (datetime.utcnow() - last).total_seconds()
+                wait = min(interval, max(due_in, 60))
+        except Exception as e:
+            logger.warning("Snapshot de inventario falló: %s", e)
+        await asyncio.sleep(wait)
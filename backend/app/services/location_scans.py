@@ -0,0 +1,132 @@
+"""
+Asignación de productos a ubicaciones por escaneo.
+
+Los códigos escaneados se resuelven contra un índice en memoria: UPC / SKU
+-> producto y código de anaquel -> ubicación. El índice se reconstruye solo
+cuando cambia la versión del catálogo; las escrituras de este módulo
+(cantidades en product_locations) no cambian códigos, así que re-sellan el
+índice con la versión nueva en lugar de invalidarlo.
+
+Una secuencia de escaneos se interpreta así: un código de ubicación fija el
+anaquel actual y cada código de producto posterior suma una pieza en ese
+anaquel. Los totales se aplican en bloque con un upsert que suma cantidades.
+"""
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.domain.models import Location, Product
+from app.services.catalog_cache import bump_catalog_version, get_catalog_version
+from app.services.product_locations import upsert_quantities
+
+
+def normalize_location_code(raw: str) -> str:
+    """Igual que `sanitize_code` de las ubicaciones."""
+    return raw.strip().replace("-", "").upper()[:50]
+
+
+def normalize_product_code(raw: str) -> str:
+    return raw.strip().upper()
+
+
+# --- ÍNDICE EN MEMORIA ---
+@dataclass
+class ScanIndex:
+    version: int = -1
+    products: Dict[str, Tuple[int, str]] = field(default_factory=dict)  # código -> (id, nombre)
+    locations: Dict[str, Tuple[int, str]] = field(default_factory=dict)  # código -> (id, código)
+
+
+_index = ScanIndex()
+
+
+async def get_scan_index(db: AsyncSession) -> ScanIndex:
+    global _index
+    version = await get_catalog_version(db)
+    if _index.version == version:
+        return _index
+
+    index = ScanIndex(version=version)
+    rows = await db.execute(select(Product.id, Product.name, Product.sku, Product.upc))
+    for pid, name, sku, upc in rows.all():
+        # El SKU gana sobre un UPC repetido: es único por producto
+        if upc and upc.strip():
+            index.products.setdefault(normalize_product_code(upc), (pid, name))
+        if sku and sku.strip():
+            index.products[normalize_product_code(sku)] = (pid, name)
+    for lid, code in (await db.execute(select(Location.id, Location.code))).all():
+        if code:
+            index.locations[normalize_location_code(code)] = (lid, code)
+    _index = index
+    return index
+
+
+# --- APLICACIÓN DE ESCANEOS ---
+async def apply_scans(
+    db: AsyncSession, scans: Iterable[str], location_code: Optional[str] = None
+) -> dict:
+    """
+    Resuelve y aplica una secuencia de escaneos y hace commit. Devuelve el
+    resumen y la última ubicación activa (para continuar en el siguiente lote).
+    """
+    index = await get_scan_index(db)
+    current = index.locations.get(normalize_location_code(location_code)) if location_code else None
+
+    totals: Counter = Counter()
+    names: Dict[int, str] = {}
+    codes: Dict[int, str] = {}
+    unknown: List[str] = []
+    without_location = 0
+    scanned = 0
+    for raw in scans:
+        if not raw or not raw.strip():
+            continue
+        scanned += 1
+        loc = index.locations.get(normalize_location_code(raw))
+        if loc:
+            current = loc
+            continue
+        product = index.products.get(normalize_product_code(raw))
+        if not product:
+            unknown.append(raw.strip())
+        elif not current:
+            without_location += 1
+        else:
+            totals[(current[0], product[0])] += 1
+            names[product[0]] = product[1]
+            codes[current[0]] = current[1]
+
+    applied = []
+    if totals:
+        rows = [
+            {"location_id": lid, "product_id": pid, "quantity": added}
+            for (lid, pid), added in totals.items()
+        ]
+        quantities = await upsert_quantities(db, rows, increment=True)
+        for (lid, pid), added in totals.items():
+            applied.append({
+                "location_code": codes[lid],
+                "product_id": pid,
+                "name": names[pid],
+                "added": added,
+                "quantity": quantities.get((lid, pid), added),
+            })
+
+        await bump_catalog_version(db)
+        new_version = await get_catalog_version(db)
+        await db.commit()
+        # Solo cambiaron cantidades: el índice sigue vigente con la versión nueva
+        # (si nadie más escribió entre medio, la versión avanzó exactamente 1)
+        if index is _index and new_version == index.version + 1:
+            index.version = new_version
+
+    return {
+        "scans": scanned,
+        "applied": applied,
+        "unknown": unknown,
+        "without_location": without_location,
+        "location_code": current[1] if current else None,
+    }
@@ -0,0 +1,67 @@
+"""
+Escrituras masivas sobre productos e historial de precios.
+
+`bulk_update_products` aplica valores ya calculados en memoria con un solo
+`UPDATE products ... FROM (VALUES ...)` por bloque, e `insert_price_history`
+escribe el historial con INSERTs de varias filas. Los bloques respetan el
+límite de parámetros por sentencia de asyncpg.
+"""
+from datetime import datetime
+from typing import Dict, List
+
+from sqlalchemy import Integer, cast, column, insert, update, values
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.types import TypeEngine
+
+from app.domain.models import PriceHistory, Product
+
+MAX_PARAMS_PER_STATEMENT = 30000
+
+
+def _chunks(rows: List, width: int):
+    size = max(1, MAX_PARAMS_PER_STATEMENT // max(width, 1))
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+async def bulk_update_products(
+    db: AsyncSession, rows: List[dict], types: Dict[str, TypeEngine]
+) -> int:
+    """
+    `rows` son dicts con "id" y el valor final de cada columna en `types`
+    (ej: {"selling_price": Float()}). También marca updated_at.
+
+    Cada columna se convierte a su tipo al asignarla: si en un bloque todos
+    los valores son None, Postgres tipa la columna del VALUES como text.
+    """
+    if not rows:
+        return 0
+    table = Product.__table__
+    names = list(types)
+    now = datetime.utcnow()
+    for part in _chunks(rows, len(names) + 1):
+        v = (
+            values(
+                column("id", Integer()),
+                *[column(name, types[name]) for name in names],
+                name="v",
+            )
+            .data([(r["id"], *[r[name] for name in names]) for r in part])
+        )
+        await db.execute(
+            update(table)
+            .where(table.c.id == v.c.id)
+            .values({**{name: cast(v.c[name], types[name]) for name in names}, "updated_at": now})
+        )
+    return len(rows)
+
+
+async def insert_price_history(db: AsyncSession, rows: List[dict]) -> int:
+    """`rows`: dicts con product_id, change_type, old_value y new_value."""
+    if not rows:
+        return 0
+    now = datetime.utcnow()
+    table = PriceHistory.__table__
+    for part in _chunks(rows, 5):
+        await db.execute(insert(table).values([{**r, "date": now} for r in part]))
+    return len(rows)
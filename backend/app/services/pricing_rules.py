@@ -0,0 +1,141 @@
+"""
+Motor de reglas de precio.
+
+Carga costo, precio y proveedor de los productos candidatos en arreglos de
+numpy y evalúa todas las reglas activas de forma vectorizada: cada producto
+toma la primera regla (por prioridad) cuyos filtros cumple. La vista previa y
+la aplicación usan el mismo cálculo.
+"""
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.domain.models import PricingRule, Product, ProductCategory
+
+
+@dataclass
+class RepricingResult:
+    ids: np.ndarray
+    names: List[str]
+    cost: np.ndarray
+    current: np.ndarray
+    new: np.ndarray
+    rule_ids: np.ndarray  # -1 si ninguna regla aplicó
+    changed: np.ndarray  # máscara booleana
+
+    @property
+    def evaluated(self) -> int:
+        return int(self.ids.size)
+
+    @property
+    def matched(self) -> int:
+        return int((self.rule_ids >= 0).sum())
+
+    def changes(self, limit: Optional[int] = None) -> List[dict]:
+        idx = np.flatnonzero(self.changed)
+        if limit is not None:
+            idx = idx[:limit]
+        return [
+            {
+                "id": int(self.ids[i]),
+                "name": self.names[i],
+                "cost": float(self.cost[i]),
+                "old_price": float(self.current[i]),
+                "new_price": float(self.new[i]),
+                "rule_id": int(self.rule_ids[i]),
+            }
+            for i in idx
+        ]
+
+
+def rule_prices(rule: PricingRule, cost: np.ndarray) -> np.ndarray:
+    value = rule.value or 0.0
+    if rule.mode == "margin":
+        raw = cost / (1 - value / 100.0)
+    else:
+        raw = cost * (1 + value / 100.0)
+
+    step = rule.rounding_step or 0.0
+    ending = rule.price_ending
+    if ending is not None:
+        # Siguiente precio >= raw que termina en `ending` (ej: 0.90, 9.90)
+        step = step or 1.0
+        return np.round(np.ceil(np.round((raw - ending) / step, 6)) * step + ending, 2)
+    if step > 0:
+        return np.round(np.ceil(np.round(raw / step, 6)) * step, 2)
+    return np.round(raw, 2)
+
+
+async def evaluate_rules(
+    db: AsyncSession,
+    rule_ids: Optional[List[int]] = None,
+    product_ids: Optional[List[int]] = None,
+    supplier_id: Optional[int] = None,
+    only_missing_price: bool = False,
+) -> RepricingResult:
+    rules_stmt = (
+        select(PricingRule)
+        .where(PricingRule.is_active == True)
+        .order_by(PricingRule.priority.asc(), PricingRule.id.asc())
+    )
+    # Una lista vacía no selecciona nada (None = sin filtro)
+    if rule_ids is not None:
+        rules_stmt = rules_stmt.where(PricingRule.id.in_(rule_ids))
+    rules = (await db.execute(rules_stmt)).scalars().all()
+
+    stmt = select(
+        Product.id, Product.name, Product.price, Product.selling_price, Product.supplier_id
+    ).where(Product.price > 0)
+    if product_ids is not None:
+        stmt = stmt.where(Product.id.in_(product_ids))
+    if supplier_id:
+        stmt = stmt.where(Product.supplier_id == supplier_id)
+    if only_missing_price:
+        stmt = stmt.where(or_(Product.selling_price == None, Product.selling_price <= 0))
+    rows = (await db.execute(stmt.order_by(Product.id))).all()
+
+    n = len(rows)
+    ids = np.fromiter((r.id for r in rows), dtype=np.int64, count=n)
+    cost = np.fromiter((r.price or 0.0 for r in rows), dtype=np.float64, count=n)
+    current = np.fromiter((r.selling_price or 0.0 for r in rows), dtype=np.float64, count=n)
+    suppliers = np.fromiter((r.supplier_id or -1 for r in rows), dtype=np.int64, count=n)
+    names = [r.name for r in rows]
+
+    # Miembros de cada categoría usada por alguna regla (una sola consulta)
+    category_ids = {r.category_id for r in rules if r.category_id}
+    members: Dict[int, np.ndarray] = {}
+    if category_ids and n:
+        pc_rows = (
+            await db.execute(
+                select(ProductCategory.category_id, ProductCategory.product_id).where(
+                    ProductCategory.category_id.in_(category_ids)
+                )
+            )
+        ).all()
+        grouped: Dict[int, List[int]] = {}
+        for cat_id, pid in pc_rows:
+            grouped.setdefault(cat_id, []).append(pid)
+        members = {cat_id: np.array(pids, dtype=np.int64) for cat_id, pids in grouped.items()}
+
+    new = current.copy()
+    applied = np.full(n, -1, dtype=np.int64)
+    for rule in rules:
+        mask = applied < 0
+        if rule.supplier_id:
+            mask &= suppliers == rule.supplier_id
+        if rule.category_id:
+            mask &= np.isin(ids, members.get(rule.category_id, np.empty(0, dtype=np.int64)))
+        if rule.min_cost is not None:
+            mask &= cost >= rule.min_cost
+        if rule.max_cost is not None:
+            mask &= cost < rule.max_cost
+        if not mask.any():
+            continue
+        new[mask] = rule_prices(rule, cost[mask])
+        applied[mask] = rule.id
+
+    changed = (applied >= 0) & (np.abs(new - current) > 0.01)
+    return RepricingResult(ids, names, cost, current, new, applied, changed)
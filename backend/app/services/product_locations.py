@@ -0,0 +1,51 @@
+"""
+Escrituras en bloque sobre product_locations.
+
+(location_id, product_id) es único, así que las altas y cambios de cantidad
+son upserts (INSERT ... ON CONFLICT DO UPDATE): dos escrituras concurrentes
+sobre el mismo par no pueden duplicar la fila.
+"""
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import delete, func, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.domain.models import ProductLocation
+from app.services.price_updates import MAX_PARAMS_PER_STATEMENT
+
+PAIR = ["location_id", "product_id"]
+
+
+async def upsert_quantities(
+    db, rows: List[dict], increment: bool = False
+) -> Dict[Tuple[int, int], int]:
+    """
+    `rows`: dicts con location_id, product_id y quantity. Con `increment`
+    la cantidad se suma a la existente; si no, la reemplaza. Devuelve la
+    cantidad final por (location_id, product_id).
+    """
+    table = ProductLocation.__table__
+    size = MAX_PARAMS_PER_STATEMENT // 3
+    final = {}
+    for start in range(0, len(rows), size):
+        stmt = pg_insert(table).values(rows[start:start + size])
+        quantity = stmt.excluded.quantity
+        if increment:
+            quantity = func.coalesce(table.c.quantity, 0) + stmt.excluded.quantity
+        result = await db.execute(
+            stmt.on_conflict_do_update(index_elements=PAIR, set_={"quantity": quantity})
+            .returning(table.c.location_id, table.c.product_id, table.c.quantity)
+        )
+        final.update({(lid, pid): qty for lid, pid, qty in result.all()})
+    return final
+
+
+async def delete_pairs(db, pairs: Iterable[Tuple[int, int]]) -> int:
+    pairs = list(pairs)
+    if not pairs:
+        return 0
+    table = ProductLocation.__table__
+    result = await db.execute(
+        delete(table).where(tuple_(table.c.location_id, table.c.product_id).in_(pairs))
+    )
+    return result.rowcount or 0
@@ -0,0 +1,109 @@
+"""
+Proyecciones de columnas para las vistas de productos.
+
+Cada vista declara sus campos de salida como expresiones SQL (los valores por
+defecto como `upc or ""` se resuelven con COALESCE). Las consultas devuelven
+filas ligeras en lugar de entidades `Product`, sin identity map ni
+seguimiento de cambios, y cada fila se convierte directo en dict.
+
+El parámetro `fields=` de cada vista elige un subconjunto de esos campos: la
+lista manda tanto en las columnas del SELECT como en la forma de la respuesta.
+"""
+from typing import Dict, Iterable, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import false, func, or_
+
+from app.domain.models import ImportBatchItem, Product, ProductCategory, ProductLocation, Supplier
+
+# GET /invoices/products
+PRODUCT_LIST_FIELDS = {
+    "id": Product.id,
+    "sku": Product.sku,
+    "upc": func.coalesce(Product.upc, ""),
+    "name": Product.name,
+    "alias": func.coalesce(Product.alias, ""),
+    "price": Product.price,
+    "selling_price": Product.selling_price,
+    "stock": Product.stock_quantity,
+    "supplier_id": Product.supplier_id,
+    "supplier_name": func.coalesce(Supplier.name, ""),
+    "is_delicate": func.coalesce(Product.is_delicate, false()),
+}
+
+# GET /invoices/batches/{id}/products
+BATCH_ITEM_FIELDS = {
+    "id": Product.id,
+    "sku": Product.sku,
+    "upc": Product.upc,
+    "name": Product.name,
+    "alias": func.coalesce(Product.alias, ""),
+    "price": Product.price,
+    "selling_price": Product.selling_price,
+    "stock": Product.stock_quantity,  # Stock total global
+    "quantity": func.coalesce(ImportBatchItem.quantity, 0),  # Cantidad de este lote
+    "missing_price": or_(Product.selling_price == None, Product.selling_price <= 0),
+}
+
+# GET /suppliers/{id}
+SUPPLIER_PRODUCT_FIELDS = {
+    "id": Product.id,
+    "name": Product.name,
+    "alias": func.coalesce(Product.alias, ""),
+    "sku": func.coalesce(Product.sku, ""),
+    "upc": func.coalesce(Product.upc, ""),
+    "price": Product.price,
+    "selling_price": Product.selling_price,
+    "stock": Product.stock_quantity,
+}
+
+# GET /locations/{id}
+LOCATION_PRODUCT_FIELDS = {
+    "id": ProductLocation.id,
+    "product_id": Product.id,
+    "name": Product.name,
+    "sku": func.coalesce(Product.sku, ""),
+    "alias": func.coalesce(Product.alias, ""),
+    "image_url": func.coalesce(Product.image_url, ""),
+    "price": Product.price,
+    "selling_price": Product.selling_price,
+    "quantity": ProductLocation.quantity,
+}
+
+# GET /categories/{id}
+CATEGORY_PRODUCT_FIELDS = {
+    "id": ProductCategory.id,
+    "product_id": Product.id,
+    "name": Product.name,
+    "sku": func.coalesce(Product.sku, ""),
+    "upc": func.coalesce(Product.upc, ""),
+    "alias": func.coalesce(Product.alias, ""),
+    "image_url": func.coalesce(Product.image_url, ""),
+    "price": Product.price,
+    "selling_price": Product.selling_price,
+    "added_at": ProductCategory.added_at,
+}
+
+
+def columns(fields: Dict, keys: Optional[Iterable[str]] = None) -> List:
+    """Columnas etiquetadas con el nombre del campo de salida."""
+    return [fields[k].label(k) for k in (keys if keys is not None else fields)]
+
+
+def as_dicts(rows) -> List[dict]:
+    return [r._asdict() for r in rows]
+
+
+def parse_fields(raw: Optional[str], fields: Dict, extra: Iterable[str] = ()) -> List[str]:
+    """
+    Convierte `fields=id,name,selling_price` en los campos a devolver, en el
+    orden de la vista. Sin parámetro se devuelven todos.
+    """
+    allowed = list(fields) + list(extra)
+    requested = {f.strip() for f in (raw or "").split(",") if f.strip()}
+    if not requested:
+        return allowed
+    unknown = requested - set(allowed)
+    if unknown:
+        raise HTTPException(400, f"Campos no válidos: {', '.join(sorted(unknown))}")
+    return [f for f in allowed if f in requested]
@@ -0,0 +1,50 @@
+"""
+Orden de commit para el feed de sincronización de productos.
+
+`updated_at` se asigna al ejecutar la sentencia, no al hacer commit: una
+transacción larga (upload_invoice, update-prices, conciliación, cierre de
+un conteo) puede confirmar filas con fecha anterior a un cursor que un
+cliente ya pasó, y esas filas se perderían.
+
+Por eso un trigger guarda en `sync_xid` el id de la transacción que escribió
+cada fila de products y product_tombstones, y el feed solo entrega filas con
+`sync_xid` menor al horizonte del snapshot (`pg_snapshot_xmin`): toda
+transacción con id menor ya terminó, y las que siguen abiertas tienen id
+mayor o igual al horizonte, es decir, mayor que cualquier cursor entregado.
+Una fila que confirma tarde aparece siempre después del cursor. El costo es
+que una transacción abierta retiene en el feed lo escrito después de ella.
+"""
+from sqlalchemy import text
+
+SYNC_TABLES = ("products", "product_tombstones")
+
+
+async def setup_sync_xid(conn) -> None:
+    """Arranque: columna, índice y trigger en cada tabla del feed."""
+    await conn.execute(
+        text(
+            "CREATE OR REPLACE FUNCTION set_sync_xid() RETURNS trigger AS $$ "
+            "BEGIN NEW.sync_xid := pg_current_xact_id()::text::bigint; RETURN NEW; END "
+            "$$ LANGUAGE plpgsql"
+        )
+    )
+    for table in SYNC_TABLES:
+        await conn.execute(
+            text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS sync_xid BIGINT NOT NULL DEFAULT 0")
+        )
+        await conn.execute(
+            text(f"CREATE INDEX IF NOT EXISTS ix_{table}_sync_xid_id ON {table} (sync_xid, id)")
+        )
+        await conn.execute(text(f"DROP TRIGGER IF EXISTS trg_{table}_sync_xid ON {table}"))
+        await conn.execute(
+            text(
+                f"CREATE TRIGGER trg_{table}_sync_xid BEFORE INSERT OR UPDATE ON {table} "
+                "FOR EACH ROW EXECUTE FUNCTION set_sync_xid()"
+            )
+        )
+
+
+async def sync_horizon(db) -> int:
+    """Id de la transacción abierta más antigua: las menores ya terminaron."""
+    result = await db.execute(text("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint"))
+    return result.scalar()
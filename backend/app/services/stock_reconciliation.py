@@ -0,0 +1,116 @@
+"""
+Conciliación entre Product.stock_quantity y las cantidades por anaquel.
+
+El stock global lo mueven facturas, fusiones y reversas; product_locations
+lo mantiene el módulo de ubicaciones. Una sola consulta agregada compara
+cada producto contra la suma de sus anaqueles. Al aplicar, el stock global
+pasa a ser la suma de anaqueles (el conteo físico) y cada corrección queda en
+StockHistory como AJUSTE.
+
+Por defecto se ignoran los productos sin ningún anaquel asignado: todavía no
+se han acomodado y ponerlos en cero borraría su stock.
+"""
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.domain.models import Product, ProductLocation, StockHistory
+from app.services.stock_rollups import add_stock_history
+
+RECONCILIATION_SOURCE = "conciliacion"
+
+
+def discrepancies(include_unlocated: bool = False, product_ids: Optional[Iterable[int]] = None):
+    """Subconsulta: productos cuyo stock difiere de la suma de sus anaqueles."""
+    shelves = (
+        select(
+            ProductLocation.product_id,
+            func.coalesce(func.sum(ProductLocation.quantity), 0).label("shelf"),
+            func.count().label("locations"),
+        )
+        .group_by(ProductLocation.product_id)
+        .subquery("shelves")
+    )
+    stock = func.coalesce(Product.stock_quantity, 0)
+    shelf = func.coalesce(shelves.c.shelf, 0)
+    stmt = (
+        select(
+            Product.id.label("product_id"),
+            Product.name,
+            func.coalesce(Product.sku, "").label("sku"),
+            stock.label("stock"),
+            shelf.label("shelf"),
+            (shelf - stock).label("diff"),
+            func.coalesce(shelves.c.locations, 0).label("locations"),
+        )
+        .outerjoin(shelves, shelves.c.product_id == Product.id)
+        .where(stock != shelf)
+    )
+    if not include_unlocated:
+        stmt = stmt.where(shelves.c.product_id != None)
+    if product_ids is not None:
+        stmt = stmt.where(Product.id.in_(list(product_ids)))
+    return stmt.subquery("discrepancies")
+
+
+async def reconciliation_report(
+    db: AsyncSession, include_unlocated: bool = False, limit: int = 50, offset: int = 0
+) -> dict:
+    d = discrepancies(include_unlocated)
+    totals = (
+        await db.execute(
+            select(
+                func.count(),
+                func.coalesce(func.sum(func.greatest(d.c.diff, 0)), 0),
+                func.coalesce(func.sum(func.greatest(-d.c.diff, 0)), 0),
+            )
+        )
+    ).one()
+    rows = (
+        await db.execute(
+            select(d)
+            .order_by(func.abs(d.c.diff).desc(), d.c.product_id)
+            .limit(limit)
+            .offset(offset)
+        )
+    ).all()
+    return {
+        "total": totals[0],
+        "units_missing_in_stock": int(totals[1]),  # Hay más en anaqueles que en el stock
+        "units_missing_on_shelves": int(totals[2]),  # Hay más en el stock que en anaqueles
+        "items": [r._asdict() for r in rows],
+    }
+
+
+async def apply_reconciliation(
+    db: AsyncSession,
+    product_ids: Optional[Iterable[int]] = None,
+    include_unlocated: bool = False,
+) -> int:
+    """
+    Iguala el stock a la suma de anaqueles con un UPDATE ... FROM y registra
+    los AJUSTE en bloque. No hace commit.
+    """
+    d = discrepancies(include_unlocated, product_ids)
+    now = datetime.utcnow()
+    result = await db.execute(
+        update(Product)
+        .where(Product.id == d.c.product_id)
+        .values(stock_quantity=d.c.shelf, updated_at=now)
+        .returning(Product.id, d.c.stock, d.c.shelf)
+        .execution_options(synchronize_session=False)
+    )
+    entries = [
+        StockHistory(
+            product_id=pid,
+            change_type="AJUSTE",
+            old_value=old,
+            new_value=new,
+            source=RECONCILIATION_SOURCE,
+            date=now,
+        )
+        for pid, old, new in result.all()
+    ]
+    return await add_stock_history(db, entries)
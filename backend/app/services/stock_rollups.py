@@ -0,0 +1,112 @@
+"""
+Resumen diario de movimientos de stock por producto.
+
+Cada escritura de `StockHistory` pasa por `add_stock_history`, que además
+suma el movimiento a `stock_daily_rollups` con un upsert (ON CONFLICT DO
+UPDATE) en la misma transacción. Las tendencias leen solo esta tabla, sin
+recorrer el historial crudo. `rebuild_stock_rollups` recalcula el resumen
+desde el historial existente (relleno inicial o reparación).
+"""
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import Date, cast, delete, func, insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.domain.models import StockDailyRollup, StockHistory
+from app.services.price_updates import MAX_PARAMS_PER_STATEMENT
+
+# change_type -> columna con el neto de ese tipo
+TYPE_COLUMNS = {
+    "ENTRADA": "entrada",
+    "AJUSTE": "ajuste",
+    "MERGE": "merge",
+    "REVERSA": "reversa",
+}
+COUNTERS = ["qty_in", "qty_out", *TYPE_COLUMNS.values(), "movements"]
+
+
+async def add_stock_history(db, entries: List[StockHistory]) -> int:
+    """Agrega los movimientos a la sesión y actualiza el resumen diario."""
+    if not entries:
+        return 0
+    now = datetime.utcnow()
+    totals: Dict[Tuple[date, int], Dict[str, int]] = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    for e in entries:
+        e.date = e.date or now
+        diff = int(e.new_value or 0) - int(e.old_value or 0)
+        t = totals[(e.date.date(), e.product_id)]
+        t["qty_in"] += max(diff, 0)
+        t["qty_out"] += max(-diff, 0)
+        if e.change_type in TYPE_COLUMNS:
+            t[TYPE_COLUMNS[e.change_type]] += diff
+        t["movements"] += 1
+    db.add_all(entries)
+
+    rows = [{"day": d, "product_id": pid, **t} for (d, pid), t in totals.items()]
+    table = StockDailyRollup.__table__
+    size = MAX_PARAMS_PER_STATEMENT // (len(COUNTERS) + 2)
+    for start in range(0, len(rows), size):
+        stmt = pg_insert(table).values(rows[start:start + size])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["day", "product_id"],
+            set_={c: table.c[c] + stmt.excluded[c] for c in COUNTERS},
+        )
+        await db.execute(stmt)
+    return len(entries)
+
+
+def rollup_select(since: Optional[date] = None, until: Optional[date] = None):
+    """SELECT que agrega stock_history al formato del resumen diario."""
+    diff = func.coalesce(StockHistory.new_value, 0) - func.coalesce(StockHistory.old_value, 0)
+    day = cast(StockHistory.date, Date)
+    stmt = (
+        select(
+            day.label("day"),
+            StockHistory.product_id,
+            func.coalesce(func.sum(func.greatest(diff, 0)), 0),
+            func.coalesce(func.sum(func.greatest(-diff, 0)), 0),
+            *[
+                func.coalesce(func.sum(diff).filter(StockHistory.change_type == t), 0)
+                for t in TYPE_COLUMNS
+            ],
+            func.count(),
+        )
+        .where(StockHistory.product_id != None, StockHistory.date != None)
+        .group_by(day, StockHistory.product_id)
+    )
+    if since:
+        stmt = stmt.where(StockHistory.date >= datetime.combine(since, datetime.min.time()))
+    if until:
+        stmt = stmt.where(StockHistory.date < datetime.combine(until, datetime.min.time()))
+    return stmt
+
+
+async def rebuild_stock_rollups(
+    conn, since: Optional[date] = None, until: Optional[date] = None
+) -> int:
+    """
+    Recalcula el resumen en [since, until) (o completo). Sirve con sesión o
+    conexión. Ojo: los meses ya archivados por la retención no tienen
+    historial crudo; `since` no debe ser anterior a `archived_until`.
+    """
+    table = StockDailyRollup.__table__
+    stmt = delete(table)
+    if since:
+        stmt = stmt.where(table.c.day >= since)
+    if until:
+        stmt = stmt.where(table.c.day < until)
+    await conn.execute(stmt)
+    result = await conn.execute(
+        insert(table).from_select(["day", "product_id", *COUNTERS], rollup_select(since, until))
+    )
+    return result.rowcount or 0
+
+
+async def backfill_stock_rollups(conn) -> int:
+    """Relleno inicial: solo si el resumen está vacío y ya hay historial."""
+    table = StockDailyRollup.__table__
+    if (await conn.execute(select(table.c.day).limit(1))).first():
+        return 0
+    return await rebuild_stock_rollups(conn)
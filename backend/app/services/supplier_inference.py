@@ -0,0 +1,130 @@
+"""
+Inferencia del proveedor de productos sin asignar a partir de los lotes.
+
+Cada línea de lote es evidencia de que su producto viene del proveedor del
+lote:
+- lote con proveedor (import_batches.supplier_id): peso 1;
+- lote antiguo sin proveedor: se toma el proveedor de la mayoría de sus
+  productos ya asignados, con peso igual a esa proporción (0-1).
+
+Por producto, la confianza del mejor candidato es su peso entre el peso total
+de todos sus candidatos. Todo se calcula en una consulta; aplicar es un solo
+UPDATE ... FROM sobre los productos que siguen sin proveedor.
+"""
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import Float, cast, func, literal, or_, select, union_all, update
+
+from app.domain.models import ImportBatch, ImportBatchItem, Product, Supplier
+
+INFERENCE_MIN_CONFIDENCE = 0.6
+
+
+def unassigned():
+    return or_(Product.supplier_id == None, Product.supplier_id == 0)
+
+
+def supplier_candidates():
+    """Subconsulta: mejor proveedor por producto sin asignar, con su confianza."""
+    B, I, P = ImportBatch, ImportBatchItem, Product
+
+    # Lotes sin proveedor: proveedor mayoritario entre sus productos asignados
+    assigned = (
+        select(I.batch_id, P.supplier_id, func.count().label("n"))
+        .join(B, B.id == I.batch_id)
+        .join(P, P.id == I.product_id)
+        .where(B.supplier_id == None, P.supplier_id != None, P.supplier_id != 0)
+        .group_by(I.batch_id, P.supplier_id)
+        .subquery("assigned")
+    )
+    majority = (
+        select(
+            assigned.c.batch_id,
+            assigned.c.supplier_id,
+            (cast(assigned.c.n, Float) / func.sum(assigned.c.n).over(partition_by=assigned.c.batch_id)).label(
+                "share"
+            ),
+        )
+        .distinct(assigned.c.batch_id)
+        .order_by(assigned.c.batch_id, assigned.c.n.desc(), assigned.c.supplier_id)
+        .subquery("majority")
+    )
+
+    targets = select(P.id).where(unassigned())
+    evidence = union_all(
+        select(I.product_id, B.supplier_id, literal(1.0, Float).label("weight"), I.batch_id)
+        .join(B, B.id == I.batch_id)
+        .where(B.supplier_id != None, I.product_id.in_(targets)),
+        select(I.product_id, majority.c.supplier_id, majority.c.share, I.batch_id)
+        .join(majority, majority.c.batch_id == I.batch_id)
+        .where(I.product_id.in_(targets)),
+    ).subquery("evidence")
+
+    scores = (
+        select(
+            evidence.c.product_id,
+            evidence.c.supplier_id,
+            func.sum(evidence.c.weight).label("weight"),
+            func.count(func.distinct(evidence.c.batch_id)).label("batches"),
+        )
+        .group_by(evidence.c.product_id, evidence.c.supplier_id)
+        .subquery("scores")
+    )
+    by_product = {"partition_by": scores.c.product_id}
+    ranked = select(
+        scores.c.product_id,
+        scores.c.supplier_id,
+        scores.c.weight,
+        scores.c.batches,
+        (scores.c.weight / func.sum(scores.c.weight).over(**by_product)).label("confidence"),
+        func.count().over(**by_product).label("candidates"),
+        func.row_number()
+        .over(order_by=(scores.c.weight.desc(), scores.c.supplier_id), **by_product)
+        .label("rank"),
+    ).subquery("ranked")
+    return (
+        select(ranked)
+        .where(ranked.c.rank == 1)
+        .subquery("candidates")
+    )
+
+
+def candidate_filter(c, min_confidence: float, product_ids: Optional[Iterable[int]] = None) -> list:
+    filters = [c.c.confidence >= min_confidence]
+    if product_ids is not None:
+        filters.append(c.c.product_id.in_(list(product_ids)))
+    return filters
+
+
+def preview_statement(min_confidence: float):
+    c = supplier_candidates()
+    return (
+        select(
+            c.c.product_id,
+            Product.name,
+            func.coalesce(Product.sku, "").label("sku"),
+            c.c.supplier_id,
+            Supplier.name.label("supplier_name"),
+            c.c.confidence,
+            c.c.batches,
+            c.c.candidates,
+        )
+        .join(Product, Product.id == c.c.product_id)
+        .join(Supplier, Supplier.id == c.c.supplier_id)
+        .where(*candidate_filter(c, min_confidence))
+    )
+
+
+async def apply_inferred_suppliers(
+    db, min_confidence: float = INFERENCE_MIN_CONFIDENCE, product_ids: Optional[Iterable[int]] = None
+) -> int:
+    """Asigna el mejor candidato con un solo UPDATE ... FROM. No hace commit."""
+    c = supplier_candidates()
+    result = await db.execute(
+        update(Product)
+        .where(Product.id == c.c.product_id, unassigned(), *candidate_filter(c, min_confidence, product_ids))
+        .values(supplier_id=c.c.supplier_id, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount or 0
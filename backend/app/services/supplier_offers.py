@@ -0,0 +1,57 @@
+"""
+Índice de ofertas por proveedor.
+
+`upload_invoice` registra en `supplier_offers` el costo unitario de cada
+producto facturado junto con el proveedor y el lote. El último costo de cada
+(producto, proveedor) sale de un DISTINCT ON sobre el índice
+(product_id, supplier_id, date); el proveedor más barato es el menor de esos
+últimos costos. Solo cuentan ofertas de los últimos
+SUPPLIER_OFFER_MAX_AGE_DAYS días.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.domain.models import SupplierOffer
+
+OFFER_MAX_AGE_DAYS = int(os.environ.get("SUPPLIER_OFFER_MAX_AGE_DAYS", "365"))
+
+
+def latest_offers(product_ids: Optional[Iterable[int]] = None, max_age_days: int = OFFER_MAX_AGE_DAYS):
+    """Último costo de cada proveedor por producto."""
+    O = SupplierOffer
+    stmt = (
+        select(O.product_id, O.supplier_id, O.unit_cost, O.date)
+        .distinct(O.product_id, O.supplier_id)
+        .order_by(O.product_id, O.supplier_id, O.date.desc(), O.id.desc())
+    )
+    if max_age_days:
+        stmt = stmt.where(O.date >= datetime.utcnow() - timedelta(days=max_age_days))
+    if product_ids is not None:
+        stmt = stmt.where(O.product_id.in_(list(product_ids)))
+    return stmt.subquery("latest")
+
+
+def cheapest_offers(product_ids: Optional[Iterable[int]] = None, max_age_days: int = OFFER_MAX_AGE_DAYS):
+    """Proveedor con el menor último costo por producto (y cuántos lo ofrecen)."""
+    latest = latest_offers(product_ids, max_age_days)
+    return (
+        select(
+            latest.c.product_id,
+            latest.c.supplier_id,
+            latest.c.unit_cost,
+            latest.c.date,
+            func.count().over(partition_by=latest.c.product_id).label("supplier_count"),
+        )
+        .distinct(latest.c.product_id)
+        .order_by(latest.c.product_id, latest.c.unit_cost.asc(), latest.c.date.desc())
+        .subquery("cheapest")
+    )
+
+
+async def cheapest_supplier_id(db: AsyncSession, product_id: int) -> Optional[int]:
+    cheapest = cheapest_offers([product_id])
+    return (await db.execute(select(cheapest.c.supplier_id))).scalar()
@@ -0,0 +1,122 @@
+"""
+Gasto mensual por proveedor.
+
+`upload_invoice` guarda en cada lote su proveedor y en cada línea el costo
+unitario; `supplier_monthly_spend` resume por (mes, proveedor) el número de
+lotes, líneas, piezas, gasto y el cambio de costo contra la compra anterior
+del mismo producto al mismo proveedor. Subir o borrar un lote recalcula los
+renglones de su proveedor desde el mes del lote en adelante (el cambio de
+costo de los meses siguientes depende de esa compra); la analítica lee
+únicamente el resumen.
+
+Cada recálculo borra y vuelve a insertar, así que se serializa con un lock
+de transacción: dos lotes del mismo proveedor no se cruzan, y el recálculo
+completo excluye a todos los demás.
+"""
+from datetime import date
+from typing import Optional
+
+from sqlalchemy import Date, cast, delete, distinct, func, insert, select, text
+
+from app.domain.models import ImportBatch, ImportBatchItem, SupplierMonthlySpend
+
+SPEND_LOCK_KEY = 72_410_049  # pg advisory lock (espacio, proveedor)
+
+SPEND_COLUMNS = [
+    "month", "supplier_id", "batches", "lines", "units", "spend",
+    "cost_change_lines", "cost_change_sum",
+]
+
+
+def spend_select(supplier_id: Optional[int] = None, since: Optional[date] = None):
+    """SELECT que agrega las líneas de lote al formato del resumen mensual."""
+    B, I = ImportBatch, ImportBatchItem
+    lines = (
+        select(
+            cast(func.date_trunc("month", B.created_at), Date).label("month"),
+            B.supplier_id,
+            I.batch_id,
+            func.coalesce(I.quantity, 0).label("quantity"),
+            I.unit_cost,
+            func.lag(I.unit_cost)
+            .over(partition_by=(B.supplier_id, I.product_id), order_by=(B.created_at, B.id))
+            .label("prev_cost"),
+        )
+        .join(B, B.id == I.batch_id)
+        .where(B.supplier_id != None, I.unit_cost != None)
+    )
+    # El filtro por proveedor va dentro (la ventana solo mira ese proveedor);
+    # el de meses va fuera para que LAG vea las compras de meses anteriores
+    if supplier_id is not None:
+        lines = lines.where(B.supplier_id == supplier_id)
+    lines = lines.subquery("lines")
+
+    changed = lines.c.prev_cost > 0
+    stmt = (
+        select(
+            lines.c.month,
+            lines.c.supplier_id,
+            func.count(distinct(lines.c.batch_id)),
+            func.count(),
+            func.sum(lines.c.quantity),
+            func.sum(lines.c.quantity * lines.c.unit_cost),
+            func.count().filter(changed),
+            func.coalesce(
+                func.sum((lines.c.unit_cost - lines.c.prev_cost) / lines.c.prev_cost).filter(changed), 0
+            ),
+        )
+        .group_by(lines.c.month, lines.c.supplier_id)
+    )
+    if since is not None:
+        stmt = stmt.where(lines.c.month >= since)
+    return stmt
+
+
+async def refresh_supplier_spend(
+    conn, supplier_id: Optional[int] = None, since: Optional[date] = None
+) -> int:
+    """Recalcula el resumen (todo, un proveedor o un proveedor desde el mes `since`)."""
+    if supplier_id is None:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:key, 0)"), {"key": SPEND_LOCK_KEY})
+    else:
+        await conn.execute(text("SELECT pg_advisory_xact_lock_shared(:key, 0)"), {"key": SPEND_LOCK_KEY})
+        await conn.execute(
+            text("SELECT pg_advisory_xact_lock(:key, :supplier_id)"),
+            {"key": SPEND_LOCK_KEY, "supplier_id": supplier_id},
+        )
+    table = SupplierMonthlySpend.__table__
+    stmt = delete(table)
+    if supplier_id is not None:
+        stmt = stmt.where(table.c.supplier_id == supplier_id)
+    if since is not None:
+        stmt = stmt.where(table.c.month >= since)
+    await conn.execute(stmt)
+    result = await conn.execute(
+        insert(table).from_select(SPEND_COLUMNS, spend_select(supplier_id, since))
+    )
+    return result.rowcount or 0
+
+
+async def backfill_supplier_spend(conn) -> int:
+    """
+    Arranque: completa proveedor y costo de lotes anteriores desde el
+    índice de ofertas y arma el resumen si está vacío.
+    """
+    await conn.execute(
+        text(
+            "UPDATE import_batch_items i SET unit_cost = o.unit_cost FROM supplier_offers o "
+            "WHERE i.unit_cost IS NULL AND o.batch_id = i.batch_id AND o.product_id = i.product_id"
+        )
+    )
+    await conn.execute(
+        text(
+            "UPDATE import_batches b SET supplier_id = o.supplier_id "
+            "FROM (SELECT DISTINCT ON (batch_id) batch_id, supplier_id FROM supplier_offers "
+            "WHERE batch_id IS NOT NULL ORDER BY batch_id, id) o "
+            "WHERE b.supplier_id IS NULL AND o.batch_id = b.id"
+        )
+    )
+    table = SupplierMonthlySpend.__table__
+    if (await conn.execute(select(table.c.month).limit(1))).first():
+        return 0
+    return await refresh_supplier_spend(conn)
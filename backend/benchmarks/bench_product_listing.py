@@ -0,0 +1,150 @@
+"""
+Benchmark del listado de productos: entidades ORM + jsonable_encoder contra
+columnas proyectadas + orjson, en páginas de 500 filas.
+
+Usa SQLite en memoria para aislar el costo de Python (hidratación y
+serialización) del de la base de datos. Ejecutar desde backend/:
+
+    python benchmarks/bench_product_listing.py
+"""
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app.core.config exige estas variables aunque aquí no se conecte a Postgres
+os.environ.setdefault("DATABASE_URL", "postgresql+asyncpg://bench@localhost/bench")
+os.environ.setdefault("PROJECT_NAME", "bench")
+os.environ.setdefault("SECRET_KEY", "bench")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from sqlalchemy import create_engine, select  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from app.core.database import Base  # noqa: E402
+from app.core.serialization import dumps  # noqa: E402
+from app.domain.models import Product, Supplier  # noqa: E402
+from app.services.product_queries import PRODUCT_LIST_FIELDS, as_dicts, columns  # noqa: E402
+
+PAGE_SIZE = 500
+ROUNDS = 200
+
+
+def seed(engine):
+    Base.metadata.create_all(engine, tables=[Supplier.__table__, Product.__table__])
+    with Session(engine) as session:
+        suppliers = [Supplier(name=f"Proveedor {i}") for i in range(20)]
+        session.add_all(suppliers)
+        session.flush()
+        session.add_all(
+            Product(
+                sku=f"SKU{i:06d}",
+                upc=f"75{i:011d}" if i % 3 else None,
+                name=f"Producto de prueba número {i}",
+                alias=f"Alias {i}" if i % 2 else None,
+                price=10.0 + i % 97,
+                selling_price=15.0 + i % 89,
+                stock_quantity=i % 40,
+                supplier_id=suppliers[i % 20].id if i % 5 else None,
+            )
+            for i in range(PAGE_SIZE * 4)
+        )
+        session.commit()
+
+
+def orm_page(session):
+    """Ruta anterior: entidades completas, dicts a mano y jsonable_encoder."""
+    stmt = (
+        select(Product, Supplier.name.label("supplier_name"))
+        .outerjoin(Supplier, Product.supplier_id == Supplier.id)
+        .order_by(Product.id)
+        .limit(PAGE_SIZE)
+    )
+    items = [
+        {
+            "id": p.id,
+            "sku": p.sku,
+            "upc": p.upc or "",
+            "name": p.name,
+            "alias": p.alias or "",
+            "price": p.price,
+            "selling_price": p.selling_price,
+            "stock": p.stock_quantity,
+            "supplier_id": p.supplier_id,
+            "supplier_name": supplier_name or "",
+            "is_delicate": p.is_delicate or False,
+        }
+        for p, supplier_name in session.execute(stmt).all()
+    ]
+    # Lo mismo que hace JSONResponse de FastAPI
+    return json.dumps(
+        jsonable_encoder({"items": items}),
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def projected_page(session):
+    """Ruta nueva: columnas proyectadas a dicts y orjson."""
+    stmt = (
+        select(*columns(PRODUCT_LIST_FIELDS))
+        .select_from(Product)
+        .outerjoin(Supplier, Product.supplier_id == Supplier.id)
+        .order_by(Product.id)
+        .limit(PAGE_SIZE)
+    )
+    return dumps({"items": as_dicts(session.execute(stmt).all())})
+
+
+def measure(engine, fn):
+    # Calentamiento (compilación de sentencias en caché, imports perezosos)
+    with Session(engine) as session:
+        fn(session)
+
+    start = time.process_time()
+    for _ in range(ROUNDS):
+        with Session(engine) as session:
+            fn(session)
+    cpu_ms = (time.process_time() - start) * 1000 / ROUNDS
+
+    tracemalloc.start()
+    with Session(engine) as session:
+        before = tracemalloc.take_snapshot()
+        fn(session)
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    allocated = sum(s.size_diff for s in after.compare_to(before, "filename") if s.size_diff > 0)
+    return cpu_ms, allocated / 1024, peak / 1024
+
+
+def main():
+    engine = create_engine("sqlite://")
+    seed(engine)
+
+    with Session(engine) as session:
+        a = json.loads(orm_page(session))
+        b = json.loads(projected_page(session))
+    assert a == b, "Las dos rutas deben producir el mismo JSON"
+
+    results = {
+        "orm + jsonable_encoder": measure(engine, orm_page),
+        "proyección + orjson": measure(engine, projected_page),
+    }
+    print(f"Página de {PAGE_SIZE} filas, promedio de {ROUNDS} peticiones")
+    print(f"{'ruta':<26}{'CPU ms/pet':>12}{'KiB retenidos':>16}{'KiB pico':>12}")
+    for name, (cpu_ms, kept_kib, peak_kib) in results.items():
+        print(f"{name:<26}{cpu_ms:>12.2f}{kept_kib:>16.1f}{peak_kib:>12.1f}")
+    base, new = results["orm + jsonable_encoder"], results["proyección + orjson"]
+    print(f"Ahorro de CPU: {100 * (1 - new[0] / base[0]):.0f}%  |  "
+          f"pico de memoria: {100 * (1 - new[2] / base[2]):.0f}%")
+
+
+if __name__ == "__main__":
+    main()
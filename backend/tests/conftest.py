@@ -0,0 +1,113 @@
+"""
+Pruebas de integración contra Postgres.
+
+Crean tablas y escriben datos, así que usan una base desechable indicada en
+TEST_DATABASE_URL (nunca DATABASE_URL); sin ella se omiten. Ejecutar desde
+backend/:
+
+    TEST_DATABASE_URL=postgresql://postgres@localhost/radar_test python -m pytest -q tests
+"""
+import os
+import sys
+import uuid
+from contextlib import contextmanager
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+# app.core.config exige estas variables aunque las pruebas se omitan
+os.environ["DATABASE_URL"] = TEST_DATABASE_URL or "postgresql+asyncpg://test@localhost/test"
+os.environ.setdefault("PROJECT_NAME", "test")
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
+
+import httpx  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+from app.core.database import engine  # noqa: E402
+
+engine.echo = False
+
+
+def pytest_collection_modifyitems(config, items):
+    if TEST_DATABASE_URL:
+        return
+    skip = pytest.mark.skip(reason="TEST_DATABASE_URL no está definida")
+    for item in items:
+        item.add_marker(skip)
+
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+async def client():
+    """Cliente HTTP contra la app; el arranque crea y migra las tablas."""
+    from app import main
+
+    await main.startup_event()
+    # Las tareas periódicas no corren durante las pruebas
+    for task in main._background_tasks:
+        task.cancel()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as c:
+        yield c
+    await engine.dispose()
+
+
+@pytest.fixture
+async def db(client):
+    from app.main import AsyncSessionLocal
+
+    async with AsyncSessionLocal() as session:
+        yield session
+
+
+def unique(prefix: str) -> str:
+    return f"{prefix}-{uuid.uuid4().hex[:10]}"
+
+
+@contextmanager
+def count_statements():
+    """Cuenta las sentencias SQL enviadas a la base dentro del bloque."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+
+async def create_product(client, **fields) -> int:
+    payload = {"name": unique("prod"), "price": 10, "selling_price": 15, "stock": 0, **fields}
+    r = await client.post("/invoices/products/manual", json=payload)
+    assert r.status_code == 200, r.text
+    return r.json()["id"]
+
+
+async def create_supplier(client, **fields) -> int:
+    r = await client.post("/suppliers", json={"name": unique("prov"), **fields})
+    assert r.status_code == 200, r.text
+    return r.json()["id"]
+
+
+async def create_category(client, **fields) -> int:
+    r = await client.post("/categories", json={"name": unique("cat"), **fields})
+    assert r.status_code == 200, r.text
+    return r.json()["id"]
+
+
+async def create_location(client, **fields) -> int:
+    code = uuid.uuid4().hex[:12].upper()
+    r = await client.post("/locations", json={"code": code, **fields})
+    assert r.status_code == 200, r.text
+    return r.json()["id"]
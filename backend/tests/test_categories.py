@@ -0,0 +1,37 @@
+import pytest
+
+from conftest import count_statements, create_category, create_location, create_product
+
+pytestmark = pytest.mark.anyio
+
+
+async def detail(client, category_id: int):
+    with count_statements() as statements:
+        r = await client.get(f"/categories/{category_id}")
+    assert r.status_code == 200, r.text
+    return r.json(), len(statements)
+
+
+async def test_category_detail_statement_count_is_constant(client):
+    locations = [await create_location(client) for _ in range(3)]
+    small, large, shared = [await create_category(client) for _ in range(3)]
+    products = [await create_product(client) for _ in range(8)]
+    for product_id in products:
+        for location_id in locations:
+            r = await client.post(f"/locations/{location_id}/products", json={"product_id": product_id, "quantity": 1})
+            assert r.status_code == 200, r.text
+
+    # Los productos también pertenecen a otra categoría: no deben duplicarse
+    for category_id, ids in ((small, products[:1]), (large, products), (shared, products)):
+        r = await client.post(f"/categories/{category_id}/products", json={"product_ids": ids})
+        assert r.status_code == 200, r.text
+
+    body, few = await detail(client, small)
+    assert body["product_count"] == 1
+    body, many = await detail(client, large)
+    assert body["product_count"] == 8
+    assert sorted(p["product_id"] for p in body["products"]) == sorted(products)
+    assert all(len(p["locations"]) == 3 for p in body["products"])
+
+    # Categoría + conteo, y productos con sus ubicaciones: sin N+1
+    assert few == many == 2
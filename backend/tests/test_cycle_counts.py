@@ -0,0 +1,119 @@
+import pytest
+from sqlalchemy import func, select
+
+from app.domain.models import CycleCountEntry, Product, StockHistory
+from app.services.cycle_counts import cycle_count_source
+from conftest import create_location, create_product, unique
+
+pytestmark = pytest.mark.anyio
+
+
+async def open_count(client, *location_ids) -> int:
+    r = await client.post("/cycle-counts", json={"location_ids": list(location_ids)})
+    assert r.status_code == 200, r.text
+    return r.json()["id"]
+
+
+async def send(client, count_id, *entries, mode="set", batch_id=None) -> dict:
+    payload = {"batch_id": batch_id or unique("lote"), "mode": mode, "entries": list(entries)}
+    r = await client.post(f"/cycle-counts/{count_id}/batches", json=payload)
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+async def test_delete_location_used_by_a_count(client, db):
+    location_id = await create_location(client)
+    product_id = await create_product(client)
+    count_id = await open_count(client, location_id)
+    # Contado en cero: al cerrar el anaquel queda sin productos
+    await send(client, count_id, {"location_id": location_id, "product_id": product_id, "quantity": 0})
+
+    r = await client.delete(f"/locations/{location_id}")
+    assert r.status_code == 400, r.text
+
+    r = await client.post(f"/cycle-counts/{count_id}/close")
+    assert r.status_code == 200, r.text
+    r = await client.delete(f"/locations/{location_id}")
+    assert r.status_code == 200, r.text
+
+    entries = await db.execute(select(func.count()).where(CycleCountEntry.location_id == location_id))
+    assert entries.scalar() == 0
+
+
+async def counted(db, count_id, product_id) -> int:
+    return (
+        await db.execute(
+            select(CycleCountEntry.counted).where(
+                CycleCountEntry.cycle_count_id == count_id, CycleCountEntry.product_id == product_id
+            )
+        )
+    ).scalar()
+
+
+async def test_duplicate_batch_is_not_reapplied(client, db):
+    location_id = await create_location(client)
+    product_id = await create_product(client)
+    count_id = await open_count(client, location_id)
+    line = {"location_id": location_id, "product_id": product_id, "quantity": 2}
+
+    first = await send(client, count_id, line, line, mode="add", batch_id="lote-1")
+    assert (first["duplicate"], first["accepted"]) == (False, 1)
+    again = await send(client, count_id, line, mode="add", batch_id="lote-1")
+    assert (again["duplicate"], again["accepted"]) == (True, 0)
+    assert await counted(db, count_id, product_id) == 4
+
+
+async def test_add_accumulates_and_set_overwrites(client, db):
+    location_id = await create_location(client)
+    product_id = await create_product(client)
+    count_id = await open_count(client, location_id)
+    line = {"location_id": location_id, "product_id": product_id}
+
+    await send(client, count_id, {**line, "quantity": 3}, {**line, "quantity": 4}, mode="set")
+    assert await counted(db, count_id, product_id) == 4
+    await send(client, count_id, {**line, "quantity": 2}, mode="add")
+    assert await counted(db, count_id, product_id) == 6
+    await send(client, count_id, {**line, "quantity": 1}, mode="set")
+    assert await counted(db, count_id, product_id) == 1
+
+
+async def stock_state(client, db, product_id) -> tuple:
+    stock = (await db.execute(select(Product.stock_quantity).where(Product.id == product_id))).scalar()
+    r = await client.get(f"/locations/product/{product_id}/locations")
+    return stock, {row["location_id"]: row["quantity"] for row in r.json()}
+
+
+async def place(client, location_id, product_id, quantity):
+    r = await client.post(f"/locations/{location_id}/products", json={"product_id": product_id, "quantity": quantity})
+    assert r.status_code == 200, r.text
+
+
+@pytest.mark.parametrize("zero_missing", [True, False])
+async def test_close_applies_variances(client, db, zero_missing):
+    location_id = await create_location(client)
+    short = await create_product(client, stock=5)
+    missing = await create_product(client, stock=2)
+    await place(client, location_id, short, 5)
+    await place(client, location_id, missing, 2)
+    count_id = await open_count(client, location_id)
+    await send(client, count_id, {"location_id": location_id, "product_id": short, "quantity": 3})
+
+    r = await client.post(f"/cycle-counts/{count_id}/close", params={"zero_missing": zero_missing})
+    assert r.status_code == 200, r.text
+    assert r.json()["status"] == "closed"
+
+    assert await stock_state(client, db, short) == (3, {location_id: 3})
+    history = await db.execute(
+        select(StockHistory.change_type, StockHistory.old_value, StockHistory.new_value).where(
+            StockHistory.product_id == short, StockHistory.source == cycle_count_source(count_id)
+        )
+    )
+    assert [tuple(row) for row in history.all()] == [("AJUSTE", 5, 3)]
+
+    # Lo que nadie contó queda en cero solo con zero_missing
+    if zero_missing:
+        assert await stock_state(client, db, missing) == (0, {})
+        assert r.json()["units_short"] == 4
+    else:
+        assert await stock_state(client, db, missing) == (2, {location_id: 2})
+        assert r.json()["units_short"] == 2
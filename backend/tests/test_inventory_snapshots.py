@@ -0,0 +1,47 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select, update
+
+from app.domain.models import InventorySnapshot, Product, StockHistory
+from app.services.inventory_snapshots import valuation_rows
+from app.services.stock_rollups import add_stock_history
+from conftest import create_product
+
+pytestmark = pytest.mark.anyio
+
+
+async def stock_at(db, at, snapshot, ids) -> dict:
+    v = valuation_rows(at, snapshot)
+    rows = (await db.execute(select(v.c.product_id, v.c.stock).where(v.c.product_id.in_(ids)))).all()
+    return dict(rows)
+
+
+async def test_merged_product_is_not_counted_twice(client, db):
+    keep_id = await create_product(client)
+    discard_id = await create_product(client)
+    await db.execute(update(Product).where(Product.id.in_([keep_id, discard_id])).values(stock_quantity=5))
+    await db.commit()
+
+    r = await client.post("/inventory/reports/snapshots", params={"full": "true"})
+    assert r.status_code == 200, r.text
+    snapshot = await db.get(InventorySnapshot, r.json()["id"])
+    r = await client.post("/invoices/merge", json={"keep_id": keep_id, "discard_id": discard_id})
+    assert r.status_code == 200, r.text
+
+    assert await stock_at(db, datetime.utcnow(), snapshot, [keep_id, discard_id]) == {keep_id: 10}
+
+
+async def test_product_without_creation_date_needs_history(client, db):
+    product_id = await create_product(client)
+    await db.execute(update(Product).where(Product.id == product_id).values(created_at=None))
+    await db.commit()
+    assert await stock_at(db, datetime.utcnow(), None, [product_id]) == {}
+
+    await add_stock_history(db, [StockHistory(
+        product_id=product_id, change_type="AJUSTE", old_value=0, new_value=2, source="prueba",
+    )])
+    await db.execute(update(Product).where(Product.id == product_id).values(stock_quantity=2))
+    await db.commit()
+    assert await stock_at(db, datetime(2000, 1, 1), None, [product_id]) == {}
+    assert await stock_at(db, datetime.utcnow(), None, [product_id]) == {product_id: 2}
@@ -0,0 +1,20 @@
+from sqlalchemy.exc import OperationalError
+from starlette.testclient import TestClient
+
+from app.api.endpoints import locations
+from app.main import app
+
+
+def test_scan_socket_closes_on_database_error(monkeypatch):
+    async def failing_apply_scans(db, scans, location_code):
+        raise OperationalError("SELECT 1", {}, ConnectionResetError("conexión perdida"))
+
+    monkeypatch.setattr(locations, "apply_scans", failing_apply_scans)
+    # Sin el bloque `with` no corre el arranque: la prueba no toca la base
+    client = TestClient(app)
+    with client.websocket_connect("/locations/scan/ws?location_code=A1") as ws:
+        ws.send_text("750100000001")
+        assert ws.receive_json() == {"error": "Error de base de datos; reenvía el lote", "location_code": "A1"}
+        message = ws.receive()
+        assert message["type"] == "websocket.close"
+        assert message["code"] == 1011
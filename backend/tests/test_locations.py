@@ -0,0 +1,99 @@
+import pytest
+
+from conftest import count_statements, create_location, create_product, unique
+
+pytestmark = pytest.mark.anyio
+
+
+async def seed(client, tag: str, products: int, locations: list) -> list:
+    ids = []
+    for i in range(products):
+        product_id = await create_product(client, name=f"{tag}-{i}")
+        for location_id in locations:
+            r = await client.post(f"/locations/{location_id}/products", json={"product_id": product_id, "quantity": 2})
+            assert r.status_code == 200, r.text
+        ids.append(product_id)
+    return ids
+
+
+async def search(client, tag: str, location_id: int):
+    params = {"q": tag, "location_id": location_id, "with_locations": "true"}
+    with count_statements() as statements:
+        r = await client.get("/locations/search-products", params=params)
+    assert r.status_code == 200, r.text
+    return r.json(), len(statements)
+
+
+async def test_search_products_statement_count_is_constant(client):
+    locations = [await create_location(client) for _ in range(3)]
+    small, large = unique("pocos"), unique("muchos")
+    await seed(client, small, 1, locations)
+    await seed(client, large, 8, locations)
+
+    items, few = await search(client, small, locations[0])
+    assert len(items) == 1
+    items, many = await search(client, large, locations[0])
+    assert len(items) == 8
+    assert all(item["already_in_location"] and len(item["locations"]) == 3 for item in items)
+
+    # Productos + ubicaciones de todos ellos, sin una consulta por producto
+    assert few == many == 2
+
+
+async def place(client, location_id: int, product_id: int, quantity: int):
+    r = await client.post(f"/locations/{location_id}/products", json={"product_id": product_id, "quantity": quantity})
+    assert r.status_code == 200, r.text
+
+
+async def placements(client, product_id: int) -> dict:
+    r = await client.get(f"/locations/product/{product_id}/locations")
+    assert r.status_code == 200, r.text
+    return {row["location_id"]: row["quantity"] for row in r.json()}
+
+
+async def batch(client, *operations):
+    return await client.post("/locations/batch", json={"operations": list(operations)})
+
+
+async def test_batch_is_all_or_nothing(client):
+    a, b = await create_location(client), await create_location(client)
+    product_id = await create_product(client)
+    await place(client, a, product_id, 5)
+
+    r = await batch(
+        client,
+        {"op": "set", "product_id": product_id, "location_id": b, "quantity": 9},
+        {"op": "move", "product_id": product_id, "location_id": b, "to_location_id": b},
+        {"op": "set", "product_id": 999999999, "location_id": a, "quantity": 1},
+    )
+    assert r.status_code == 400, r.text
+    assert "#2" in r.json()["detail"] and "#3" in r.json()["detail"]
+    assert await placements(client, product_id) == {a: 5}
+
+
+async def test_batch_move_into_existing_pair(client):
+    a, b = await create_location(client), await create_location(client)
+    product_id = await create_product(client)
+    await place(client, a, product_id, 5)
+    await place(client, b, product_id, 2)
+
+    r = await batch(client, {"op": "move", "product_id": product_id, "location_id": a, "to_location_id": b})
+    assert r.status_code == 200, r.text
+    assert r.json()["removed"] == 1
+    assert await placements(client, product_id) == {b: 7}
+
+
+async def test_batch_transfer_checks_running_quantity(client):
+    a, b = await create_location(client), await create_location(client)
+    product_id = await create_product(client)
+    await place(client, a, product_id, 5)
+
+    transfer = {"op": "transfer", "product_id": product_id, "location_id": a, "to_location_id": b, "quantity": 3}
+    r = await batch(client, transfer, transfer)
+    assert r.status_code == 400, r.text
+    assert "#2: solo hay 2" in r.json()["detail"]
+    assert await placements(client, product_id) == {a: 5}
+
+    r = await batch(client, transfer, {**transfer, "quantity": 2})
+    assert r.status_code == 200, r.text
+    assert await placements(client, product_id) == {a: 0, b: 5}
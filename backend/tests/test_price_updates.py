@@ -0,0 +1,27 @@
+import pytest
+from sqlalchemy import Float, String, select
+
+from app.domain.models import Product
+from app.services.price_updates import bulk_update_products
+from conftest import create_product
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_bulk_update_with_all_null_column(client, db):
+    ids = [await create_product(client), await create_product(client)]
+
+    rows = [{"id": i, "selling_price": None, "alias": None} for i in ids]
+    assert await bulk_update_products(db, rows, {"selling_price": Float(), "alias": String()}) == 2
+    await db.commit()
+
+    prices = (await db.execute(select(Product.selling_price).where(Product.id.in_(ids)))).scalars().all()
+    assert prices == [None, None]
+
+
+async def test_update_prices_clearing_every_alias(client):
+    ids = [await create_product(client, alias="viejo") for _ in range(2)]
+
+    r = await client.post("/invoices/update-prices", json=[{"id": i, "alias": ""} for i in ids])
+    assert r.status_code == 200, r.text
+    assert r.json()["updated"] == 2
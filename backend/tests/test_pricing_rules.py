@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from app.domain.models import PricingRule, Product
+from app.services.pricing_rules import rule_prices
+from conftest import create_category, create_product, create_supplier, unique
+
+pytestmark = pytest.mark.anyio
+
+
+async def create_rule(client, **scope) -> int:
+    r = await client.post("/pricing-rules", json={"name": unique("regla"), "value": 30, **scope})
+    assert r.status_code == 200, r.text
+    return r.json()["id"]
+
+
+async def rule_ids(client) -> set:
+    r = await client.get("/pricing-rules")
+    return {rule["id"] for rule in r.json()}
+
+
+async def test_delete_category_with_rule(client):
+    category_id = await create_category(client)
+    rule_id = await create_rule(client, category_id=category_id)
+
+    r = await client.delete(f"/categories/{category_id}")
+    assert r.status_code == 200, r.text
+    assert rule_id not in await rule_ids(client)
+
+
+async def test_delete_supplier_with_rule(client):
+    supplier_id = await create_supplier(client)
+    rule_id = await create_rule(client, supplier_id=supplier_id)
+    other_id = await create_rule(client)
+
+    r = await client.delete(f"/suppliers/{supplier_id}")
+    assert r.status_code == 200, r.text
+    remaining = await rule_ids(client)
+    assert rule_id not in remaining
+    assert other_id in remaining
+
+
+def make_rule(**fields) -> PricingRule:
+    return PricingRule(**{"mode": "markup", "value": 30, "rounding_step": None, "price_ending": None, **fields})
+
+
+@pytest.mark.parametrize(
+    "fields, cost, expected",
+    [
+        ({}, 10.0, 13.0),
+        ({"mode": "margin", "value": 20}, 10.0, 12.5),
+        ({"rounding_step": 0.5}, 10.1, 13.5),
+        ({"price_ending": 0.9}, 10.0, 13.9),
+        ({"mode": "margin", "value": 20, "price_ending": 0.9}, 10.0, 12.9),
+        ({"price_ending": 9.9, "rounding_step": 10}, 10.0, 19.9),
+        ({"value": 0, "price_ending": 0.9}, 12.9, 12.9),
+    ],
+)
+def test_rule_prices(fields, cost, expected):
+    assert rule_prices(make_rule(**fields), np.array([cost]))[0] == pytest.approx(expected)
+
+
+async def preview(client, **request) -> dict:
+    r = await client.post("/pricing-rules/preview", json=request)
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+async def test_first_rule_by_priority_wins(client):
+    supplier_id = await create_supplier(client)
+    product_id = await create_product(client, price=10, selling_price=1, supplier_id=supplier_id)
+    late = await create_rule(client, value=50, priority=20)
+    early = await create_rule(client, value=10, priority=10, supplier_id=supplier_id)
+    unmatched = await create_rule(client, value=80, priority=5, min_cost=100)
+
+    body = await preview(client, rule_ids=[late, early, unmatched], product_ids=[product_id])
+    assert body["items"] == [
+        {"id": product_id, "name": body["items"][0]["name"], "cost": 10.0, "old_price": 1.0, "new_price": 11.0, "rule_id": early}
+    ]
+
+
+async def test_empty_product_ids_reprice_nothing(client, db):
+    product_id = await create_product(client, price=10, selling_price=1)
+    rule_id = await create_rule(client)
+
+    body = await preview(client, rule_ids=[rule_id], product_ids=[])
+    assert body["evaluated"] == 0
+
+    r = await client.post("/pricing-rules/apply", json={"rule_ids": [rule_id], "product_ids": []})
+    assert r.status_code == 200, r.text
+    assert r.json()["updated"] == 0
+    assert (await db.get(Product, product_id)).selling_price == 1
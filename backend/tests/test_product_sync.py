@@ -0,0 +1,52 @@
+import pytest
+from sqlalchemy import text
+
+from app.core.database import engine
+from conftest import create_product
+
+pytestmark = pytest.mark.anyio
+
+
+async def drain(client, cursor=None):
+    """Recorre el feed hasta el final; devuelve los ids vistos y el cursor."""
+    seen = []
+    while True:
+        r = await client.get("/invoices/products/changes", params={"since": cursor} if cursor else {})
+        assert r.status_code == 200, r.text
+        body = r.json()
+        seen += [row[0] for row in body["upserts"]]
+        cursor = body["cursor"]
+        if not body["has_more"]:
+            return seen, cursor
+
+
+async def test_late_commit_is_not_skipped(client):
+    slow_id = await create_product(client)
+    fast_id = await create_product(client)
+    _, cursor = await drain(client)
+
+    # Transacción larga: escribe primero y hace commit al final
+    async with engine.connect() as slow:
+        await slow.execute(text("UPDATE products SET stock_quantity = 7 WHERE id = :id"), {"id": slow_id})
+        r = await client.put(f"/invoices/products/{fast_id}", json={"alias": "rapido"})
+        assert r.status_code == 200, r.text
+
+        # Mientras la transacción larga siga abierta, el cursor no la rebasa
+        seen, cursor = await drain(client, cursor)
+        assert slow_id not in seen
+        assert fast_id not in seen
+        await slow.commit()
+
+    seen, _ = await drain(client, cursor)
+    assert slow_id in seen
+    assert fast_id in seen
+
+
+async def test_deleted_product_appears_as_tombstone(client):
+    product_id = await create_product(client)
+    _, cursor = await drain(client)
+    r = await client.delete(f"/invoices/products/{product_id}")
+    assert r.status_code == 200, r.text
+
+    r = await client.get("/invoices/products/changes", params={"since": cursor})
+    assert product_id in r.json()["deleted"]
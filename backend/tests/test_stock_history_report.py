@@ -0,0 +1,24 @@
+import pytest
+
+from conftest import create_product, unique
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_search_treats_wildcards_literally(client):
+    tag = unique("hist")
+    literal_id = await create_product(client, name=f"{tag}_x", stock=5)
+    await create_product(client, name=f"{tag}ax", stock=5)
+
+    r = await client.get("/inventory/reports/stock-history", params={"q": f"{tag}_x"})
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert [item["product_id"] for item in body["items"]] == [literal_id]
+    # total: movimientos que cumplen el filtro, no todo el historial
+    assert body["total"] == 1
+
+
+async def test_total_is_optional(client):
+    r = await client.get("/inventory/reports/stock-history", params={"with_total": "false", "limit": 1})
+    assert r.status_code == 200, r.text
+    assert r.json()["total"] is None
@@ -0,0 +1,52 @@
+import pytest
+from sqlalchemy import select
+
+from app.domain.models import Product, StockHistory
+from app.services.stock_reconciliation import RECONCILIATION_SOURCE
+from conftest import create_location, create_product
+
+pytestmark = pytest.mark.anyio
+
+
+async def reconcile(client, product_ids, include_unlocated=False) -> int:
+    r = await client.post(
+        "/inventory/reports/reconciliation/apply",
+        json={"product_ids": product_ids, "include_unlocated": include_unlocated},
+    )
+    assert r.status_code == 200, r.text
+    return r.json()["adjusted"]
+
+
+async def adjustments(db, product_id) -> list:
+    rows = await db.execute(
+        select(StockHistory.change_type, StockHistory.old_value, StockHistory.new_value).where(
+            StockHistory.product_id == product_id, StockHistory.source == RECONCILIATION_SOURCE
+        )
+    )
+    return [tuple(r) for r in rows.all()]
+
+
+async def stock(db, product_id) -> int:
+    return (await db.execute(select(Product.stock_quantity).where(Product.id == product_id))).scalar()
+
+
+async def test_apply_sets_stock_to_shelves(client, db):
+    location_id = await create_location(client)
+    located = await create_product(client, stock=10)
+    unlocated = await create_product(client, stock=4)
+    r = await client.post(f"/locations/{location_id}/products", json={"product_id": located, "quantity": 7})
+    assert r.status_code == 200, r.text
+
+    assert await reconcile(client, [located, unlocated]) == 1
+    assert await stock(db, located) == 7
+    assert await adjustments(db, located) == [("AJUSTE", 10, 7)]
+
+    # Sin anaquel asignado solo se ajusta si se pide explícitamente
+    assert await stock(db, unlocated) == 4
+    assert await adjustments(db, unlocated) == []
+    assert await reconcile(client, [unlocated], include_unlocated=True) == 1
+    assert await stock(db, unlocated) == 0
+    assert await adjustments(db, unlocated) == [("AJUSTE", 4, 0)]
+
+    # Ya conciliados: no hay nada más que ajustar
+    assert await reconcile(client, [located, unlocated], include_unlocated=True) == 0
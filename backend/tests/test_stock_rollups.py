@@ -0,0 +1,96 @@
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import select, text
+
+from app.domain.models import PriceHistory, PriceHistoryMonthly, StockDailyRollup, StockHistory
+from app.services.history_partitions import create_partition, partition_name
+from app.services.stock_rollups import add_stock_history
+from conftest import create_product
+
+pytestmark = pytest.mark.anyio
+
+OLD_MONTH = date(2001, 1, 1)
+ARCHIVE = partition_name("stock_history", OLD_MONTH)
+PRICE_ARCHIVE = partition_name("price_history", OLD_MONTH)
+
+
+async def drop_archive(db):
+    await db.execute(text(f"DROP TABLE IF EXISTS {ARCHIVE}"))
+    await db.execute(text(f"DROP TABLE IF EXISTS {PRICE_ARCHIVE}"))
+    await db.execute(StockDailyRollup.__table__.delete().where(StockDailyRollup.day < date(2001, 2, 1)))
+    await db.execute(PriceHistoryMonthly.__table__.delete().where(PriceHistoryMonthly.month < date(2001, 2, 1)))
+    await db.commit()
+
+
+async def test_rebuild_keeps_archived_months(client, db):
+    await drop_archive(db)
+    product_id = await create_product(client)
+    try:
+        assert await create_partition(db, "stock_history", OLD_MONTH)
+        await add_stock_history(db, [StockHistory(
+            product_id=product_id,
+            change_type="ENTRADA",
+            old_value=0,
+            new_value=4,
+            source="prueba",
+            date=datetime(2001, 1, 15),
+        )])
+        await db.commit()
+
+        r = await client.post("/inventory/reports/history-maintenance", params={"retention_months": 12})
+        assert r.status_code == 200, r.text
+        assert ARCHIVE in r.json()["detached"]
+
+        r = await client.post("/inventory/reports/stock-trends/rebuild")
+        assert r.status_code == 200, r.text
+        assert r.json()["since"] == "2001-02-01"
+        kept = (
+            await db.execute(
+                select(StockDailyRollup.qty_in).where(
+                    StockDailyRollup.product_id == product_id, StockDailyRollup.day == date(2001, 1, 15)
+                )
+            )
+        ).scalar()
+        assert kept == 4
+
+        # Reconstruir desde antes del archivo borraría ese resumen
+        r = await client.post("/inventory/reports/stock-trends/rebuild", params={"since": "2000-12-01"})
+        assert r.status_code == 400
+    finally:
+        await db.rollback()
+        await drop_archive(db)
+
+
+async def test_delete_product_with_archived_history(client, db):
+    await drop_archive(db)
+    product_id = await create_product(client)
+    try:
+        assert await create_partition(db, "stock_history", OLD_MONTH)
+        assert await create_partition(db, "price_history", OLD_MONTH)
+        await add_stock_history(db, [StockHistory(
+            product_id=product_id,
+            change_type="ENTRADA",
+            old_value=0,
+            new_value=4,
+            source="prueba",
+            date=datetime(2001, 1, 15),
+        )])
+        db.add(PriceHistory(
+            product_id=product_id, change_type="PRECIO", old_value=10, new_value=12, date=datetime(2001, 1, 15)
+        ))
+        await db.commit()
+
+        r = await client.post("/inventory/reports/history-maintenance", params={"retention_months": 12})
+        assert r.status_code == 200, r.text
+        assert {ARCHIVE, PRICE_ARCHIVE} <= set(r.json()["detached"])
+
+        r = await client.delete(f"/invoices/products/{product_id}")
+        assert r.status_code == 200, r.text
+
+        # El archivo conserva el historial del producto borrado
+        archived = (await db.execute(text(f"SELECT count(*) FROM {PRICE_ARCHIVE} WHERE product_id = :id"), {"id": product_id})).scalar()
+        assert archived == 1
+    finally:
+        await db.rollback()
+        await drop_archive(db)
@@ -0,0 +1,89 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+
+from app.domain.models import ImportBatch, ImportBatchItem, SupplierMonthlySpend
+from app.main import AsyncSessionLocal
+from app.services.supplier_spend import refresh_supplier_spend
+from conftest import create_product, create_supplier
+
+pytestmark = pytest.mark.anyio
+
+
+async def add_batch(db, supplier_id: int, product_id: int, created_at: datetime, unit_cost: float) -> int:
+    batch = ImportBatch(filename="prueba.xml", supplier_id=supplier_id, created_at=created_at)
+    batch.items = [ImportBatchItem(product_id=product_id, quantity=2, unit_cost=unit_cost)]
+    db.add(batch)
+    await db.flush()
+    return batch.id
+
+
+async def test_delete_supplier_with_batches(client, db):
+    supplier_id = await create_supplier(client)
+    product_id = await create_product(client)
+    batch_id = await add_batch(db, supplier_id, product_id, datetime(2025, 3, 10), 10.0)
+    await refresh_supplier_spend(db, supplier_id)
+    await db.commit()
+
+    r = await client.delete(f"/suppliers/{supplier_id}")
+    assert r.status_code == 200, r.text
+
+    db.expire_all()
+    assert (await db.get(ImportBatch, batch_id)).supplier_id is None
+    spend = await db.execute(select(SupplierMonthlySpend).where(SupplierMonthlySpend.supplier_id == supplier_id))
+    assert spend.first() is None
+
+
+async def test_spend_refresh_updates_later_months(client, db):
+    supplier_id = await create_supplier(client)
+    product_id = await create_product(client)
+    await add_batch(db, supplier_id, product_id, datetime(2025, 1, 10), 10.0)
+    await add_batch(db, supplier_id, product_id, datetime(2025, 3, 10), 12.0)
+    await refresh_supplier_spend(db, supplier_id)
+    await db.commit()
+
+    # Compra intermedia en febrero: marzo ahora compara contra 11, no contra 10
+    await add_batch(db, supplier_id, product_id, datetime(2025, 2, 10), 11.0)
+    await refresh_supplier_spend(db, supplier_id, datetime(2025, 2, 1).date())
+    await db.commit()
+
+    S = SupplierMonthlySpend
+    rows = (
+        await db.execute(
+            select(S.month, S.cost_change_lines, S.cost_change_sum)
+            .where(S.supplier_id == supplier_id)
+            .order_by(S.month)
+        )
+    ).all()
+    assert [(r.month.month, r.cost_change_lines) for r in rows] == [(1, 0), (2, 1), (3, 1)]
+    assert rows[2].cost_change_sum == pytest.approx(1 / 11)
+
+
+async def test_concurrent_spend_refreshes_do_not_collide(client, db):
+    supplier_id = await create_supplier(client)
+    product_id = await create_product(client)
+    await add_batch(db, supplier_id, product_id, datetime(2025, 5, 10), 10.0)
+    await db.commit()
+
+    # Dos cargas del mismo proveedor recalculan a la vez; la segunda espera
+    async with AsyncSessionLocal() as first, AsyncSessionLocal() as second:
+        await refresh_supplier_spend(first, supplier_id)
+        waiting = asyncio.create_task(refresh_supplier_spend(second, supplier_id))
+        await asyncio.sleep(0.3)
+        assert not waiting.done()
+        await first.commit()
+        await waiting
+        await second.commit()
+
+    spend = await db.execute(select(SupplierMonthlySpend.batches).where(SupplierMonthlySpend.supplier_id == supplier_id))
+    assert spend.scalars().all() == [1]
+
+
+@pytest.mark.parametrize("value", ["-0.1", "1.5"])
+async def test_inference_rejects_confidence_out_of_range(client, value):
+    r = await client.get("/suppliers/inference", params={"min_confidence": value})
+    assert r.status_code == 422
+    r = await client.post("/suppliers/inference/apply", json={"min_confidence": float(value)})
+    assert r.status_code == 422
@@ -34,6 +34,7 @@ export function ProductDetailModal({ product, isAdmin, onClose, onDelete, onUpda
     const [showExitConfirm, setShowExitConfirm] = useState(false);
     const [showDeleteConfirm, setShowDeleteConfirm] = useState(false);
     const [history, setHistory] = useState<any[]>([]);
+    const [historyCursor, setHistoryCursor] = useState<string | null>(null);
     const [activeTab, setActiveTab] = useState<'general' | 'history' | 'shopping'>('general');
     const [showScanner, setShowScanner] = useState(false);
     const [showSettings, setShowSettings] = useState(false);
@@ -51,13 +52,26 @@ export function ProductDetailModal({ product, isAdmin, onClose, onDelete, onUpda
     // Cargar historial y proveedores al montar
     useEffect(() => {
         axios.get(`${API_URL}/invoices/products/${product.id}/history`)
-            .then(res => setHistory(res.data))
+            .then(res => {
+                setHistory(res.data.items);
+                setHistoryCursor(res.data.next_cursor);
+            })
             .catch(err => console.error("Error historial", err));
         axios.get(`${API_URL}/suppliers`)
             .then(res => setSuppliers(res.data))
             .catch(err => console.error("Error proveedores", err));
     }, [product.id]);
 
+    const loadMoreHistory = () => {
+        if (!historyCursor) return;
+        axios.get(`${API_URL}/invoices/products/${product.id}/history`, { params: { cursor: historyCursor } })
+            .then(res => {
+                setHistory(prev => [...prev, ...res.data.items]);
+                setHistoryCursor(res.data.next_cursor);
+            })
+            .catch(err => console.error("Error historial", err));
+    };
+
     const handlePrint = usePrintLabel(labelRef, product.alias || product.name);
 
     // Lógica simplificada de "Hay cambios sin guardar"
@@ -409,7 +423,7 @@ export function ProductDetailModal({ product, isAdmin, onClose, onDelete, onUpda
                     )}
 
                     {activeTab === 'history' && (
-                        <HistoryList history={history} />
+                        <HistoryList history={history} onLoadMore={historyCursor ? loadMoreHistory : undefined} />
                     )}
 
                     {activeTab === 'shopping' && (
@@ -585,7 +599,7 @@ const ShoppingTab = ({ product, editSupplierId, suppliers, addQty, setAddQty, ad
 };
 
 // Historial
-const HistoryList = ({ history }: { history: any[] }) => {
+const HistoryList = ({ history, onLoadMore }: { history: any[]; onLoadMore?: () => void }) => {
     if (history.length === 0) return <p className="text-center text-gray-400 py-10 italic text-sm">No hay historial de cambios.</p>;
     return (
         <div className="relative border-l-2 border-gray-200 dark:border-gray-700 ml-3 space-y-6 pb-4">
@@ -607,6 +621,14 @@ const HistoryList = ({ history }: { history: any[] }) => {
                     </div>
                 </div>
             ))}
+            {onLoadMore && (
+                <button
+                    onClick={onLoadMore}
+                    className="ml-6 text-xs font-bold text-blue-600 dark:text-blue-400 hover:underline"
+                >
+                    Ver más cambios
+                </button>
+            )}
         </div>
     );
 };
\ No newline at end of file